@@ -0,0 +1,171 @@
+import numpy as np
+
+
+# Pinhole camera with the 8-coefficient rational lens distortion
+# (d1, d2, t1, t2, d3, d4, d5, d6), the same order as OpenCV's (k1, k2, p1, p2, k3, k4, k5, k6):
+#
+#   r_dist = (1 + d1*r^2 + d2*r^4 + d3*r^6) / (1 + d4*r^2 + d5*r^4 + d6*r^6)
+#   x' = x*r_dist + 2*t1*x*y + t2*(r^2 + 2*x^2)
+#   y' = y*r_dist + 2*t2*x*y + t1*(r^2 + 2*y^2)
+#
+# Every method takes arrays of points, (N, 3) world / camera points or (N, 2) pixels,
+# and works on whole columns at once, so there is no per-point Python loop.
+class Camera(object):
+    def __init__(self, K, R, t, distortion=None):
+        # K: 3x3 intrinsic matrix, R: 3x3 rotation and t: 3-vector translation (world -> camera),
+        # distortion: up to 8 coefficients (d1, d2, t1, t2, d3, d4, d5, d6), missing ones are 0
+        self.K = np.asarray(K, dtype=np.float64).reshape(3, 3)
+        self.R = np.asarray(R, dtype=np.float64).reshape(3, 3)
+        self.t = np.asarray(t, dtype=np.float64).reshape(3)
+        self.distortion = np.zeros(8)
+        if distortion is not None:
+            distortion = np.asarray(distortion, dtype=np.float64).ravel()
+            self.distortion[:len(distortion)] = distortion
+        self.R_inv = np.linalg.inv(self.R)
+
+    @property
+    def has_distortion(self):
+        return bool(np.any(self.distortion))
+
+    def world_to_camera(self, points):
+        # (N, 3) world points -> (N, 3) camera coordinates
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        return points.dot(self.R.T) + self.t
+
+    def camera_to_world(self, points):
+        # (N, 3) camera coordinates -> (N, 3) world points
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        return (points - self.t).dot(self.R_inv.T)
+
+    def _distort(self, x, y, jacobian=False):
+        # Distorted (x', y') of normalised columns x, y, and if jacobian the partial
+        # derivatives (dx'/dx, dx'/dy, dy'/dx, dy'/dy)
+        d1, d2, t1, t2, d3, d4, d5, d6 = self.distortion
+        x2 = x * x
+        y2 = y * y
+        xy2 = 2. * x * y
+        r2 = x2 + y2
+        a = 1. + r2 * (d1 + r2 * (d2 + r2 * d3))
+        b = 1. + r2 * (d4 + r2 * (d5 + r2 * d6))
+        r_dist = a / b
+        xd = x * r_dist + t1 * xy2 + t2 * (r2 + 2. * x2)
+        yd = y * r_dist + t2 * xy2 + t1 * (r2 + 2. * y2)
+        if not jacobian:
+            return xd, yd
+        # d(r_dist)/d(r^2)
+        g = ((d1 + r2 * (2. * d2 + 3. * d3 * r2)) * b -
+             (d4 + r2 * (2. * d5 + 3. * d6 * r2)) * a) / (b * b)
+        cross = xy2 * g
+        j_xx = r_dist + 2. * x2 * g + 2. * t1 * y + 6. * t2 * x
+        j_xy = cross + 2. * t1 * x + 2. * t2 * y
+        j_yx = cross + 2. * t2 * y + 2. * t1 * x
+        j_yy = r_dist + 2. * y2 * g + 2. * t2 * x + 6. * t1 * y
+        return xd, yd, (j_xx, j_xy, j_yx, j_yy)
+
+    def distort(self, xy):
+        # (N, 2) normalised image coordinates (x/z, y/z) -> distorted normalised coordinates
+        xy = np.atleast_2d(np.asarray(xy, dtype=np.float64))
+        if not self.has_distortion:
+            return xy.copy()
+        out = np.empty_like(xy)
+        out[:, 0], out[:, 1] = self._distort(xy[:, 0], xy[:, 1])
+        return out
+
+    def undistort(self, xy, max_iter=20, tol=1e-10):
+        # (N, 2) distorted normalised coordinates -> undistorted ones, the inverse of distort.
+        # Newton iterations on all points at once, starting from the distorted point, each
+        # iteration only on the points not converged yet. Points without an inverse in the
+        # monotonic part of the lens model (beyond the radius where it folds back) give NaN
+        xy = np.atleast_2d(np.asarray(xy, dtype=np.float64))
+        if not self.has_distortion:
+            return xy.copy()
+        out = xy.copy()
+        active = np.flatnonzero(np.all(np.isfinite(xy), axis=1))
+        xd = xy[active, 0]
+        yd = xy[active, 1]
+        x = xd.copy()
+        y = yd.copy()
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for _ in range(max_iter):
+                fx, fy, (j_xx, j_xy, j_yx, j_yy) = self._distort(x, y, jacobian=True)
+                ex = fx - xd
+                ey = fy - yd
+                det = j_xx * j_yy - j_xy * j_yx
+                x -= (j_yy * ex - j_xy * ey) / det
+                y -= (j_xx * ey - j_yx * ex) / det
+                out[active, 0] = x
+                out[active, 1] = y
+                # converged points drop out, so do points whose iterate left the monotonic part
+                # of the model (they are rejected below) and NaN residuals, which compare False
+                keep = (ex * ex + ey * ey >= tol * tol) & (det > 0)
+                if not keep.any():
+                    break
+                active, xd, yd, x, y = active[keep], xd[keep], yd[keep], x[keep], y[keep]
+
+            x = out[:, 0]
+            y = out[:, 1]
+            fx, fy, (j_xx, j_xy, j_yx, j_yy) = self._distort(x, y, jacobian=True)
+            d1, d2, _, _, d3, d4, d5, d6 = self.distortion
+            r2 = x * x + y * y
+            r_dist = ((1. + r2 * (d1 + r2 * (d2 + r2 * d3))) /
+                      (1. + r2 * (d4 + r2 * (d5 + r2 * d6))))
+            ok = (((fx - xy[:, 0]) ** 2 + (fy - xy[:, 1]) ** 2 < 100. * tol * tol) &
+                  (j_xx * j_yy - j_xy * j_yx > 0) & (r_dist > 0))
+        out[~ok] = np.nan
+        return out
+
+    def normalized_to_pixel(self, xy):
+        # (N, 2) normalised image coordinates -> (N, 2) pixels, through K
+        xy = np.atleast_2d(np.asarray(xy, dtype=np.float64))
+        K = self.K
+        uv = np.empty_like(xy)
+        uv[:, 0] = K[0, 0] * xy[:, 0] + K[0, 1] * xy[:, 1] + K[0, 2]
+        uv[:, 1] = K[1, 1] * xy[:, 1] + K[1, 2]
+        return uv
+
+    def pixel_to_normalized(self, uv):
+        # (N, 2) pixels -> (N, 2) normalised image coordinates, through K^-1
+        uv = np.atleast_2d(np.asarray(uv, dtype=np.float64))
+        K = self.K
+        xy = np.empty_like(uv)
+        xy[:, 1] = (uv[:, 1] - K[1, 2]) / K[1, 1]
+        xy[:, 0] = (uv[:, 0] - K[0, 2] - K[0, 1] * xy[:, 1]) / K[0, 0]
+        return xy
+
+    def project(self, points):
+        # (N, 3) world points -> (N, 2) distorted pixels;
+        # points on or behind the camera plane (z <= 0) give NaN
+        cam = self.world_to_camera(points)
+        z = cam[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xy = cam[:, :2] / z[:, None]
+        xy[z <= 0] = np.nan
+        return self.normalized_to_pixel(self.distort(xy))
+
+    def pixel_to_ray(self, pixels):
+        # (N, 2) distorted pixels -> (N, 3) rays (x, y, 1) in camera coordinates, distortion removed
+        xy = self.undistort(self.pixel_to_normalized(pixels))
+        rays = np.empty((len(xy), 3))
+        rays[:, :2] = xy
+        rays[:, 2] = 1.
+        return rays
+
+    def unproject(self, pixels, depth):
+        # (N, 2) distorted pixels and their depth along the camera z axis (scalar or (N,)) -> (N, 3) world points
+        depth = np.asarray(depth, dtype=np.float64).reshape(-1, 1)
+        return self.camera_to_world(self.pixel_to_ray(pixels) * depth)
+
+    def undistort_map(self, width, height, K_new=None):
+        # Lookup map of a (height, width) undistorted image for cv2.remap: (map_x, map_y)
+        # float32 arrays holding, for every output pixel, its source pixel in the distorted
+        # image. The output image has the intrinsics K_new (default: the camera's K)
+        K_new = self.K if K_new is None else np.asarray(K_new, dtype=np.float64).reshape(3, 3)
+        v, u = np.mgrid[0:height, 0:width].astype(np.float64)
+        y = (v - K_new[1, 2]) / K_new[1, 1]
+        x = (u - K_new[0, 2] - K_new[0, 1] * y) / K_new[0, 0]
+        if self.has_distortion:
+            x, y = self._distort(x, y)
+        K = self.K
+        map_x = (K[0, 0] * x + K[0, 1] * y + K[0, 2]).astype(np.float32)
+        map_y = (K[1, 1] * y + K[1, 2]).astype(np.float32)
+        return map_x, map_y
@@ -0,0 +1,44 @@
+import numpy as np
+from camera import Camera
+
+
+# Define the camera parameters for Camera 1
+K1 = np.matrix([
+    [726.012573, 0.000000, 615.539917],
+    [0.000000, 724.575256, 523.566040],
+    [0.000000, 0.000000, 1.000000],
+])
+
+r1 = np.matrix([
+    [-0.262846, -0.012075, 0.964762],
+    [-0.006363, -0.999878, -0.014248],
+    [0.964817, -0.009883, 0.262737],
+])
+
+t1 = np.matrix([-3.506606, 128.004700, 168.618835])
+
+distortion1 = np.array([-0.361906, 0.179266, -0.000213, 0.001141, -0.054861, 0, 0, 0])
+
+
+
+# Define the camera parameters for Camera 2
+K2 = np.matrix([
+    [729.434204, 0.000000, 605.735596],
+    [0.000000, 728.705566, 511.485962],
+    [0.000000, 0.000000, 1.000000],
+])
+
+r2 = np.matrix([
+    [0.108824, 0.005068, 0.994048],
+    [-0.052556, -0.998559, 0.010845],
+    [0.992671, -0.053423, -0.108402],
+])
+
+t2 = np.matrix([-0.255262, 129.808014, 177.681732])
+
+distortion2 = np.array([-0.366454, 0.227449, 0.000769, -0.000390, -0.127463, 0, 0, 0])
+
+# Cameras by the prefix of their frames (Hik_2_frame<i>.jpg, Hik_3_frame<i>.jpg)
+camera1 = Camera(K1, r1, t1, distortion1)
+camera2 = Camera(K2, r2, t2, distortion2)
+CAMERAS = {'Hik_2': camera1, 'Hik_3': camera2}
@@ -0,0 +1,150 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import argparse
+import numpy as np
+import cv2
+from hik_cameras import CAMERAS
+
+
+# Undistortion of camera frames with remap tables built once per
+# (K, distortion, image size, output K) and cached on disk as .npy:
+#
+#   undistort_cache/undistort_<key>_map1.npy   (H, W, 2) int16, integer source pixels
+#   undistort_cache/undistort_<key>_map2.npy   (H, W) uint16, interpolation table index
+#
+# The fixed-point maps (cv2.convertMaps) remap faster than float maps, and later
+# runs memory-map the files instead of evaluating the lens model on every pixel.
+
+# key -> (map1, map2) of the maps used by this process
+_MAPS = {}
+
+
+def map_key(camera, width, height, K_new=None):
+    # Hash of everything the remap tables depend on
+    K_new = camera.K if K_new is None else K_new
+    h = hashlib.sha1()
+    for array in (camera.K, camera.distortion, K_new):
+        h.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    h.update(np.array([width, height], dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def map_paths(cache_dir, key):
+    base = os.path.join(cache_dir, 'undistort_' + key)
+    return base + '_map1.npy', base + '_map2.npy'
+
+
+def _save_npy(path, array):
+    # Write to a temporary file and rename, so a reader never sees a partial map
+    tmp_path = '{}.{}.tmp.npy'.format(path[:-len('.npy')], os.getpid())
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def build_maps(camera, width, height, K_new=None):
+    # Fixed-point (map1, map2) remap tables of a camera, see Camera.undistort_map
+    map_x, map_y = camera.undistort_map(width, height, K_new)
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+def load_maps(camera, width, height, cache_dir='undistort_cache', K_new=None):
+    # Remap tables of a camera and image size: from this process, memory-mapped from
+    # cache_dir, or built and saved there
+    key = map_key(camera, width, height, K_new)
+    if key in _MAPS:
+        return _MAPS[key]
+    paths = map_paths(cache_dir, key)
+    if all(os.path.exists(path) for path in paths):
+        maps = tuple(np.load(path, mmap_mode='r') for path in paths)
+    else:
+        maps = build_maps(camera, width, height, K_new)
+        os.makedirs(cache_dir, exist_ok=True)
+        for path, array in zip(paths, maps):
+            _save_npy(path, array)
+    _MAPS[key] = maps
+    return maps
+
+
+def undistort_frames(frames, camera, cache_dir='undistort_cache', K_new=None,
+                     interpolation=cv2.INTER_LINEAR):
+    # Yield the undistorted frames of an iterable of images; the tables are looked up
+    # once per frame size, every frame is then a single cv2.remap
+    size = None
+    maps = None
+    for frame in frames:
+        if frame.shape[:2] != size:
+            size = frame.shape[:2]
+            maps = load_maps(camera, size[1], size[0], cache_dir, K_new)
+        yield cv2.remap(frame, maps[0], maps[1], interpolation)
+
+
+def iter_video(video_path):
+    # Frames of a video file, read one at a time
+    capture = cv2.VideoCapture(video_path)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def iter_images(image_paths):
+    for image_path in image_paths:
+        yield cv2.imread(image_path)
+
+
+def camera_name(path):
+    # Hik_2_frame2189.jpg -> Hik_2
+    match = re.match(r'(Hik_\d+)', os.path.basename(path))
+    return match.group(1) if match else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Undistort Hik camera frames with cached remap tables")
+    parser.add_argument('--input', required=True,
+                        help="Video file, or glob of images such as 'Hik_2_frame*.jpg'")
+    parser.add_argument('--output', required=True,
+                        help="Output video file (video input) or directory (image input)")
+    parser.add_argument('--camera', default=None, choices=sorted(CAMERAS),
+                        help="Camera of the frames (default: from the input file name)")
+    parser.add_argument('--cache_dir', default='undistort_cache', help="Directory of the cached remap tables")
+    args = parser.parse_args()
+
+    image_paths = sorted(glob.glob(args.input))
+    if not image_paths:
+        parser.error("no input matches {}".format(args.input))
+    is_video = len(image_paths) == 1 and not image_paths[0].lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))
+    name = args.camera or camera_name(image_paths[0])
+    if name not in CAMERAS:
+        parser.error("cannot tell the camera of {}, give --camera".format(image_paths[0]))
+
+    start_time = time.time()
+    n_frames = 0
+    if is_video:
+        capture = cv2.VideoCapture(image_paths[0])
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.
+        capture.release()
+        writer = None
+        for frame in undistort_frames(iter_video(image_paths[0]), CAMERAS[name], args.cache_dir):
+            if writer is None:
+                writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                         (frame.shape[1], frame.shape[0]))
+            writer.write(frame)
+            n_frames += 1
+        if writer is not None:
+            writer.release()
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        frames = undistort_frames(iter_images(image_paths), CAMERAS[name], args.cache_dir)
+        for image_path, frame in zip(image_paths, frames):
+            cv2.imwrite(os.path.join(args.output, os.path.basename(image_path)), frame)
+            n_frames += 1
+    elapsed = time.time() - start_time
+    rate = n_frames / elapsed if elapsed > 0 else 0.
+    print("Undistorted {} frames of {} in {:.1f} s, {:.1f} frames/sec.".format(n_frames, name, elapsed, rate))
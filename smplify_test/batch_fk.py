@@ -0,0 +1,98 @@
+"""
+Batched SMPL forward kinematics in NumPy.
+
+Computes the joint locations and global joint rotations of
+smpl_webuser.lbs.global_rigid_transformation for many poses in one call,
+for the places that only need the values and not chumpy derivatives.
+The kinematic tree is walked level by level, each level vectorised over
+frames and joints.
+"""
+
+import numpy as np
+
+
+def parents_from_kintree(kintree_table):
+    """Parent index of each joint, -1 for the root."""
+    id_to_col = dict((kintree_table[1, i], i) for i in range(kintree_table.shape[1]))
+    return np.array([-1] + [id_to_col[kintree_table[0, i]]
+                            for i in range(1, kintree_table.shape[1])])
+
+
+def kintree_levels(parents):
+    """Group the non-root joints by depth in the tree.
+    :returns: list of joint index arrays, the parents of a level are in the previous levels
+    """
+    depth = np.zeros(len(parents), dtype=int)
+    for i in range(1, len(parents)):
+        depth[i] = depth[parents[i]] + 1
+    return [np.where(depth == d)[0] for d in range(1, depth.max() + 1)]
+
+
+def batch_rodrigues(r):
+    """Rotation matrices of axis-angle vectors, ...x3 -> ...x3x3."""
+    r = np.asarray(r, dtype=np.float64)
+    shape = r.shape[:-1]
+    r = r.reshape(-1, 3)
+    theta = np.sqrt(np.sum(r**2, axis=1))
+    k = r / np.where(theta < 1e-8, 1., theta)[:, None]
+
+    K = np.zeros((len(r), 3, 3))
+    K[:, 0, 1] = -k[:, 2]
+    K[:, 0, 2] = k[:, 1]
+    K[:, 1, 0] = k[:, 2]
+    K[:, 1, 2] = -k[:, 0]
+    K[:, 2, 0] = -k[:, 1]
+    K[:, 2, 1] = k[:, 0]
+    R = (np.eye(3)[None] + np.sin(theta)[:, None, None] * K +
+         (1 - np.cos(theta))[:, None, None] * np.matmul(K, K))
+    return R.reshape(shape + (3, 3))
+
+
+def rest_joints(betas, Jdirs, J_template):
+    """Joints of the shaped rest pose.
+    :param betas: (F, n_betas) shape coefficients
+    :param Jdirs: 24x3xN joint shape directions, N >= n_betas
+    :param J_template: 24x3 template joints
+    :returns: (F, 24, 3) joints
+    """
+    betas = np.atleast_2d(np.asarray(betas, dtype=np.float64))
+    return J_template + np.einsum('jcb,fb->fjc', Jdirs[:, :, :betas.shape[1]], betas)
+
+
+def forward_kinematics(poses, J, parents, levels=None):
+    """Pose the skeleton of several frames.
+    :param poses: (F, 72) axis-angle poses (a single 72D pose is accepted)
+    :param J: (F, 24, 3) or (24, 3) rest joints
+    :param parents: parent index of each joint (see parents_from_kintree)
+    :param levels: optional kintree_levels(parents)
+    :returns: a tuple ((F, 24, 3) joints, (F, 24, 3, 3) global rotations)
+    """
+    if levels is None:
+        levels = kintree_levels(parents)
+    poses = np.atleast_2d(np.asarray(poses, dtype=np.float64))
+    n_frames = len(poses)
+    n = len(parents)
+    R = batch_rodrigues(poses.reshape(n_frames, n, 3))
+    J = np.broadcast_to(np.asarray(J, dtype=np.float64), (n_frames, n, 3))
+
+    G = np.empty_like(R)
+    t = np.empty((n_frames, n, 3))
+    G[:, 0] = R[:, 0]
+    t[:, 0] = J[:, 0]
+    for ids in levels:
+        p = parents[ids]
+        G[:, ids] = np.matmul(G[:, p], R[:, ids])
+        t[:, ids] = np.einsum('fjab,fjb->fja', G[:, p], J[:, ids] - J[:, p]) + t[:, p]
+    return t, G
+
+
+def smpl_joints(poses, betas, jdirs, parents, levels=None):
+    """Joints and global rotations of SMPL for several frames.
+    :param poses: (F, 72) axis-angle poses
+    :param betas: (F, n_betas) shape coefficients
+    :param jdirs: tuple (joint shape directions, template joints), see model_cache.compute_jdirs
+    :param parents: parent index of each joint (see parents_from_kintree)
+    :returns: a tuple ((F, 24, 3) joints, (F, 24, 3, 3) global rotations)
+    """
+    return forward_kinematics(poses, rest_joints(betas, jdirs[0], jdirs[1]),
+                              parents, levels)
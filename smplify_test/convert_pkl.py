@@ -1,197 +1,43 @@
 import os
+import re
 import pickle
 import json
+import hashlib
+import logging
 import numpy as np
-from smpl_webuser.serialization import load_model
-from smpl_webuser.verts import verts_decorated
-from smpl_webuser.lbs import global_rigid_transformation
-import chumpy as ch
 import cv2
+import batch_fk
+import model_cache
+import results_store
+import skeletons
 
-smpl_to_openpose_map = {
-    "Pelvis": "MidHip",
-    "L_Hip": "L_Hip",
-    "R_Hip": "R_Hip",
-    "SpineL": None, # SpineL doesn't map directly to Openpose
-    "L_Knee": "L_Knee",
-    "R_Knee": "R_Knee",
-    "SpineM": None, # SpineM doesn't map directly to Openpose
-    "L_Ankle": "L_Ankle",
-    "R_Ankle": "R_Ankle",
-    "SpineH": None, # SpineH doesn't map directly to Openpose
-    "L_Foot": None, # L_Foot doesn't map directly to Openpose
-    "R_Foot": None, # R_Foot doesn't map directly to Openpose
-    "Neck": "Neck",
-    "L_Collar": None, # L_Collar doesn't map directly to Openpose
-    "R_Collar": None, # R_Collar doesn't map directly to Openpose
-    "Head": None, # Head doesn't map directly to Openpose
-    "L_Shoulder": "L_Shoulder",
-    "R_Shoulder": "R_Shoulder",
-    "L_Elbow": "L_Elbow",
-    "R_Elbow": "R_Elbow",
-    "L_Wrist": "L_Wrist",
-    "R_Wrist": "R_Wrist",
-    "L_Hand": None, # L_Hand doesn't map directly to Openpose
-    "R_Hand": None  # R_Hand doesn't map directly to Openpose
-}
+_LOGGER = logging.getLogger(__name__)
+
+# result pickles of fit_3d_kist_robot_0508_seq1.py
+PKL_PATTERN = re.compile(r'^USB_Sync_Left_(\d+)\.pkl$')
 
 def load_pkl_file(file_path):
     with open(file_path, 'rb') as f:
         params = pickle.load(f)
     return params
 
-def extract_joint_positions(model, pose, betas, cam_t):
-    # Number of shape coefficients
-    n_betas = len(betas)
-
-    # Create SMPL model instance
-    sv = verts_decorated(
-        trans=ch.array(cam_t),
-        pose=ch.array(pose),
-        v_template=model.v_template,
-        J=model.J_regressor,
-        betas=ch.array(betas),
-        shapedirs=model.shapedirs[:, :, :n_betas],
-        weights=model.weights,
-        kintree_table=model.kintree_table,
-        bs_style=model.bs_style,
-        f=model.f,
-        bs_type=model.bs_type,
-        posedirs=model.posedirs)
-
-    # Compute the 3D joint positions
-    Jdirs = np.dstack([model.J_regressor.dot(model.shapedirs[:, :, i]) for i in range(n_betas)])
-    J_onbetas = ch.array(Jdirs).dot(ch.array(betas)) + model.J_regressor.dot(model.v_template.r)
-    _, A_global = global_rigid_transformation(ch.array(pose), J_onbetas, model.kintree_table, xp=ch)
-    joints_3d = np.vstack([g[:3, 3] for g in A_global])
-
-    return joints_3d
-
-
-
-
-
-def reorder_cam_t(cam_t, smpl_to_openpose_map):
-    # For cam_t, the mapping will be similar to joints since it represents translations
-    ordered_cam_t = [0.0, 0.0, 0.0]
-    # Map the cam_t translation values based on the mapping
-    for smpl_joint, openpose_joint in smpl_to_openpose_map.items():
-        if openpose_joint:
-            ordered_cam_t = cam_t
-    return ordered_cam_t
-
-def reorder_quaternions(quaternions, smpl_to_openpose_map):
-    # Create a list of default quaternion [0, 0, 0, 1] for OpenPose order
-    ordered_quaternions = [[0.0, 0.0, 0.0, 1.0] for _ in range(25)]
-    smpl_order = [
-        "Pelvis", "L_Hip", "R_Hip", "SpineL", "L_Knee", "R_Knee",
-        "SpineM", "L_Ankle", "R_Ankle", "SpineH", "L_Foot", "R_Foot",
-        "Neck", "L_Collar", "R_Collar", "Head", "L_Shoulder",
-        "R_Shoulder", "L_Elbow", "R_Elbow", "L_Wrist", "R_Wrist",
-        "L_Hand", "R_Hand"
-    ]
-
-    # Create a dictionary for easy access
-    quaternion_dict = {smpl_order[i]: quaternions[i] for i in range(len(smpl_order))}
-    
-    for openpose_index, openpose_name in enumerate(smpl_to_openpose_map.keys()):
-        smpl_name = smpl_to_openpose_map.get(openpose_name)
-        if smpl_name and smpl_name in quaternion_dict:
-            ordered_quaternions[openpose_index] = quaternion_dict[smpl_name]
-    
-    return ordered_quaternions
+def fit_joints(model, poses, betas, joint_cache=None):
+    # Joint positions and global rotations of one or more fits, (F, 24, 3) and (F, 24, 3, 3)
+    # joint_cache: model_cache.load_joint_cache of the model, computed here if None
+    if joint_cache is None:
+        joint_cache = model_cache.compute_joint_cache(model)
+    jdirs = (joint_cache['Jdirs'], joint_cache['J_template'])
+    return batch_fk.smpl_joints(poses, betas, jdirs, joint_cache['parents'])
 
-def reorder_betas(betas, smpl_to_openpose_map):
-    # Typically, betas are not reordered as they represent shape coefficients
-    # This function is added for the completeness of the request
-    ordered_betas = list(betas)  # Assuming betas don't need reordering
-    return ordered_betas
-
-
-
-
-def reorder_joints_deeprobot_to_openpose(joints):
-    # The mapping from DeepRobotJoint to Openpose order
-    reorder_map = {
-        0: 1,  # Neck -> Neck
-        1: 5,  # L_Shoulder -> L_Shoulder
-        2: 2,  # R_Shoulder -> R_Shoulder
-        3: 12, # L_Hip -> L_Hip
-        4: 9,  # R_Hip -> R_Hip
-        5: 6,  # L_Elbow -> L_Elbow
-        6: 3,  # R_Elbow -> R_Elbow
-        7: 13, # L_Knee -> L_Knee
-        8: 10, # R_Knee -> R_Knee
-        9: 7,  # L_Wrist -> L_Wrist
-        10: 4, # R_Wrist -> R_Wrist
-        11: 14, # L_Ankle -> L_Ankle
-        12: 11  # R_Ankle -> R_Ankle
-    }
-    
-    ordered_joints = [[0.0, 0.0, 0.0] for _ in range(25)]
-    for deep_index, openpose_index in reorder_map.items():
-        ordered_joints[openpose_index] = joints[deep_index]
-    
-    return ordered_joints
-
-def reorder_joints(joints):
-    # The mapping from SMPL to Openpose order
-    
-    openpose_order = [
-        "Nose", "Neck", "R_Shoulder", "R_Elbow", "R_Wrist", 
-        "L_Shoulder", "L_Elbow", "L_Wrist", "MidHip", "R_Hip", 
-        "R_Knee", "R_Ankle", "L_Hip", "L_Knee", "L_Ankle", 
-        "REye", "LEye", "REar", "LEar", "LBigToe", "LSmallToe", 
-        "LHeel", "RBigToe", "RSmallToe", "RHeel"
-    ]
-    
-    # Default value for joints that don't exist in the original data
-    default_joint = [0.0, 0.0, 0.0]
-    smpl_order = [
-        "Pelvis", "L_Hip", "R_Hip", "SpineL", "L_Knee", "R_Knee", 
-        "SpineM", "L_Ankle", "R_Ankle", "SpineH", "L_Foot", "R_Foot", 
-        "Neck", "L_Collar", "R_Collar", "Head", "L_Shoulder", 
-        "R_Shoulder", "L_Elbow", "R_Elbow", "L_Wrist", "R_Wrist", 
-        "L_Hand", "R_Hand"
-    ]
-    
-    # Create a dictionary for easy access
-    joints_dict = {smpl_order[i]: joints[i] for i in range(len(smpl_order))}
-    
-    ordered_joints = [default_joint] * 25
-    for openpose_index, openpose_name in enumerate(openpose_order):
-        smpl_name = smpl_to_openpose_map.get(openpose_name)
-        if smpl_name:
-            ordered_joints[openpose_index] = joints_dict[smpl_name]
-    
-    return ordered_joints
-
-def extract_joint_rotations(model, pose, betas):
-    # Number of shape coefficients
-    n_betas = len(betas)
-
-    # Create SMPL model instance
-    sv = verts_decorated(
-        trans=ch.zeros(3),
-        pose=ch.array(pose),
-        v_template=model.v_template,
-        J=model.J_regressor,
-        betas=ch.array(betas),
-        shapedirs=model.shapedirs[:, :, :n_betas],
-        weights=model.weights,
-        kintree_table=model.kintree_table,
-        bs_style=model.bs_style,
-        f=model.f,
-        bs_type=model.bs_type,
-        posedirs=model.posedirs)
+def extract_joint_positions(model, pose, betas, cam_t, joint_cache=None):
+    # Compute the 3D joint positions (in the model frame, cam_t is not applied)
+    joints_3d, _ = fit_joints(model, pose, betas, joint_cache)
+    return joints_3d[0]
 
+def extract_joint_rotations(model, pose, betas, joint_cache=None):
     # Compute the 3D joint rotations
-    Jdirs = np.dstack([model.J_regressor.dot(model.shapedirs[:, :, i]) for i in range(n_betas)])
-    J_onbetas = ch.array(Jdirs).dot(ch.array(betas)) + model.J_regressor.dot(model.v_template.r)
-    _, A_global = global_rigid_transformation(ch.array(pose), J_onbetas, model.kintree_table, xp=ch)
-    rotations = [g[:3, :3] for g in A_global]
-
-    return rotations
+    _, rotations = fit_joints(model, pose, betas, joint_cache)
+    return rotations[0]
 
 def quaternion_from_matrix(matrix):
     R = matrix[:3, :3]
@@ -220,168 +66,248 @@ def quaternion_from_matrix(matrix):
         q[k + 1] = (R[k, i] + R[i, k]) * t
     return q
 
-def create_json_files(input_dir, output_dir, model_path):
-    # Load SMPL model
-    model = load_model(model_path)
-
-    # Prepare JSON structures
-    pos_data = {
-        "Header": {
-            "Comment": [
-                "Hip: center of L_hip, R_hip",
-                "Only the first 15 joints are used among opose 25 joints",
-                "Set-F : Frame Index",
-                "Set-J : Joint Pos3D (x, y, z, confidence) in Opose25 type"
-            ],
-            "JOINT_NAMES": [
-                "Nose", "Neck", "RShoulder", "RElbow", "RWrist",
-                "LShoulder", "LElbow", "LWrist", "MidHip", "RHip",
-                "RKnee", "RAnkle", "LHip", "LKnee", "LAnkle", "REye",
-                "LEye", "REar", "LEar", "LBigToe", "LSmallToe", "LHeel",
-                "RBigToe", "RSmallToe", "RHeel"
-            ],
-            "NUM_FRAMES": 1378,
-            "NUM_JOINTS": 25,
-            "PARENT_IDS": [
-                1, 8, 1, 2, 3, 1, 5, 6, -1, 8, 9, 10, 8, 12, 13,
-                0, 0, 15, 16, 14, 19, 14, 11, 22, 11
-            ]
-        },
-        "Set": []
-    }
-
-    pose_data = {
-        "BoneNames": [
-            "Pelvis", "L_Hip", "L_Knee", "L_Ankle", "L_Foot", "R_Hip",
-            "R_Knee", "R_Ankle", "R_Foot", "SpineL", "SpineM", "SpineH",
-            "Neck", "Head", "L_Collar", "L_Shoulder", "L_Elbow",
-            "L_Wrist", "L_Hand", "R_Collar", "R_Shoulder", "R_Elbow",
-            "R_Wrist", "R_Hand"
-        ],
-        "BoneParents": [
-            -1, 0, 1, 2, 3, 0, 5, 6, 7, 0, 9, 10, 11, 12, 11, 14, 15,
-            16, 17, 11, 19, 20, 21, 22
+# JSON structures of the converted outputs
+POS_DATA = {
+    "Header": {
+        "Comment": [
+            "Hip: center of L_hip, R_hip",
+            "Only the first 15 joints are used among opose 25 joints",
+            "Set-F : Frame Index",
+            "Set-J : Joint Pos3D (x, y, z, confidence) in Opose25 type"
         ],
-        "_README": [
-            [ "// -----------------------------------------------" ],
-            [ "// --- Rotations in Quaternion (x,y,z,w)" ],
-            [ "// --- The coordinate system in OpenGL(x:left, y:up, z:forward)" ],
-            [ "// --- Each Rotation represents Global Transform of each bone" ],
-            [ "// --- GlobalTrans = GlobalTrans_parent * LocalTransform" ],
-            [ "// --- LocalTransform = inv(GlobalTrans_parent) * GlobalTrans" ],
-            [ "// --- pose_parameters: F = frame index" ],
-            [ "// --- pose_parameters: T = translation" ],
-            [ "// --- pose_parameters: R = rotations" ],
-            [ "// -----------------------------------------------" ]
+        "JOINT_NAMES": [
+            "Nose", "Neck", "RShoulder", "RElbow", "RWrist",
+            "LShoulder", "LElbow", "LWrist", "MidHip", "RHip",
+            "RKnee", "RAnkle", "LHip", "LKnee", "LAnkle", "REye",
+            "LEye", "REar", "LEar", "LBigToe", "LSmallToe", "LHeel",
+            "RBigToe", "RSmallToe", "RHeel"
         ],
-        "num_frames": 1378,
-        "pose_parameters": []
-    }
-
-    shape_data = {
-        "_README": [
-            [ "// -----------------------------------------------" ],
-            [ "// --- [shape_param_avg]: use this for the representative" ],
-            [ "// --- The current shape param values in cm scale." ],
-            [ "// --- The official SMPL uses meter scale." ],
-            [ "// --- num_frames: the number of frames" ],
-            [ "// --- [shape_param_frames][F]: frame index" ],
-            [ "// --- [shape_param_frames][S]: shape parameters" ],
-            [ "// -----------------------------------------------" ]
-        ],
-        "gender": "NEUTRAL",
-        "num_frames": 1378,
-        "shape_param_avg": [],
-        "shape_param_fit": {
-            "error_pose": 0.0,
-            "error_shape": 0.0,
-            "iter": 0,
-            "value": []
-        },
-        "shape_param_frames": []
-    }
-
-    # Process each pkl file in the directory
-
-    for frame_index in range(1370): # last frame
-        file_name = "USB_Sync_Left_{}.pkl".format(frame_index)
-        pkl_path = os.path.join(input_dir, file_name)    
-        params = load_pkl_file(pkl_path)
-
-        cam_t = np.array(params['cam_t'])
-        pose = np.array(params['pose'])
-        betas = np.array(params['betas'])
-
-        joints_3d = extract_joint_positions(model, pose, betas, cam_t)
-        ordered_joints_3d = reorder_joints(joints_3d)
-
-        #rotations = extract_joint_rotations(model, pose, betas)
-        #quaternions = [quaternion_from_matrix(rot) for rot in rotations]
-
-        # TODO
-        #ordered_cam_t, ordered_quaternions, ordered_betas = reorder_parameters(cam_t, quaternions, betas, smpl_to_openpose_map)        
-        #ordered_cam_t = reorder_cam_t(cam_t, smpl_to_openpose_map)
-        #ordered_quaternions = reorder_quaternions(quaternions, smpl_to_openpose_map)
-        #ordered_betas = reorder_betas(betas, smpl_to_openpose_map)
-
-        pos_entry = {
-            "F": frame_index,
-            "J": [list(joint) + [1.0] for joint in ordered_joints_3d]  # Assuming confidence is 1.0 for all joints
-        }
-        pos_data["Set"].append(pos_entry)
+        "NUM_FRAMES": 1378,
+        "NUM_JOINTS": 25,
+        "PARENT_IDS": [
+            1, 8, 1, 2, 3, 1, 5, 6, -1, 8, 9, 10, 8, 12, 13,
+            0, 0, 15, 16, 14, 19, 14, 11, 22, 11
+        ]
+    },
+    "Set": []
+}
 
-        #pose_entry = {
-        #    "F": frame_index,
-        #    "T": list(ordered_cam_t),
-        #    "R": [list(q) for q in ordered_quaternions]
-        #}
-        #pose_data["pose_parameters"].append(pose_entry)
+POSE_DATA = {
+    "BoneNames": [
+        "Pelvis", "L_Hip", "L_Knee", "L_Ankle", "L_Foot", "R_Hip",
+        "R_Knee", "R_Ankle", "R_Foot", "SpineL", "SpineM", "SpineH",
+        "Neck", "Head", "L_Collar", "L_Shoulder", "L_Elbow",
+        "L_Wrist", "L_Hand", "R_Collar", "R_Shoulder", "R_Elbow",
+        "R_Wrist", "R_Hand"
+    ],
+    "BoneParents": [
+        -1, 0, 1, 2, 3, 0, 5, 6, 7, 0, 9, 10, 11, 12, 11, 14, 15,
+        16, 17, 11, 19, 20, 21, 22
+    ],
+    "_README": [
+        [ "// -----------------------------------------------" ],
+        [ "// --- Rotations in Quaternion (x,y,z,w)" ],
+        [ "// --- The coordinate system in OpenGL(x:left, y:up, z:forward)" ],
+        [ "// --- Each Rotation represents Global Transform of each bone" ],
+        [ "// --- GlobalTrans = GlobalTrans_parent * LocalTransform" ],
+        [ "// --- LocalTransform = inv(GlobalTrans_parent) * GlobalTrans" ],
+        [ "// --- pose_parameters: F = frame index" ],
+        [ "// --- pose_parameters: T = translation" ],
+        [ "// --- pose_parameters: R = rotations" ],
+        [ "// -----------------------------------------------" ]
+    ],
+    "num_frames": 1378,
+    "pose_parameters": []
+}
 
-        #shape_entry = {
-        #    "F": frame_index,
-        #    "S": list(ordered_betas)
-        #}
-        #shape_data["shape_param_frames"].append(shape_entry)
+SHAPE_DATA = {
+    "_README": [
+        [ "// -----------------------------------------------" ],
+        [ "// --- [shape_param_avg]: use this for the representative" ],
+        [ "// --- The current shape param values in cm scale." ],
+        [ "// --- The official SMPL uses meter scale." ],
+        [ "// --- num_frames: the number of frames" ],
+        [ "// --- [shape_param_frames][F]: frame index" ],
+        [ "// --- [shape_param_frames][S]: shape parameters" ],
+        [ "// -----------------------------------------------" ]
+    ],
+    "gender": "NEUTRAL",
+    "num_frames": 1378,
+    "shape_param_avg": [],
+    "shape_param_fit": {
+        "error_pose": 0.0,
+        "error_shape": 0.0,
+        "iter": 0,
+        "value": []
+    },
+    "shape_param_frames": []
+}
 
-        
-        
-        pose = params['pose'].tolist()
-        betas = params['betas'].tolist()
+def discover_frames(input_dir, pattern=PKL_PATTERN):
+    # {frame index: pkl path} of the result pickles found in input_dir
+    frames = {}
+    for file_name in os.listdir(input_dir):
+        match = pattern.match(file_name)
+        if match:
+            frames[int(match.group(1))] = os.path.join(input_dir, file_name)
+    return frames
+
+def load_convert_cache(cache_path, model_sha1=None):
+    # {frame index: (stamp, sha1, ordered joints)} of a previous run; the joints depend
+    # on the SMPL model, so a cache of another model (or of unknown model) is dropped
+    if not os.path.exists(cache_path):
+        return {}
+    data = np.load(cache_path)
+    try:
+        if model_sha1 is not None and ('model_sha1' not in data or
+                                       str(data['model_sha1']) != model_sha1):
+            _LOGGER.info('`%s` was built with another model, converting every frame again.',
+                         cache_path)
+            return {}
+        return dict((int(i), (stamp, str(sha1), joints)) for i, stamp, sha1, joints in
+                    zip(data['frames'], data['stamps'], data['sha1'], data['joints']))
+    finally:
+        data.close()
+
+def save_convert_cache(cache_path, cache, model_sha1):
+    frames = sorted(cache)
+    model_cache.save_npz(cache_path, {
+        'model_sha1': np.array(model_sha1),
+        'frames': np.array(frames, dtype=np.int64),
+        'stamps': np.array([cache[i][0] for i in frames]).reshape(-1, 2),
+        'sha1': np.array([cache[i][1] for i in frames]),
+        'joints': np.array([cache[i][2] for i in frames]).reshape(-1, 25, 3)})
+
+def changed_frames(frame_stamps, cache, sha1_fn):
+    # Frames whose source changed since the cached run, compared by stamp then by SHA-1
+    # returns a dict {frame index: sha1} of the frames to convert again
+    changed = {}
+    for i, stamp in sorted(frame_stamps.items()):
+        entry = cache.get(i)
+        if entry is not None and np.array_equal(entry[0], stamp):
+            continue
+        sha1 = sha1_fn(i)
+        if entry is not None and entry[1] == sha1:
+            # touched but unchanged
+            cache[i] = (stamp, sha1, entry[2])
+            continue
+        changed[i] = sha1
+    return changed
+
+def store_sources(store):
+    # Stamps and params of the frames of a results_store, a row is identified by its content
+    # (NaN stamps never match, so changed_frames always compares the digests)
+    sources = {}
+    for i in store.frames():
+        params = store.get(i)
+        digest = hashlib.sha1(np.concatenate(
+            [params['cam_t'], params['pose'], params['betas']]).tobytes()).hexdigest()
+        sources[int(i)] = (np.array([np.nan, np.nan]), digest, params)
+    return sources
+
+def write_pos_json(path, frames, joints):
+    # Stream pos_smplify.json, one "Set" entry per line, renamed into place once complete
+    header = dict(POS_DATA["Header"])
+    header["NUM_FRAMES"] = len(frames)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('{\n    "Header": %s,\n    "Set": [' % json.dumps(header))
+        for n, (frame_index, frame_joints) in enumerate(zip(frames, joints)):
+            # Assuming confidence is 1.0 for all joints
+            entry = {"F": int(frame_index),
+                     "J": [[float(x), float(y), float(z), 1.0] for x, y, z in frame_joints]}
+            f.write('%s\n        %s' % (',' if n else '', json.dumps(entry)))
+        f.write('\n    ]\n}\n')
+    os.rename(tmp_path, path)
+
+def create_json_files(input_dir, output_dir, model_path, force=False):
+    # Convert the fits of input_dir (USB_Sync_Left_<i>.pkl files or a results_store folder)
+    # to pos_smplify.json and param_smplify_<i>.json. Only frames that are new or changed
+    # since the last run are loaded and converted, their joints are cached in
+    # output_dir/convert_cache.npz with the SHA-1 of the model they were computed with;
+    # force, or another model, converts every frame again.
+    joint_cache = model_cache.load_joint_cache(model_path)
+    model_sha1 = str(joint_cache['sha1'])
+    cache_path = os.path.join(output_dir, 'convert_cache.npz')
+    cache = {} if force else load_convert_cache(cache_path, model_sha1)
+
+    if os.path.exists(os.path.join(input_dir, 'meta.json')):
+        sources = store_sources(results_store.ResultStore(input_dir))
+        frame_stamps = dict((i, source[0]) for i, source in sources.items())
+        changed = changed_frames(frame_stamps, cache, lambda i: sources[i][1])
+
+        def load_params(i):
+            return sources[i][2]
+    else:
+        pkl_paths = discover_frames(input_dir)
+        frame_stamps = dict((i, model_cache.file_stamp(path)) for i, path in pkl_paths.items())
+        changed = changed_frames(frame_stamps, cache, lambda i: model_cache.file_sha1(pkl_paths[i]))
+
+        def load_params(i):
+            return load_pkl_file(pkl_paths[i])
+
+    # frames whose source disappeared are dropped
+    for i in set(cache) - set(frame_stamps):
+        del cache[i]
+    _LOGGER.info('%d frames in `%s`, %d new or changed.', len(frame_stamps), input_dir, len(changed))
+
+    frame_ids = []
+    poses = []
+    betas = []
+    for frame_index in sorted(changed):
+        try:
+            params = load_params(frame_index)
+        except Exception as e:
+            # a broken pickle only loses its own frame
+            _LOGGER.warn('Skipping frame %d: %s', frame_index, e)
+            cache.pop(frame_index, None)
+            continue
+        frame_ids.append(frame_index)
+        poses.append(np.ravel(params['pose']))
+        betas.append(np.ravel(params['betas']))
 
         params = {
-            'pose': pose,
-            'betas': betas
+            'pose': np.ravel(params['pose']).tolist(),
+            'betas': np.ravel(params['betas']).tolist()
         }
-
         json_path = os.path.join(output_dir, 'param_smplify_{}.json'.format(frame_index))
         with open(json_path, 'w') as f:
-            json.dump(params, f, indent=4)
-
-    # Calculate average shape parameters
-    #all_shapes = np.array([frame["S"] for frame in shape_data["shape_param_frames"]])
-    #shape_data["shape_param_avg"] = list(np.mean(all_shapes, axis=0))
-
-    # Save JSON files
-    with open(os.path.join(output_dir, 'pos_smplify.json'), 'w') as f:
-        json.dump(pos_data, f, indent=4)
-
-    #with open(os.path.join(output_dir, 'pose_smplify.json'), 'w') as f:
-    #    json.dump(pose_data, f, indent=4)
-
-    #with open(os.path.join(output_dir, 'shape_smplify.json'), 'w') as f:
-    #    json.dump(shape_data, f, indent=4)
-
-
-# Specify the input and output directories
-input_dir = 'Seq1'
-output_dir = 'output'
-#model_path = 'path_to_smpl_model.pkl'  # Replace with the path to your SMPL model
-model_path = 'models/basicModel_neutral_lbs_10_207_0_v1.0.0.pkl'  # replace with the path to your SMPL model
-
-# Create output directory if it doesn't exist
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
-
-# Generate the JSON files
-create_json_files(input_dir, output_dir, model_path)
+            json.dump(params, f)
+
+    if frame_ids:
+        # forward kinematics of all the converted frames at once
+        joints_3d, _ = fit_joints(None, np.array(poses), np.array(betas), joint_cache)
+        ordered_joints = skeletons.remap(joints_3d, 'smpl24', 'openpose25')
+        for frame_index, ordered_joints_3d in zip(frame_ids, ordered_joints):
+            cache[frame_index] = (frame_stamps[frame_index], changed[frame_index], ordered_joints_3d)
+    save_convert_cache(cache_path, cache, model_sha1)
+
+    frames = sorted(cache)
+    write_pos_json(os.path.join(output_dir, 'pos_smplify.json'), frames,
+                   [cache[i][2] for i in frames])
+    return len(frame_ids)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='convert SMPLify fits to pos_smplify.json')
+    # Specify the input and output directories
+    parser.add_argument('--input_dir', default='Seq1',
+                        help="folder of USB_Sync_Left_<i>.pkl files or a results_store folder")
+    parser.add_argument('--output_dir', default='output')
+    parser.add_argument('--model', default='models/basicModel_neutral_lbs_10_207_0_v1.0.0.pkl',
+                        help="SMPL model file")
+    parser.add_argument('--force', default=False, action='store_true',
+                        help="Convert every frame again, not only new or changed ones.")
+    args = parser.parse_args()
+
+    # Create output directory if it doesn't exist
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # Generate the JSON files
+    n_converted = create_json_files(args.input_dir, args.output_dir, args.model, args.force)
+    _LOGGER.info('Converted %d frames.', n_converted)
 
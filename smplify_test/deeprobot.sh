@@ -3,29 +3,10 @@
 # Data 폴더의 이름을 변수로 설정
 DATA_FOLDER="Set1_V6"
 
-# f_1800부터 f_3600까지의 프레임 인덱스를 반복합니다.
-#for i in $(seq 1800 3600)
-#for i in $(seq 1800 1800)
-for i in $(seq 2100 2350)
-do
-    # 파일 복사 및 이름 변경
-    cp -f "${DATA_FOLDER}/f_${i}_0_resize.jpg" "input.jpg"
-    cp -f "${DATA_FOLDER}/f_${i}_1_joint_pos.json" "input_joints.json"
-    cp -f "${DATA_FOLDER}/f_${i}_2_confid.json" "input_conf.json"
-
-    # Python 스크립트 실행
-    python fit_3d_robot.py --out_dir ./
-
-    # 생성된 파일들을 Data 폴더로 이동 및 이름 변경
-    mv -f "output_jtr.json" "${DATA_FOLDER}/f_${i}_3_joint_3d_smplify1.json"
-    mv -f "output_jtr2.json" "${DATA_FOLDER}/f_${i}_3_joint_3d_smplify2.json"
-    mv -f "output_jtr3.json" "${DATA_FOLDER}/f_${i}_3_joint_3d_smplify3.json"
-    mv -f "output_jtr4.json" "${DATA_FOLDER}/f_${i}_3_joint_3d_smplify4.json"
-    mv -f "output.png" "${DATA_FOLDER}/f_${i}_4_output_smplify.png"
-    mv -f "output.pkl" "${DATA_FOLDER}/f_${i}_4_output_smplify.pkl"
-    mv -f "output.json" "${DATA_FOLDER}/f_${i}_4_output_smplify.json"
-
-    # 현재 디렉토리의 임시 파일들을 정리
-    rm input.jpg input_joints.json input_conf.json
-done
-
+# f_2100부터 f_2350까지의 프레임 작업을 fitting 서버 하나에 전달합니다.
+# 모델과 prior는 한 번만 로드되고, 결과는 Data 폴더에 바로 저장됩니다:
+#   f_${i}_3_joint_3d_smplify{1,2,3,4}.json, f_${i}_4_output_smplify.{png,pkl,json}
+# 이미 .pkl이 있는 프레임은 건너뜁니다 (다시 fitting하려면 submit에 --force 추가).
+#python fit_3d_robot.py --out_dir ./   (input.jpg 하나만 fitting)
+python fit_server.py submit --data_dir "${DATA_FOLDER}" --start_frame 2100 --end_frame 2350 \
+    | python fit_server.py serve
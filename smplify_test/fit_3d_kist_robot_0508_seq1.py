@@ -27,17 +27,21 @@ import json
 import time
 
 
-import matplotlib.pyplot as plt2
-from mpl_toolkits.mplot3d import Axes3D
-
-from opendr.camera import ProjectPoints
 from lib.robustifiers import GMOf
-from smpl_webuser.serialization import load_model
 from smpl_webuser.lbs import global_rigid_transformation
+from smpl_webuser.posemapper import Rodrigues
 from smpl_webuser.verts import verts_decorated
 from lib.sphere_collisions import SphereCollisions
 from lib.max_mixture_prior import MaxMixtureCompletePrior
-from render_model import render_model
+import parallel_fit
+import batch_fk
+import model_cache
+import jtr_export
+import results_store
+import skeletons
+import frameset
+import frame_source
+import numpy_fit
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -58,6 +62,20 @@ _LOGGER = logging.getLogger(__name__)
 # 13 Head top       added
 
 
+# files written by run_single_fit: json joints per frame convention (see jtr_export)
+# and the pose/betas json; a 'record' key adds a jtr_export `.npz` record
+DEFAULT_OUT_FILES = {
+    'jtr': 'output_jtr.json',
+    'jtr2': 'output_jtr2.json',
+    'jtr3': 'output_jtr3.json',
+    'jtr4': 'output_jtr4.json',
+    'params': 'output.json',
+}
+
+# --jtr_format choices
+JTR_FORMATS = ('json', 'npz', 'both')
+
+
 # --------------------Camera estimation --------------------
 def guess_init(model, focal_length, j2d, init_pose):
     """Initialize the camera translation via triangle similarity, by using the torso joints        .
@@ -72,11 +90,9 @@ def guess_init(model, focal_length, j2d, init_pose):
     j2d_here = j2d[cids]
     smpl_ids = [8, 5, 2, 1, 4, 7, 21, 19, 17, 16, 18, 20]
 
-    opt_pose = ch.array(init_pose)
-    (_, A_global) = global_rigid_transformation(
-        opt_pose, model.J, model.kintree_table, xp=ch)
-    Jtr = ch.vstack([g[:3, 3] for g in A_global])
-    Jtr = Jtr[smpl_ids].r
+    Jtr = batch_fk.forward_kinematics(
+        init_pose, model.J.r, batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    Jtr = Jtr[smpl_ids]
 
     # 9 is L shoulder, 3 is L hip
     # 8 is R shoulder, 2 is R hip
@@ -98,7 +114,9 @@ def initialize_camera(model,
                       init_pose,
                       flength=5000.,
                       pix_thsh=25.,
-                      viz=False):
+                      viz=False,
+                      cam=None,
+                      init_t=None):
     """Initialize camera translation and body orientation
     :param model: SMPL model
     :param j2d: 14x2 array of CNN joints
@@ -109,6 +127,10 @@ def initialize_camera(model,
                      is lower than pix_thsh, the body orientation as ambiguous (so a fit is run on both
                      the estimated one and its flip)
     :param viz: boolean, if True enables visualization during optimization
+    :param cam: optional camera template (see parallel_fit.make_camera) that is reset and reused
+                instead of building a new ProjectPoints for every frame
+    :param init_t: camera translation to start from (e.g. the previous frame's fit) instead
+                   of the similar triangles guess, the depth is regularized towards it
     :returns: a tuple containing the estimated camera,
               a boolean deciding if both the optimized body orientation and its flip should be considered,
               3D vector for the body orientation
@@ -125,21 +147,30 @@ def initialize_camera(model,
     # initialize camera rotation
     rt = ch.zeros(3)
     # initialize camera translation
-    _LOGGER.info('initializing translation via similar triangles')
-    init_t = guess_init(model, flength, j2d, init_pose)
+    if init_t is None:
+        _LOGGER.info('initializing translation via similar triangles')
+        init_t = guess_init(model, flength, j2d, init_pose)
+    init_t = np.array(init_t, dtype=np.float64)
     t = ch.array(init_t)
 
     # check how close the shoulder joints are
     try_both_orient = np.linalg.norm(j2d[8] - j2d[9]) < pix_thsh
 
     opt_pose = ch.array(init_pose)
-    (_, A_global) = global_rigid_transformation(
-        opt_pose, model.J, model.kintree_table, xp=ch)
-    Jtr = ch.vstack([g[:3, 3] for g in A_global])
+    # only the body orientation is optimized: pose the joints once with a zero
+    # root rotation, and let chumpy rotate them about the root
+    rest_pose = np.array(init_pose, dtype=np.float64)
+    rest_pose[:3] = 0.
+    J_posed = batch_fk.forward_kinematics(
+        rest_pose, model.J.r, batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    Jtr = Rodrigues(opt_pose[:3]).dot((J_posed - J_posed[0]).T).T + J_posed[0]
 
     # initialize the camera
-    cam = ProjectPoints(
-        f=np.array([flength, flength]), rt=rt, t=t, k=np.zeros(5), c=center)
+    if cam is None:
+        cam = parallel_fit.make_camera(flength, center)
+    cam.rt = rt
+    cam.t = t
+    cam.c = center
 
     # we are going to project the SMPL joints
     cam.v = Jtr
@@ -199,6 +230,235 @@ def initialize_camera(model,
 
 
 # --------------------Core optimization --------------------
+def joint_error(proj, j2d, conf):
+    """Mean 2D distance (in pixel) between projected SMPL joints and LSP joints.
+    Joints are weighted like the data term of optimize_on_joints (hips ignored).
+    :param proj: 24x2 array of projected SMPL joints
+    :param j2d: array of LSP joints (the first 12 are used)
+    :param conf: confidence values of the LSP joints
+    :returns: the weighted mean distance
+    """
+    smpl_ids = [8, 5, 2, 1, 4, 7, 21, 19, 17, 16, 18, 20]
+    weights = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64) * conf[:12]
+    dist = np.sqrt(np.sum((proj[smpl_ids] - j2d[:12])**2, axis=1))
+    return np.sum(weights * dist) / max(np.sum(weights), 1e-8)
+
+
+def error_jumped(err, ref_err, jump_ratio=2., min_err=10.):
+    """Decide if a reprojection error is too large to keep a warm start.
+    :param ref_err: reference error, that of the last cold fit
+    """
+    return err > max(jump_ratio * ref_err, min_err)
+
+
+def build_fit_terms(j2d, conf, model, cam, prior, betas, init_pose, n_betas, jdirs):
+    """Instantiate SMPL for one image and build the terms of the fitting objective.
+    :param j2d: 12x2 array of LSP joints (neck and head removed)
+    :param conf: 12D vector storing the confidence values from the CNN
+    :param model: SMPL model
+    :param cam: estimated camera, it projects the SMPL joints after this call
+    :param prior: mixture of gaussians pose prior
+    :param betas: chumpy shape coefficients, may be shared by several images
+    :param init_pose: 72D vector used to initialize the pose
+    :param n_betas: number of shape coefficients considered during optimization
+    :param jdirs: shape-to-joint directions (see model_cache.compute_jdirs)
+    :returns: a tuple (model instance, data term, pose prior term, joint angle term),
+              the terms are functions of their weights
+    """
+    cids = range(12)
+    smpl_ids = [8, 5, 2, 1, 4, 7, 21, 19, 17, 16, 18, 20]
+
+    # weights assigned to each joint during optimization;
+    # the definition of hips in SMPL and LSP is significantly different so set
+    # their weights to zero
+    #base_weights = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64)
+    base_weights = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64) # (WR) ignore neck joint fit
+
+    # instantiate the model:
+    # verts_decorated allows us to define how many
+    # shape coefficients (directions) we want to consider (here, n_betas)
+    sv = verts_decorated(
+        trans=ch.zeros(3),
+        pose=ch.array(init_pose),
+        v_template=model.v_template,
+        J=model.J_regressor,
+        betas=betas,
+        shapedirs=model.shapedirs[:, :, :n_betas],
+        weights=model.weights,
+        kintree_table=model.kintree_table,
+        bs_style=model.bs_style,
+        f=model.f,
+        bs_type=model.bs_type,
+        posedirs=model.posedirs)
+
+    # make the SMPL joints depend on betas
+    J_onbetas = ch.array(jdirs[0]).dot(betas) + jdirs[1]
+
+    # get joint positions as a function of model pose, betas and trans
+    (_, A_global) = global_rigid_transformation(
+        sv.pose, J_onbetas, model.kintree_table, xp=ch)
+    Jtr = ch.vstack([g[:3, 3] for g in A_global]) + sv.trans
+
+    # (WR) ignore neck joint fit
+    # add the head joint, corresponding to a vertex...
+    #Jtr = ch.vstack((Jtr, sv[head_id]))
+
+    # update the weights using confidence values
+    weights = base_weights * conf[
+        cids] if conf is not None else base_weights
+
+    # project SMPL joints on the image plane using the estimated camera
+    cam.v = Jtr
+
+    # data term: distance between observed and estimated joints in 2D
+    obj_j2d = lambda w, sigma: (
+        w * weights.reshape((-1, 1)) * GMOf((j2d[cids] - cam[smpl_ids]), sigma))
+
+    # mixture of gaussians pose prior
+    pprior = lambda w: w * prior(sv.pose)
+    # joint angles pose prior, defined over a subset of pose parameters:
+    # 55: left elbow,  90deg bend at -np.pi/2
+    # 58: right elbow, 90deg bend at np.pi/2
+    # 12: left knee,   90deg bend at np.pi/2
+    # 15: right knee,  90deg bend at np.pi/2
+    alpha = 10
+    my_exp = lambda x: alpha * ch.exp(x)
+    obj_angle = lambda w: w * ch.concatenate([my_exp(sv.pose[55]), my_exp(-sv.pose[
+                                             58]), my_exp(-sv.pose[12]), my_exp(-sv.pose[15])])
+    return (sv, obj_j2d, pprior, obj_angle)
+
+
+def fit_shared_betas(samples,
+                     model,
+                     prior,
+                     jdirs,
+                     n_betas=10,
+                     flength=5000.,
+                     pix_thsh=25.,
+                     scale_factor=2):
+    """Fit one shape to several images at once.
+    Every image gets its own camera and pose while all of them share the same betas;
+    the 4 prior-weight stages of optimize_on_joints are run on the summed objective.
+    The interpenetration term is not used here.
+    :param samples: list of (image, 14x2 LSP joints, 14D confidence) tuples
+    :param model: SMPL model
+    :param prior: mixture of gaussians pose prior
+    :param jdirs: shape-to-joint directions (see model_cache.compute_jdirs)
+    :param n_betas: number of shape coefficients considered during optimization
+    :param flength: camera focal length (kept fixed)
+    :param pix_thsh: shoulder distance (in pixel) under which the orientation is ambiguous
+    :param scale_factor: int, image rescaling used by run_single_fit
+    :returns: the n_betas shape coefficients
+    """
+    t0 = time.time()
+    betas = ch.zeros(n_betas)
+    init_pose = np.hstack((np.zeros(3), prior.weights.dot(prior.means)))
+
+    terms = []
+    for img, j2d, conf in samples:
+        if scale_factor != 1:
+            img = cv2.resize(img, (img.shape[1] * scale_factor,
+                                   img.shape[0] * scale_factor))
+            j2d = j2d * scale_factor
+        (cam, _, body_orient) = initialize_camera(
+            model, j2d, img, init_pose, flength=flength, pix_thsh=pix_thsh)
+        terms.append(build_fit_terms(
+            np.delete(j2d, 13, axis=0), np.delete(conf, 13), model, cam, prior,
+            betas, np.hstack((body_orient, init_pose[3:])), n_betas, jdirs))
+
+    opt_weights = zip([4.04 * 1e2, 4.04 * 1e2, 57.4, 4.78],
+                      [1e2, 5 * 1e1, 1e1, .5 * 1e1])
+    # the shape prior is counted once per image, as in the single image fits
+    n_images = len(terms)
+    for stage, (w, wbetas) in enumerate(opt_weights):
+        _LOGGER.info('shared shape stage %01d', stage)
+        objs = {'betas': np.sqrt(n_images) * wbetas * betas}
+        for k, (sv, obj_j2d, pprior, obj_angle) in enumerate(terms):
+            objs['j2d_%d' % k] = obj_j2d(1., 100)
+            objs['pose_%d' % k] = pprior(w)
+            objs['pose_exp_%d' % k] = obj_angle(0.317 * w)
+        ch.minimize(
+            objs,
+            x0=[betas] + [term[0].pose for term in terms],
+            method='dogleg',
+            options={'maxiter': 100,
+                     'e_3': .0001,
+                     'disp': 0})
+    _LOGGER.info('shared shape from %d images, elapsed %.05f', n_images, time.time() - t0)
+    return betas.r.copy()
+
+
+# how the body orientation of a fit was chosen, params['orient_path'] of run_single_fit:
+# warm: warm-started from the previous frame's fit, single: not ambiguous,
+# previous: closest to the previous frame, prescreen: short stage-0 fit,
+# both: full fit of both orientations
+ORIENT_PATHS = ('warm', 'single', 'previous', 'prescreen', 'both')
+
+
+def count_orient_path(counts, params):
+    """Add the orientation path of a fit (see ORIENT_PATHS) to a dict of counts."""
+    path = params.get('orient_path')
+    if path is not None:
+        counts[path] = counts.get(path, 0) + 1
+
+
+def log_orient_counts(counts):
+    _LOGGER.info('Body orientation: %d warm-started, %d unambiguous, %d from previous frame, '
+                 '%d pre-screened, %d fitted twice.',
+                 *[counts.get(path, 0) for path in ORIENT_PATHS])
+
+
+def closest_orientation(orientations, prev_orient):
+    """Pick the body orientation with the smallest rotation from prev_orient."""
+    prev_rot = cv2.Rodrigues(np.asarray(prev_orient, dtype=np.float64))[0]
+    angles = [np.linalg.norm(cv2.Rodrigues(
+        prev_rot.T.dot(cv2.Rodrigues(np.asarray(o, dtype=np.float64))[0]))[0])
+        for o in orientations]
+    return orientations[int(np.argmin(angles))]
+
+
+def prescreen_orientation(j2d, conf, model, cam, prior, orientations, n_betas, jdirs,
+                          fixed_betas=None, maxiter=10, backend='chumpy'):
+    """Pick the body orientation with the lowest data term after a truncated stage-0 fit.
+    :param j2d: 12x2 array of LSP joints (neck and head removed)
+    :param conf: 12D vector storing the confidence values from the CNN
+    :param orientations: list of candidate 3D body orientations
+    :param maxiter: dogleg iterations (function evaluations with the numpy backend) per orientation
+    :param backend: 'chumpy' or 'numpy' (see numpy_fit)
+    :returns: the winning orientation
+    """
+    errors = []
+    for orient in orientations:
+        init_pose = np.hstack((orient, prior.weights.dot(prior.means)))
+        if backend == 'numpy':
+            errors.append(numpy_fit.fit_stages(
+                j2d, conf, numpy_fit.camera_params(cam), prior, init_pose, None, jdirs,
+                model.kintree_table, stages=numpy_fit.OPT_WEIGHTS[:1], n_betas=n_betas,
+                fixed_betas=fixed_betas, maxiter=maxiter)[2])
+            continue
+        if fixed_betas is not None:
+            betas = ch.array(fixed_betas[:n_betas])
+        else:
+            betas = ch.zeros(n_betas)
+        (sv, obj_j2d, pprior, obj_angle) = build_fit_terms(
+            j2d, conf, model, cam, prior, betas, init_pose, n_betas, jdirs)
+        objs = {'j2d': obj_j2d(1., 100),
+                'pose': pprior(4.04 * 1e2),
+                'pose_exp': obj_angle(0.317 * 4.04 * 1e2)}
+        if fixed_betas is None:
+            objs['betas'] = 1e2 * betas
+        ch.minimize(
+            objs,
+            x0=[sv.pose] if fixed_betas is not None else [sv.betas, sv.pose],
+            method='dogleg',
+            options={'maxiter': maxiter,
+                     'e_3': .0001,
+                     'disp': 0})
+        errors.append((objs['j2d'].r**2).sum())
+    _LOGGER.info('orientation pre-screen errors: %s', errors)
+    return orientations[int(np.argmin(errors))]
+
+
 def optimize_on_joints(j2d,
                        model,
                        cam,
@@ -209,7 +469,15 @@ def optimize_on_joints(j2d,
                        n_betas=10,
                        regs=None,
                        conf=None,
-                       viz=False):
+                       viz=False,
+                       jdirs=None,
+                       warm_pose=None,
+                       warm_betas=None,
+                       first_stage=0,
+                       fixed_betas=None,
+                       prev_orient=None,
+                       prescreen_iters=10,
+                       backend='chumpy'):
     """Fit the model to the given set of joints, given the estimated camera
     :param j2d: 14x2 array of CNN joints
     :param model: SMPL model
@@ -222,7 +490,21 @@ def optimize_on_joints(j2d,
     :param regs: regressors for capsules' axis and radius, if not None enables the interpenetration error term
     :param conf: 14D vector storing the confidence values from the CNN
     :param viz: boolean, if True enables visualization during optimization
-    :returns: a tuple containing the optimized model, its joints projected on image space, the camera translation
+    :param jdirs: precomputed shape-to-joint directions (see model_cache.compute_jdirs), built here if None
+    :param warm_pose: 72D pose to start from (e.g. the previous frame), instead of the prior mean pose
+    :param warm_betas: shape coefficients to start from, instead of the mean shape
+    :param first_stage: index of the first of the 4 prior-weight stages to run
+    :param fixed_betas: shape coefficients kept fixed (see fit_shared_betas), only the pose is optimized
+    :param prev_orient: 3D body orientation of the previous frame; if given, an ambiguous
+                        orientation is resolved by picking the one closest to it
+    :param prescreen_iters: if > 0, an ambiguous orientation is resolved by a stage-0 fit of
+                            this many iterations per orientation, and only the winner is fully
+                            optimized; 0 runs the full fit for both
+    :param backend: 'chumpy' minimizes the objective with ch.minimize, 'numpy' with the
+                    analytic Jacobians of numpy_fit (no interpenetration term)
+    :returns: a tuple containing the optimized model, its joints projected on image space, the camera translation,
+              the mean 2D reprojection error (see joint_error) and how the orientation was chosen
+              (see ORIENT_PATHS)
     """
     t0 = time.time()
     # define the mapping LSP joints -> SMPL joints
@@ -242,11 +524,8 @@ def optimize_on_joints(j2d,
     # the vertex id for the joint corresponding to the head
     head_id = 411
 
-    # weights assigned to each joint during optimization;
-    # the definition of hips in SMPL and LSP is significantly different so set
-    # their weights to zero
-    #base_weights = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64)
-    base_weights = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64) # (WR) ignore neck joint fit
+    if jdirs is None:
+        jdirs = model_cache.compute_jdirs(model, n_betas)
 
     if try_both_orient:
         flipped_orient = cv2.Rodrigues(body_orient)[0].dot(
@@ -256,81 +535,52 @@ def optimize_on_joints(j2d,
     else:
         orientations = [body_orient]
 
+    if warm_pose is not None:
+        orient_path = 'warm'
+    elif not try_both_orient:
+        orient_path = 'single'
+    elif prev_orient is not None:
+        orientations = [closest_orientation(orientations, prev_orient)]
+        orient_path = 'previous'
+    elif prescreen_iters > 0:
+        orientations = [prescreen_orientation(
+            j2d, conf, model, cam, prior, orientations, n_betas, jdirs,
+            fixed_betas=fixed_betas, maxiter=prescreen_iters, backend=backend)]
+        orient_path = 'prescreen'
+    else:
+        orient_path = 'both'
+    try_both_orient = len(orientations) > 1
+
+    if backend == 'numpy' and regs is not None:
+        _LOGGER.warn('The numpy backend ignores the interpenetration term.')
+        regs = None
+
     if try_both_orient:
         # store here the final error for both orientations,
         # and pick the orientation resulting in the lowest error
         errors = []
 
     svs = []
-    cams = []
+    projs = []
+    reproj_errors = []
     for o_id, orient in enumerate(orientations):
-        # initialize the shape to the mean shape in the SMPL training set
-        betas = ch.zeros(n_betas)
+        if fixed_betas is not None:
+            betas = ch.array(fixed_betas[:n_betas])
+        elif warm_betas is not None:
+            betas = ch.array(warm_betas[:n_betas])
+        else:
+            # initialize the shape to the mean shape in the SMPL training set
+            betas = ch.zeros(n_betas)
 
-        # initialize the pose by using the optimized body orientation and the
-        # pose prior
-        init_pose = np.hstack((orient, prior.weights.dot(prior.means)))
+        if warm_pose is not None:
+            init_pose = np.hstack((orient, warm_pose[3:]))
+        else:
+            # initialize the pose by using the optimized body orientation and the
+            # pose prior
+            init_pose = np.hstack((orient, prior.weights.dot(prior.means)))
 
-        # instantiate the model:
-        # verts_decorated allows us to define how many
-        # shape coefficients (directions) we want to consider (here, n_betas)
-        sv = verts_decorated(
-            trans=ch.zeros(3),
-            pose=ch.array(init_pose),
-            v_template=model.v_template,
-            J=model.J_regressor,
-            betas=betas,
-            shapedirs=model.shapedirs[:, :, :n_betas],
-            weights=model.weights,
-            kintree_table=model.kintree_table,
-            bs_style=model.bs_style,
-            f=model.f,
-            bs_type=model.bs_type,
-            posedirs=model.posedirs)
-
-        # make the SMPL joints depend on betas
-        Jdirs = np.dstack([model.J_regressor.dot(model.shapedirs[:, :, i])
-                           for i in range(len(betas))])
-        J_onbetas = ch.array(Jdirs).dot(betas) + model.J_regressor.dot(
-            model.v_template.r)
-
-        # get joint positions as a function of model pose, betas and trans
-        (_, A_global) = global_rigid_transformation(
-            sv.pose, J_onbetas, model.kintree_table, xp=ch)
-        Jtr = ch.vstack([g[:3, 3] for g in A_global]) + sv.trans
-
-        # (WR) ignore neck joint fit
-        # add the head joint, corresponding to a vertex...
-        #Jtr = ch.vstack((Jtr, sv[head_id]))
-
-        # (WR) ignore neck joint fit
-        # ... and add the joint id to the list
-        #if o_id == 0:
-        #    smpl_ids.append(len(Jtr) - 1)
-
-        # update the weights using confidence values
-        weights = base_weights * conf[
-            cids] if conf is not None else base_weights
-
-        # project SMPL joints on the image plane using the estimated camera
-        cam.v = Jtr
-
-
-        # data term: distance between observed and estimated joints in 2D
-        obj_j2d = lambda w, sigma: (
-            w * weights.reshape((-1, 1)) * GMOf((j2d[cids] - cam[smpl_ids]), sigma))
-
-        # mixture of gaussians pose prior
-        pprior = lambda w: w * prior(sv.pose)
-        # joint angles pose prior, defined over a subset of pose parameters:
-        # 55: left elbow,  90deg bend at -np.pi/2
-        # 58: right elbow, 90deg bend at np.pi/2
-        # 12: left knee,   90deg bend at np.pi/2
-        # 15: right knee,  90deg bend at np.pi/2
-        alpha = 10
-        my_exp = lambda x: alpha * ch.exp(x)
-        obj_angle = lambda w: w * ch.concatenate([my_exp(sv.pose[55]), my_exp(-sv.pose[
-                                                 58]), my_exp(-sv.pose[12]), my_exp(-sv.pose[15])])
+        (sv, obj_j2d, pprior, obj_angle) = build_fit_terms(
+            j2d, conf, model, cam, prior, betas, init_pose, n_betas, jdirs)
 
         if viz:
             import matplotlib.pyplot as plt
@@ -378,43 +628,54 @@ def optimize_on_joints(j2d,
         # (all the weights used in the code were obtained via grid search, see the paper for more details)
         # the first list contains the weights for the pose priors,
         # the second list contains the weights for the shape prior
-        opt_weights = zip([4.04 * 1e2, 4.04 * 1e2, 57.4, 4.78],
-                          [1e2, 5 * 1e1, 1e1, .5 * 1e1])
-
-        # run the optimization in 4 stages, progressively decreasing the
-        # weights for the priors
-        for stage, (w, wbetas) in enumerate(opt_weights):
-            _LOGGER.info('stage %01d', stage)
-            objs = {}
-
-            objs['j2d'] = obj_j2d(1., 100)
+        opt_weights = list(zip([4.04 * 1e2, 4.04 * 1e2, 57.4, 4.78],
+                               [1e2, 5 * 1e1, 1e1, .5 * 1e1]))[first_stage:]
+
+        if backend == 'numpy':
+            (pose, opt_betas, _) = numpy_fit.fit_stages(
+                j2d[cids], conf[cids], numpy_fit.camera_params(cam), prior, init_pose,
+                betas.r, jdirs, model.kintree_table, stages=opt_weights, n_betas=n_betas,
+                fixed_betas=fixed_betas)
+            sv.pose[:] = pose
+            if fixed_betas is None:
+                betas[:] = opt_betas
+            objs = {'j2d': obj_j2d(1., 100)}
+        else:
+            # run the optimization in 4 stages, progressively decreasing the
+            # weights for the priors
+            for stage, (w, wbetas) in enumerate(opt_weights, first_stage):
+                _LOGGER.info('stage %01d', stage)
+                objs = {}
 
-            objs['pose'] = pprior(w)
+                objs['j2d'] = obj_j2d(1., 100)
 
-            objs['pose_exp'] = obj_angle(0.317 * w)
+                objs['pose'] = pprior(w)
 
-            objs['betas'] = wbetas * betas
+                objs['pose_exp'] = obj_angle(0.317 * w)
 
-            if regs is not None:
-                objs['sph_coll'] = 1e3 * sp
+                if fixed_betas is None:
+                    objs['betas'] = wbetas * betas
 
-            
+                if regs is not None:
+                    objs['sph_coll'] = 1e3 * sp
 
-            ch.minimize(
-                objs,
-                x0=[sv.betas, sv.pose],
-                method='dogleg',
-                callback=on_step,
-                options={'maxiter': 100,
-                         'e_3': .0001,
-                         'disp': 0})
+                ch.minimize(
+                    objs,
+                    x0=[sv.pose] if fixed_betas is not None else [sv.betas, sv.pose],
+                    method='dogleg',
+                    callback=on_step,
+                    options={'maxiter': 100,
+                             'e_3': .0001,
+                             'disp': 0})
 
         t1 = time.time()
         _LOGGER.info('elapsed %.05f', (t1 - t0))
         if try_both_orient:
             errors.append((objs['j2d'].r**2).sum())
         svs.append(sv)
-        cams.append(cam)
+        # cam is shared by both orientations, keep this fit's projection
+        projs.append(cam.r.copy())
+        reproj_errors.append(joint_error(projs[-1], j2d, conf))
 
     if try_both_orient and errors[0] > errors[1]:
         choose_id = 1
@@ -422,7 +683,7 @@ def optimize_on_joints(j2d,
         choose_id = 0
     if viz:
         plt.ioff()
-    return (svs[choose_id], cams[choose_id].r, cams[choose_id].t.r)
+    return (svs[choose_id], projs[choose_id], cam.t.r, reproj_errors[choose_id], orient_path)
 
 
 def run_single_fit(img,
@@ -435,7 +696,18 @@ def run_single_fit(img,
                    pix_thsh=25.,
                    scale_factor=1,
                    viz=True,
-                   do_degrees=None):
+                   do_degrees=None,
+                   prior=None,
+                   jdirs=None,
+                   cam=None,
+                   out_files=None,
+                   track=None,
+                   warm_stage=2,
+                   fixed_betas=None,
+                   prev_orient=None,
+                   prescreen_iters=10,
+                   backend='chumpy',
+                   frame_idx=None):
     """Run the fit for one specific image.
     :param img: h x w x 3 image 
     :param j2d: 14x2 array of CNN joints
@@ -450,13 +722,32 @@ def run_single_fit(img,
     :param scale_factor: int, rescale the image (for LSP, slightly greater images -- 2x -- help obtain better fits)
     :param viz: boolean, if True enables visualization during optimization
     :param do_degrees: list of degrees in azimuth to render the final fit when saving results
+    :param prior: pose prior shared across frames, created here if None
+    :param jdirs: shape-to-joint directions shared across frames, created here if None
+    :param cam: camera template shared across frames, created here if None
+    :param out_files: dict of output paths (see DEFAULT_OUT_FILES)
+    :param track: dict carrying the previous frame's fit in temporal mode; if it holds a fit,
+                  pose, betas and camera translation are warm-started from it (the camera
+                  translation and body orientation are refined on the torso joints first)
+                  and only the stages from warm_stage on are run. A cold fit is run instead
+                  when the 2D reprojection error jumps above that of the last cold fit.
+                  It is updated with this frame's fit.
+    :param warm_stage: first optimization stage of warm-started fits
+    :param fixed_betas: shape coefficients kept fixed (see fit_shared_betas), only the pose is optimized
+    :param prev_orient: body orientation of the previous frame, resolves ambiguous orientations
+    :param prescreen_iters: iterations of the orientation pre-screen, 0 fits both orientations fully
+    :param backend: optimizer of optimize_on_joints, 'chumpy' or 'numpy'
+    :param frame_idx: frame index stored in the joint record (see jtr_export)
     :returns: a tuple containing camera/model parameters and images with rendered fits
     """
     if do_degrees is None:
         do_degrees = []
+    if out_files is None:
+        out_files = DEFAULT_OUT_FILES
 
-    # create the pose prior (GMM over CMU)
-    prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
+    if prior is None:
+        # create the pose prior (GMM over CMU)
+        prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
     # get the mean pose as our initial pose
     init_pose = np.hstack((np.zeros(3), prior.weights.dot(prior.means)))
 
@@ -466,35 +757,103 @@ def run_single_fit(img,
         j2d[:, 0] *= scale_factor
         j2d[:, 1] *= scale_factor
 
-    # estimate the camera parameters
-    (cam, try_both_orient, body_orient) = initialize_camera(
-        model,
-        j2d,
-        img,
-        init_pose,
-        flength=flength,
-        pix_thsh=pix_thsh,
-        viz=viz)
-
-    # fit
-    (sv, opt_j2d, t) = optimize_on_joints(
-        j2d,
-        model,
-        cam,
-        img,
-        prior,
-        try_both_orient,
-        body_orient,
-        n_betas=n_betas,
-        conf=conf,
-        viz=viz,
-        regs=regs, )
+    warm = track is not None and 'pose' in track
+    if warm:
+        # does the previous fit still explain the new detections? Warm errors are
+        # compared with the last cold fit, so a slow drift cannot ratchet them up
+        err = joint_error(track['proj'], j2d, conf)
+        if error_jumped(err, track['cold_err']):
+            _LOGGER.info('2D error jumped (%.1f px at the last cold fit -> %.1f px), cold start',
+                         track['cold_err'], err)
+            warm = False
+            # the previous fit no longer matches, do not trust its orientation
+            prev_orient = None
+
+    if warm:
+        # re-estimate the camera translation and body orientation on the torso joints,
+        # starting from the previous fit, so the subject can move towards the camera
+        (cam, _, body_orient) = initialize_camera(
+            model,
+            j2d,
+            img,
+            track['pose'],
+            flength=flength,
+            pix_thsh=pix_thsh,
+            viz=viz,
+            cam=cam,
+            init_t=track['cam_t'])
+        (sv, opt_j2d, t, err, orient_path) = optimize_on_joints(
+            j2d,
+            model,
+            cam,
+            img,
+            prior,
+            False,
+            body_orient,
+            n_betas=n_betas,
+            conf=conf,
+            viz=viz,
+            regs=regs,
+            jdirs=jdirs,
+            warm_pose=track['pose'],
+            warm_betas=track['betas'],
+            first_stage=warm_stage,
+            fixed_betas=fixed_betas,
+            backend=backend)
+        if error_jumped(err, track['cold_err']):
+            _LOGGER.info('warm fit error %.1f px (last cold fit %.1f px), cold start',
+                         err, track['cold_err'])
+            warm = False
+            prev_orient = None
+
+    if not warm:
+        # estimate the camera parameters
+        (cam, try_both_orient, body_orient) = initialize_camera(
+            model,
+            j2d,
+            img,
+            init_pose,
+            flength=flength,
+            pix_thsh=pix_thsh,
+            viz=viz,
+            cam=cam)
+
+        # fit
+        (sv, opt_j2d, t, err, orient_path) = optimize_on_joints(
+            j2d,
+            model,
+            cam,
+            img,
+            prior,
+            try_both_orient,
+            body_orient,
+            n_betas=n_betas,
+            conf=conf,
+            viz=viz,
+            regs=regs,
+            jdirs=jdirs,
+            fixed_betas=fixed_betas,
+            prev_orient=prev_orient,
+            prescreen_iters=prescreen_iters,
+            backend=backend)
+
+    if track is not None:
+        key = 'n_warm' if warm else 'n_cold'
+        track[key] = track.get(key, 0) + 1
+        track.update(pose=sv.pose.r.copy(), betas=sv.betas.r.copy(),
+                     cam_t=cam.t.r.copy(), proj=opt_j2d, err=err)
+        if not warm:
+            # reference of the error checks of the following warm fits
+            track['cold_err'] = err
 
     h = img.shape[0]
     w = img.shape[1]
     dist = np.abs(cam.t.r[2] - np.mean(sv.r, axis=0)[2])
 
     images = []
+    if do_degrees:
+        # opendr rendering is only imported when a fit is rendered
+        from render_model import render_model
     orig_v = sv.r
     for deg in do_degrees:
         if deg != 0:
@@ -513,96 +872,22 @@ def run_single_fit(img,
     params = {'cam_t': cam.t.r,
               'f': cam.f.r,
               'pose': sv.pose.r,
-              'betas': sv.betas.r}
+              'betas': sv.betas.r,
+              'j2d_err': err,
+              'orient_path': orient_path}
     
 
 
 
-    #joints_3d = sv.Jtr
-    num_betas = n_betas
-
-
-    pose = sv.pose
-    J_regressor = model.J_regressor
-    v_template = model.v_template
-    shapedirs = model.shapedirs[:, :, :num_betas]
-    betas = sv.betas
-
-    v_shaped = v_template + shapedirs.dot(betas)
-
-    J = J_regressor.dot(v_shaped)
-
-    _, A_global = global_rigid_transformation(pose, J, model.kintree_table, xp=ch)
-    joints_3d = np.stack([g[:3, 3] for g in A_global])
-
-    print("===========Cam============")
-    cam_rotation = cam.rt.r
-    cam_translation = cam.t.r * 10
-    
-    x = float(cam_translation[0])
-    y = float(cam_translation[1])
-    z = float(cam_translation[2])
-    print("cam_translation: " + "x=" + str(x) + ", y=" + str(y) + ", z=" + str(z))
-
-
-    print("===========Jtr============")
-    json_data_list = []
-    for joint_index, joint_position in enumerate(joints_3d):
-        x = float(joint_position[0])
-        y = float(joint_position[1])
-        z = float(joint_position[2])
-        print("Joint Idx: " + str(joint_index) + ", x=" + str(x) + ", y=" + str(y) + ", z=" + str(z))
-        json_data_list.append([x, y, z])
-            
-    with open("output_jtr.json", "w") as json_file:
-        json.dump(json_data_list, json_file)      
-        
+    # joints of the final fit, evaluated without the chumpy graph
+    if jdirs is None:
+        jdirs = model_cache.compute_jdirs(model, n_betas)
+    joints_3d = batch_fk.smpl_joints(
+        sv.pose.r, sv.betas.r, jdirs,
+        batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    params['joints'] = joints_3d
 
-    print("===========Jtr World============")
-    R, _ = cv2.Rodrigues(cam_rotation)
-
-    # camera coord -> world coord 
-    Jtr_world = np.dot(R, joints_3d.T).T + cam_translation
-    #Jtr_world = np.dot(Jtr - cam_translation, R.T)
-
-    json_data_list = Jtr_world.tolist()
-    with open("output_jtr2.json", "w") as json_file:
-        json.dump(json_data_list, json_file)      
-
-        
-    print("===========Jtr World2============")
-    rvec = cam.rt.r # Assuming cam.rt is in chumpy format, get its numpy representation
-    R, _ = cv2.Rodrigues(rvec)
-
-    # Compute the inverse of the rotation matrix
-    R_inv = np.linalg.inv(R)
-
-    # Transform each joint coordinate
-    Jtr_world2 = np.array([R_inv.dot(joint) - cam.t.r for joint in joints_3d])
-
-    json_data_list2 = Jtr_world2.tolist()
-    with open("output_jtr3.json", "w") as json_file:
-        json.dump(json_data_list2, json_file)  
-
-
-    print("===========Jtr World3============")
-    cam_rt = cam.rt.r
-    cam_t = cam.t.r
-
-    cam_rot_matrix, _ = cv2.Rodrigues(cam_rt)
-
-    cam_transform = np.eye(4)
-    cam_transform[:3, :3] = cam_rot_matrix
-    cam_transform[:3, 3] = cam_t
-
-    joints_3d_hom = np.hstack([joints_3d, np.ones((joints_3d.shape[0], 1))])
-    #joints_3d_cam = (cam_transform @ joints_3d_hom.T).T
-    joints_3d_cam = np.dot(cam_transform, joints_3d_hom.T).T
-    joints_3d_cam = joints_3d_cam[:, :3]
-
-    json_data_list3 = joints_3d_cam.tolist()
-    with open("output_jtr4.json", "w") as json_file:
-        json.dump(json_data_list3, json_file)  
+    jtr_export.export_joints(joints_3d, cam.rt.r, cam.t.r, out_files, frame_idx)
 
 
     # pose/betas json
@@ -612,28 +897,30 @@ def run_single_fit(img,
         'pose': pose,
         'betas': betas
     }
-    with open("output.json", 'w') as f:
+    with open(out_files['params'], 'w') as f:
         json.dump(_params, f, indent=4)
 
 
-    # ==================Jtr Plot===============        
-    # Create a 3D plot
-    fig = plt2.figure()
-    ax = fig.add_subplot(111, projection='3d')
+    # ==================Jtr Plot===============
+    if viz:
+        # matplotlib is only imported when visualizing
+        import matplotlib.pyplot as plt2
+        from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
+
+        # Create a 3D plot
+        fig = plt2.figure()
+        ax = fig.add_subplot(111, projection='3d')
 
-    # Plot each joint with a circle and text label
-    for joint_index, joint_position in enumerate(joints_3d):
-        x, y, z = joint_position
-        ax.scatter(x, y, z, c='b', marker='o')  # Plot a circle at the joint's position
-        #ax.text(x, y, z, 'Joint {}'.format(joint_index), fontsize=12, color='r')  # Add text label
+        # Plot a circle at each joint's position
+        ax.scatter(joints_3d[:, 0], joints_3d[:, 1], joints_3d[:, 2], c='b', marker='o')
 
-    # Set labels for axes
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
+        # Set labels for axes
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
 
-    # Show the 3D plot
-    #plt2.show()
+        # Show the 3D plot
+        #plt2.show()
     # =========================================
 
 
@@ -666,6 +953,383 @@ def resize_and_pad(img, size, pad_color=128):
 
     return padded_img
 
+def load_frameset(json_path, start_frame, end_frame, scale_factor=1):
+    """Read the OpenPose frameset and keep the frames inside the range.
+    :param json_path: path to a Frameset_Joints_Cam2D_*_opose25.json file
+    :param start_frame: first frame index (inclusive)
+    :param end_frame: last frame index (inclusive)
+    :param scale_factor: image downscale factor, applied to the joint coordinates
+    :returns: a list of (frame index, 25x2 joints, 25D confidence) tuples, sorted by frame
+    """
+    # converted once and cached as .npy next to the json, see frameset.py
+    frame_ids, joints = frameset.load_frameset_arrays(json_path)
+    frame_ids, joints = frameset.frame_range(frame_ids, joints, start_frame, end_frame)
+    joints_orig = np.asarray(joints[:, :, :2], dtype=np.float64) / scale_factor
+    conf_orig = np.asarray(joints[:, :, 2], dtype=np.float64)
+    return list(zip(frame_ids.tolist(), joints_orig, conf_orig))
+
+
+def frame_out_files(out_path, jtr_format='json'):
+    """Name the outputs of run_single_fit after the frame's `.pkl` path.
+    :param jtr_format: 'json' (one file per joint frame), 'npz' (one jtr_export record) or 'both'
+    """
+    out_files = {'params': out_path.replace('.pkl', '_params.json')}
+    if jtr_format in ('json', 'both'):
+        for key in jtr_export.JTR_FRAMES:
+            out_files[key] = out_path.replace('.pkl', '_' + key + '.json')
+    if jtr_format in ('npz', 'both'):
+        out_files['record'] = out_path.replace('.pkl', '_jtr.npz')
+    return out_files
+
+
+def fit_frame(img,
+              joints_orig,
+              conf_orig,
+              out_files,
+              n_betas=10,
+              flength=1160.,
+              pix_thsh=25.,
+              do_degrees=None,
+              viz=False,
+              model=None,
+              sph_regs=None,
+              prior=None,
+              jdirs=None,
+              cam=None,
+              track=None,
+              warm_stage=2,
+              fixed_betas=None,
+              prev_orient=None,
+              prescreen_iters=10,
+              backend='chumpy',
+              frame_idx=None):
+    """Fit one KIST frame; model, sph_regs, prior, jdirs and cam are the shared resources.
+    track and warm_stage enable the temporal warm start of run_single_fit,
+    fixed_betas freezes the shape, prev_orient and prescreen_iters resolve side views,
+    backend selects the optimizer, frame_idx is stored in the joint record.
+    :returns: a tuple containing camera/model parameters and images with rendered fits
+    """
+    if img.ndim == 2:
+        _LOGGER.warn("The image is grayscale!")
+        img = np.dstack((img, img, img))
+
+    joints, conf = skeletons.remap_joints_conf(joints_orig, conf_orig, 'openpose25', 'lsp14')
+
+    return run_single_fit(
+        img,
+        joints,
+        conf,
+        model,
+        regs=sph_regs,
+        n_betas=n_betas,
+        flength=flength,
+        pix_thsh=pix_thsh,
+        scale_factor=2,
+        viz=viz,
+        do_degrees=do_degrees,
+        prior=prior,
+        jdirs=jdirs,
+        cam=cam,
+        out_files=out_files,
+        track=track,
+        warm_stage=warm_stage,
+        fixed_betas=fixed_betas,
+        prev_orient=prev_orient,
+        prescreen_iters=prescreen_iters,
+        backend=backend,
+        frame_idx=frame_idx)
+
+
+def sequence_betas(betas_path, input_video_path, frames, n_samples, model, prior,
+                   jdirs, n_betas=10, flength=1160., pix_thsh=25., scale_factor=1):
+    """Fit the shape shared by a sequence on a subsample of its frames.
+    The result is saved to betas_path and reused by later runs with the same frame
+    range and fit settings; it is fitted again when they differ.
+    Frames whose shoulders are far enough apart (no ambiguous side view) are preferred.
+    :param betas_path: json file caching the shared shape
+    :param input_video_path: video the frameset was detected on
+    :param frames: list of (frame index, joints, conf) tuples of the whole range
+    :param n_samples: number of frames used for the shape fit
+    :returns: the n_betas shape coefficients
+    """
+    settings = {'range': [int(frames[0][0]), int(frames[-1][0])] if frames else [],
+                'n_samples': n_samples, 'n_betas': n_betas, 'flength': flength,
+                'pix_thsh': pix_thsh, 'scale_factor': scale_factor}
+    if exists(betas_path):
+        with open(betas_path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('settings') == settings:
+            _LOGGER.info('Using the shared shape of `%s`.', betas_path)
+            return np.array(cached['betas'])
+        _LOGGER.info('`%s` was fitted for other frames or settings, fitting the shape again.',
+                     betas_path)
+
+    lsp = [(frame_idx,) + skeletons.remap_joints_conf(joints_orig, conf_orig,
+                                                      'openpose25', 'lsp14')
+           for frame_idx, joints_orig, conf_orig in frames]
+    # pix_thsh applies to the 2x upscaled joints of run_single_fit
+    front = [f for f in lsp if np.linalg.norm(f[1][8] - f[1][9]) >= pix_thsh / 2.]
+    candidates = front if len(front) >= n_samples else lsp
+    picks = np.linspace(0, len(candidates) - 1, min(n_samples, len(candidates)))
+    picks = [candidates[int(round(i))] for i in picks]
+    lsp = dict((f[0], f) for f in picks)
+
+    samples = []
+    picked = [frame for frame in frames if frame[0] in lsp]
+    for frame_idx, img, _, _ in read_frames(input_video_path, picked, scale_factor):
+        samples.append((img, lsp[frame_idx][1], lsp[frame_idx][2]))
+
+    betas = fit_shared_betas(samples, model, prior, jdirs, n_betas=n_betas,
+                             flength=flength, pix_thsh=pix_thsh)
+    with open(betas_path, 'w') as f:
+        json.dump({'betas': betas.tolist(), 'frames': sorted(lsp.keys()), 'settings': settings},
+                  f, indent=4)
+    return betas
+
+
+def read_frames(input_video_path, frames, scale_factor=1):
+    """Yield (frame index, image, joints, conf) for the frameset entries.
+    The video is decoded sequentially on a prefetch thread (see frame_source).
+    :param input_video_path: video the frameset was detected on
+    :param frames: list of (frame index, joints, conf) tuples
+    :param scale_factor: image downscale factor
+    """
+    return frame_source.decode_frames(input_video_path, frames, scale_factor)
+
+
+def fit_sequence(input_prefix,
+                 video_name,
+                 model_path,
+                 start_frame,
+                 end_frame,
+                 sph_regs_path=None,
+                 n_betas=10,
+                 flength=1160.,
+                 pix_thsh=25.,
+                 scale_factor=1,
+                 viz=False,
+                 do_degrees=None,
+                 workers=1,
+                 temporal=False,
+                 warm_stage=2,
+                 shared_shape=0,
+                 prescreen_iters=10,
+                 backend='chumpy',
+                 dump_inputs=False,
+                 render_every=1,
+                 jtr_format='json',
+                 store=False):
+    """Fit every frame of a video range in one session.
+    The SMPL model, the pose prior, the shape-to-joint directions and the camera
+    template are built once (once per worker when workers > 1) and shared by
+    all frames; the per-frame outputs are `<video_name>_<idx>.pkl`/`.png`.
+    Finished frames are recorded in `<video_name>_manifest.jsonl`, so an
+    interrupted run resumes with the missing frames only.
+    :param input_prefix: folder holding the video and the OpenPose frameset
+    :param video_name: video name without extension, e.g. USB_Sync_Left
+    :param model_path: SMPL model file
+    :param start_frame: first frame index (inclusive)
+    :param end_frame: last frame index (inclusive)
+    :param sph_regs_path: regressors for capsules' axis and radius, enables the interpenetration term
+    :param n_betas: number of shape coefficients considered during optimization
+    :param flength: camera focal length (an estimate)
+    :param pix_thsh: shoulder distance (in pixel) under which both orientations are tried
+    :param scale_factor: image downscale factor
+    :param viz: boolean, if True enables visualization during optimization
+    :param do_degrees: list of degrees in azimuth to render the final fit
+    :param workers: number of fitting processes, 1 fits in this process
+    :param temporal: boolean, if True each frame is warm-started from the previous one
+                     (only with workers == 1, the chain restarts cold after a skipped frame)
+    :param warm_stage: first optimization stage of warm-started fits
+    :param shared_shape: if > 0, number of frames used to fit one shape for the whole sequence
+                         (saved to `<video_name>_shared_betas.json`); per-frame fits then only
+                         optimize the pose, so all frames share the same betas
+    :param prescreen_iters: iterations of the orientation pre-screen on side views (see
+                            optimize_on_joints); in this process, the previous frame's
+                            orientation is used instead when available
+    :param backend: optimizer of the per-frame fits, 'chumpy' or 'numpy' (see numpy_fit)
+    :param dump_inputs: boolean, if True the decoded frames are also saved as
+                        `<video_name>_<idx>_input.jpg` (on a writer thread)
+    :param render_every: render do_degrees for every Nth frame only, 0 renders nothing
+                         (see parallel_fit.parse_render_policy)
+    :param jtr_format: output of the joints, see frame_out_files
+    :param store: boolean, if True the fit parameters are appended to the result store
+                  `<video_name>_store` (see results_store) instead of per-frame `.pkl` files
+    :returns: the number of fitted frames
+    """
+    input_json_path = join(input_prefix, 'Frameset_Joints_Cam2D_' + video_name + '_opose25.json')
+    input_video_path = join(input_prefix, video_name + '.mp4')
+    manifest_path = join(input_prefix, video_name + '_manifest.jsonl')
+
+    def out_path_fn(frame_idx):
+        return join(input_prefix, video_name + '_' + str(frame_idx) + '.pkl')
+
+    frames = load_frameset(input_json_path, start_frame, end_frame, scale_factor)
+
+    result_store = None
+    if store:
+        result_store = results_store.ResultStore.open_or_create(
+            join(input_prefix, video_name + '_store'), start_frame, end_frame)
+
+    # finished frames are never decoded, resized or written again
+    todo = set(parallel_fit.pending_frames(
+        [frame[0] for frame in frames], manifest_path, out_path_fn, result_store))
+    pending = [frame for frame in frames if frame[0] in todo]
+    _LOGGER.info('%d frames left to fit in [%d, %d].', len(pending), start_frame, end_frame)
+    if not pending:
+        return 0
+
+    fixed_betas = None
+    if shared_shape > 0:
+        model = model_cache.load_model_fast(model_path)
+        fixed_betas = sequence_betas(
+            join(input_prefix, video_name + '_shared_betas.json'), input_video_path,
+            frames, shared_shape, model,
+            MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior(),
+            model_cache.load_jdirs(model_path, n_betas, model), n_betas=n_betas, flength=flength,
+            pix_thsh=pix_thsh, scale_factor=scale_factor)
+    frames = pending
+
+    writer = frame_source.ImageWriter() if dump_inputs else None
+
+    def dump_input(frame_idx, img):
+        if writer is not None:
+            writer.write(join(input_prefix, video_name + '_' + str(frame_idx) + '_input.jpg'), img)
+
+    # fits per orientation path, counted as the results come back (see ORIENT_PATHS)
+    orient_counts = {}
+
+    if workers > 1:
+        if viz:
+            _LOGGER.warn('Visualization is disabled when fitting with workers.')
+        if temporal:
+            _LOGGER.warn('Temporal warm start is disabled when fitting with workers.')
+
+        def jobs():
+            for frame_idx, img, joints_orig, conf_orig in read_frames(
+                    input_video_path, frames, scale_factor):
+                dump_input(frame_idx, img)
+                out_files = frame_out_files(out_path_fn(frame_idx), jtr_format)
+                yield (frame_idx, (img, joints_orig, conf_orig, out_files,
+                                   n_betas, flength, pix_thsh,
+                                   parallel_fit.render_degrees(do_degrees, render_every, frame_idx)),
+                       {'fixed_betas': fixed_betas,
+                        'prescreen_iters': prescreen_iters,
+                        'backend': backend,
+                        'frame_idx': frame_idx})
+
+        try:
+            n_fitted, _ = parallel_fit.run_pool(
+                jobs(), fit_frame, out_path_fn, manifest_path, model_path,
+                sph_regs_path=sph_regs_path, workers=workers, n_betas=n_betas,
+                flength=flength, store=result_store,
+                on_result=lambda frame_idx, params: count_orient_path(orient_counts, params))
+        finally:
+            if writer is not None:
+                writer.close()
+        log_orient_counts(orient_counts)
+        return n_fitted
+
+    # shared across all frames of the sequence
+    if shared_shape <= 0:
+        model = model_cache.load_model_fast(model_path)
+    sph_regs = np.load(sph_regs_path) if sph_regs_path else None
+    prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
+    jdirs = model_cache.load_jdirs(model_path, n_betas, model)
+    cam = parallel_fit.make_camera(flength)
+
+    track = {} if temporal else None
+    prev_idx = None
+    prev_orient = None
+
+    n_fitted = 0
+    fit_time = 0.
+    manifest = open(manifest_path, 'a')
+    try:
+        for frame_idx, img, joints_orig, conf_orig in read_frames(
+                input_video_path, frames, scale_factor):
+            if track is not None and prev_idx is not None and frame_idx != prev_idx + 1:
+                # only consecutive frames are warm-started
+                for key in ('pose', 'betas', 'cam_t', 'proj', 'err', 'cold_err'):
+                    track.pop(key, None)
+            if prev_idx is not None and frame_idx != prev_idx + 1:
+                prev_orient = None
+            prev_idx = frame_idx
+            out_path = out_path_fn(frame_idx)
+            dump_input(frame_idx, img)
+            _LOGGER.info('Fitting 3D body on frame %d (saving to `%s`).', frame_idx, out_path)
+
+            start_time = time.time()
+
+            frame_degrees = parallel_fit.render_degrees(do_degrees, render_every, frame_idx)
+            params, vis = fit_frame(
+                img,
+                joints_orig,
+                conf_orig,
+                frame_out_files(out_path, jtr_format),
+                n_betas=n_betas,
+                flength=flength,
+                pix_thsh=pix_thsh,
+                do_degrees=frame_degrees,
+                viz=viz,
+                model=model,
+                sph_regs=sph_regs,
+                prior=prior,
+                jdirs=jdirs,
+                cam=cam,
+                track=track,
+                warm_stage=warm_stage,
+                fixed_betas=fixed_betas,
+                prev_orient=prev_orient,
+                prescreen_iters=prescreen_iters,
+                backend=backend,
+                frame_idx=frame_idx)
+            prev_orient = params['pose'][:3]
+            count_orient_path(orient_counts, params)
+            if viz:
+                print("==VIZ==")
+                import matplotlib.pyplot as plt
+                plt.ion()
+                plt.show()
+                plt.subplot(121)
+                plt.imshow(img[:, :, ::-1])
+                if frame_degrees:
+                    for di, deg in enumerate(frame_degrees):
+                        plt.subplot(122)
+                        plt.cla()
+                        plt.imshow(vis[di])
+                        plt.draw()
+                        plt.title('%d deg' % deg)
+                        plt.pause(1)
+                raw_input('Press any key to continue...')
+
+            # execution time
+            end_time = time.time()
+            execution_time_seconds = end_time - start_time
+            fit_time += execution_time_seconds
+            n_fitted += 1
+            print("Execution Time: {} ms, {:.3f} frames/sec".format(
+                execution_time_seconds * 1000, n_fitted / fit_time))
+
+            parallel_fit.write_result(out_path, params, vis[0] if vis else None,
+                                      result_store, frame_idx)
+            parallel_fit.record_frame(manifest, frame_idx, out_path, execution_time_seconds,
+                                      result_store.path if result_store is not None else None)
+    finally:
+        manifest.close()
+        if writer is not None:
+            writer.close()
+
+    if n_fitted > 0:
+        _LOGGER.info('Fitted %d frames in %.1f s (%.3f frames/sec).',
+                     n_fitted, fit_time, n_fitted / fit_time)
+    if track is not None:
+        _LOGGER.info('Temporal mode: %d warm-started, %d cold frames.',
+                     track.get('n_warm', 0), track.get('n_cold', 0))
+    log_orient_counts(orient_counts)
+    return n_fitted
+
+
 def main(base_dir,
          out_dir,
          use_interpenetration=True,
@@ -674,7 +1338,19 @@ def main(base_dir,
          flength=1160.,
          pix_thsh=25.,
          use_neutral=False,
-         viz=True):
+         viz=True,
+         input_prefix='Seq1',
+         start_frame=690,
+         end_frame=1378,
+         workers=1,
+         temporal=False,
+         shared_shape=0,
+         prescreen_iters=10,
+         backend='chumpy',
+         dump_inputs=False,
+         render_every=1,
+         jtr_format='json',
+         store=False):
     """Set up paths to image and joint data, saves results.
     :param base_dir: folder containing LSP images and data
     :param out_dir: output folder
@@ -686,6 +1362,18 @@ def main(base_dir,
                      the estimated one and its flip)
     :param use_neutral: boolean, if True enables uses the neutral gender SMPL model
     :param viz: boolean, if True enables visualization during optimization
+    :param input_prefix: folder holding the KIST video and OpenPose frameset
+    :param start_frame: first frame index to fit (inclusive)
+    :param end_frame: last frame index to fit (inclusive)
+    :param workers: number of fitting processes
+    :param temporal: boolean, if True warm-starts each frame from the previous frame's fit
+    :param shared_shape: number of frames used to fit one shape for the sequence, 0 disables it
+    :param prescreen_iters: iterations of the side-view orientation pre-screen, 0 disables it
+    :param backend: optimizer, 'chumpy' or 'numpy'
+    :param dump_inputs: boolean, if True saves every fitted input frame as a jpg
+    :param render_every: render the final fit of every Nth frame, 0 disables rendering
+    :param jtr_format: output of the fitted joints, 'json', 'npz' or 'both'
+    :param store: boolean, if True the fits go to the sequence result store instead of `.pkl` files
     """
 
     img_dir = join(abspath(base_dir), 'images/lsp')
@@ -698,150 +1386,35 @@ def main(base_dir,
     # Note that rendering many views can take a while.
     do_degrees = [0.]
 
-    sph_regs = None
-    model = load_model(MODEL_MALE_PATH)
+    sph_regs_path = None
     if use_interpenetration:
-        sph_regs = np.load(SPH_REGS_MALE_PATH)   
+        sph_regs_path = SPH_REGS_MALE_PATH
 
 
     # Load KIST Robot Data
-    input_prefix = 'Seq1'
-    input_json_path = input_prefix + '/Frameset_Joints_Cam2D_USB_Sync_Left_opose25.json'
-    input_video_path = input_prefix + '/USB_Sync_Left.mp4'
-    
-    start_frame = 690 
-    end_frame = 1378    # 689
-    scale_factor = 1
-    
-    cap = cv2.VideoCapture(input_video_path)
-    
-    with open(input_json_path, 'r') as file:
-        data = json.load(file)
-
-    frames = data['Set']
-    
-    for frame in frames:
+    fit_sequence(
+        input_prefix,
+        'USB_Sync_Left',
+        MODEL_MALE_PATH,
+        start_frame,
+        end_frame,
+        sph_regs_path=sph_regs_path,
+        n_betas=n_betas,
+        flength=flength,
+        pix_thsh=pix_thsh,
+        scale_factor=1,
+        viz=viz,
+        do_degrees=do_degrees,
+        workers=workers,
+        temporal=temporal,
+        shared_shape=shared_shape,
+        prescreen_iters=prescreen_iters,
+        backend=backend,
+        dump_inputs=dump_inputs,
+        render_every=render_every,
+        jtr_format=jtr_format,
+        store=store)
 
-        frame_idx = frame['F']
-        
-        if start_frame <= frame_idx <= end_frame:
-        
-            joints_orig = np.array([[j[0] / scale_factor, j[1] / scale_factor] for j in frame['J']])
-            conf_orig = np.array([j[2] for j in frame['J']])
-            
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            success, video_frame = cap.read()
-            
-            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-            print('Original video width: ' + str(width))
-            print('Original video height: ' + str(height))
-
-            #img = video_frame
-            img = cv2.resize(video_frame, (int(width/scale_factor), int(height/scale_factor)))
-            #img = resize_and_pad(video_frame, (320, 180))
-
-
-            out_path = input_prefix + '/USB_Sync_Left_' + str(frame_idx) + '.pkl'
-            jpg_path = input_prefix + '/USB_Sync_Left_' + str(frame_idx) + '_input.jpg'
-
-            cv2.imwrite(jpg_path, img)
-
-            if not exists(out_path):
-                _LOGGER.info('Fitting 3D body on `%s` (saving to `%s`).', jpg_path, out_path)
-                #img = cv2.imread(img_path)
-                if img.ndim == 2:
-                    _LOGGER.warn("The image is grayscale!")
-                    img = np.dstack((img, img, img))
-                
-
-                joints = np.copy(joints_orig)
-                conf = np.copy(conf_orig)
-                
-                #robot_ids = [-1, 4, 3, -1, 8, 7, -1, 12, 11, -1, -1, -1, -1, -1, -1, -1, 2, 1, 6, 5, 10, 9]
-                robot_ids = [11, 7, 3, 4, 8, 12, 9, 5, 1, 2, 6, 10, 0]
-
-                # joints_orig -> KIST(2)
-                # joints -> LSP
-
-                joints[1] = joints_orig[10]	# RKnee
-                joints[2] = joints_orig[9]	# RHip
-                joints[5] = joints_orig[14]	# LAnkle
-                joints[0] = joints_orig[11]	# RAnkle
-                joints[3] = joints_orig[12]	# LHip
-                joints[4] = joints_orig[13]	# LKnee
-                joints[6] = joints_orig[4]	# RWrist
-                joints[7] = joints_orig[3]	# RElbow
-                joints[8] = joints_orig[2]	# RShoulder
-                joints[9] = joints_orig[5]	# LShoulder
-                joints[10] = joints_orig[6]	# LElbow
-                joints[11] = joints_orig[7]	# LWrist
-                joints[12] = joints_orig[1]	# Neck
-                joints[13] = joints_orig[0]	# Nose
-                
-                conf[1] = conf_orig[10]
-                conf[2] = conf_orig[9]
-                conf[5] = conf_orig[8]
-                conf[0] = conf_orig[11]
-                conf[3] = conf_orig[12]
-                conf[4] = conf_orig[13]
-                conf[6] = conf_orig[4]
-                conf[7] = conf_orig[3]
-                conf[8] = conf_orig[2]
-                conf[9] = conf_orig[5]
-                conf[10] = conf_orig[6]
-                conf[11] = conf_orig[7]
-                conf[12] = conf_orig[1]
-                conf[13] = conf_orig[0]
-
-                
-                start_time = time.time()
-                
-                params, vis = run_single_fit(
-                    img,
-                    joints,
-                    conf,
-                    model,
-                    regs=sph_regs,
-                    n_betas=n_betas,
-                    flength=flength,
-                    pix_thsh=pix_thsh,
-                    scale_factor=2,
-                    viz=viz,
-                    do_degrees=do_degrees)
-                if viz:
-                    print("==VIZ==")
-                    import matplotlib.pyplot as plt
-                    plt.ion()
-                    plt.show()
-                    plt.subplot(121)
-                    plt.imshow(img[:, :, ::-1])
-                    if do_degrees is not None:
-                        for di, deg in enumerate(do_degrees):
-                            plt.subplot(122)
-                            plt.cla()
-                            plt.imshow(vis[di])
-                            plt.draw()
-                            plt.title('%d deg' % deg)
-                            plt.pause(1)
-                    raw_input('Press any key to continue...')
-
-                # execution time
-                end_time = time.time()
-                execution_time_seconds = end_time - start_time                
-                execution_time_milliseconds = execution_time_seconds * 1000
-                print("Execution Time: {} ms".format(execution_time_milliseconds))
-
-                with open(out_path, 'w') as outf:
-                    pickle.dump(params, outf)
-
-                # This only saves the first rendering.
-                if do_degrees is not None:
-                    cv2.imwrite(out_path.replace('.pkl', '.png'), vis[0])
-                    #cv2.imwrite(out_path.replace('.pkl', '_2.png'), vis[-1])
-    
-    cap.release()
     cv2.destroyAllWindows()
 
 
@@ -893,6 +1466,78 @@ if __name__ == '__main__':
         action='store_true',
         help="Turns on visualization of intermediate optimization steps "
         "and final results.")
+    parser.add_argument(
+        '--input_prefix',
+        default='Seq1',
+        type=str,
+        help="Folder that contains USB_Sync_Left.mp4 and its OpenPose frameset.")
+    parser.add_argument(
+        '--start_frame',
+        default=690,
+        type=int,
+        help="First frame index of the sequence to fit (inclusive).")
+    parser.add_argument(
+        '--end_frame',
+        default=1378,
+        type=int,
+        help="Last frame index of the sequence to fit (inclusive).")
+    parser.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help="Number of processes fitting frames in parallel. Each worker "
+        "loads the model and the pose prior once.")
+    parser.add_argument(
+        '--temporal',
+        default=False,
+        action='store_true',
+        help="Warm-start each frame from the previous frame's pose, shape and "
+        "camera and skip the first high-prior stages. Falls back to a cold "
+        "start when the 2D reprojection error jumps.")
+    parser.add_argument(
+        '--shared_shape',
+        default=0,
+        type=int,
+        help="Fit the betas jointly on this many frames of the sequence first, "
+        "then keep them fixed and optimize only the pose of every frame. "
+        "0 fits the betas per frame.")
+    parser.add_argument(
+        '--orient_prescreen',
+        default=10,
+        type=int,
+        help="On side views, run this many stage-0 iterations for the body "
+        "orientation and its flip and fully fit only the better one (or take "
+        "the one closest to the previous frame). 0 fully fits both.")
+    parser.add_argument(
+        '--backend',
+        default='chumpy',
+        choices=['chumpy', 'numpy'],
+        help="Optimizer of the joint fit: chumpy (dogleg on the autodiff graph) "
+        "or numpy (analytic Jacobians with scipy least squares, without the "
+        "interpenetration term).")
+    parser.add_argument(
+        '--dump_inputs',
+        default=False,
+        action='store_true',
+        help="Save every fitted video frame as USB_Sync_Left_<idx>_input.jpg.")
+    parser.add_argument(
+        '--render',
+        default=1,
+        type=parallel_fit.parse_render_policy,
+        help="Rendering of the final fits (.png): 'none', 'final' for every "
+        "frame, or N for every Nth frame.")
+    parser.add_argument(
+        '--jtr_format',
+        default='json',
+        choices=JTR_FORMATS,
+        help="Output of the fitted joints: 'json' files per frame convention, "
+        "one 'npz' record (see jtr_export.py) or 'both'.")
+    parser.add_argument(
+        '--store',
+        default=False,
+        action='store_true',
+        help="Append the fits to the USB_Sync_Left_store result store (see "
+        "results_store.py) instead of writing one .pkl per frame.")
     args = parser.parse_args()
 
     use_interpenetration = not args.no_interpenetration
@@ -922,4 +1567,7 @@ if __name__ == '__main__':
                                   'regressors_locked_normalized_male.npz')
 
     main(args.base_dir, args.out_dir, use_interpenetration, args.n_betas,
-         args.flength, args.side_view_thsh, args.gender_neutral, args.viz)
+         args.flength, args.side_view_thsh, args.gender_neutral, args.viz,
+         args.input_prefix, args.start_frame, args.end_frame, args.workers,
+         args.temporal, args.shared_shape, args.orient_prescreen, args.backend,
+         args.dump_inputs, args.render, args.jtr_format, args.store)
@@ -25,17 +25,18 @@ import numpy as np
 import chumpy as ch
 import json
 
-import matplotlib.pyplot as plt2
-from mpl_toolkits.mplot3d import Axes3D
-
-from opendr.camera import ProjectPoints
 from lib.robustifiers import GMOf
-from smpl_webuser.serialization import load_model
 from smpl_webuser.lbs import global_rigid_transformation
+from smpl_webuser.posemapper import Rodrigues
 from smpl_webuser.verts import verts_decorated
 from lib.sphere_collisions import SphereCollisions
 from lib.max_mixture_prior import MaxMixtureCompletePrior
-from render_model import render_model
+import parallel_fit
+import batch_fk
+import model_cache
+import jtr_export
+import results_store
+import skeletons
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -56,6 +57,20 @@ _LOGGER = logging.getLogger(__name__)
 # 13 Head top       added
 
 
+# files written by run_single_fit: json joints per frame convention (see jtr_export)
+# and the pose/betas json; a 'record' key adds a jtr_export `.npz` record
+DEFAULT_OUT_FILES = {
+    'jtr': 'output_jtr.json',
+    'jtr2': 'output_jtr2.json',
+    'jtr3': 'output_jtr3.json',
+    'jtr4': 'output_jtr4.json',
+    'params': 'output.json',
+}
+
+# --jtr_format choices
+JTR_FORMATS = ('json', 'npz', 'both')
+
+
 # --------------------Camera estimation --------------------
 def guess_init(model, focal_length, j2d, init_pose):
     """Initialize the camera translation via triangle similarity, by using the torso joints        .
@@ -70,11 +85,9 @@ def guess_init(model, focal_length, j2d, init_pose):
     j2d_here = j2d[cids]
     smpl_ids = [8, 5, 2, 1, 4, 7, 21, 19, 17, 16, 18, 20]
 
-    opt_pose = ch.array(init_pose)
-    (_, A_global) = global_rigid_transformation(
-        opt_pose, model.J, model.kintree_table, xp=ch)
-    Jtr = ch.vstack([g[:3, 3] for g in A_global])
-    Jtr = Jtr[smpl_ids].r
+    Jtr = batch_fk.forward_kinematics(
+        init_pose, model.J.r, batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    Jtr = Jtr[smpl_ids]
 
     # 9 is L shoulder, 3 is L hip
     # 8 is R shoulder, 2 is R hip
@@ -96,7 +109,8 @@ def initialize_camera(model,
                       init_pose,
                       flength=5000.,
                       pix_thsh=25.,
-                      viz=False):
+                      viz=False,
+                      cam=None):
     """Initialize camera translation and body orientation
     :param model: SMPL model
     :param j2d: 14x2 array of CNN joints
@@ -107,6 +121,8 @@ def initialize_camera(model,
                      is lower than pix_thsh, the body orientation as ambiguous (so a fit is run on both
                      the estimated one and its flip)
     :param viz: boolean, if True enables visualization during optimization
+    :param cam: optional camera template (see parallel_fit.make_camera) that is reset and reused
+                instead of building a new ProjectPoints for every frame
     :returns: a tuple containing the estimated camera,
               a boolean deciding if both the optimized body orientation and its flip should be considered,
               3D vector for the body orientation
@@ -131,13 +147,20 @@ def initialize_camera(model,
     try_both_orient = np.linalg.norm(j2d[8] - j2d[9]) < pix_thsh
 
     opt_pose = ch.array(init_pose)
-    (_, A_global) = global_rigid_transformation(
-        opt_pose, model.J, model.kintree_table, xp=ch)
-    Jtr = ch.vstack([g[:3, 3] for g in A_global])
+    # only the body orientation is optimized: pose the joints once with a zero
+    # root rotation, and let chumpy rotate them about the root
+    rest_pose = np.array(init_pose, dtype=np.float64)
+    rest_pose[:3] = 0.
+    J_posed = batch_fk.forward_kinematics(
+        rest_pose, model.J.r, batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    Jtr = Rodrigues(opt_pose[:3]).dot((J_posed - J_posed[0]).T).T + J_posed[0]
 
     # initialize the camera
-    cam = ProjectPoints(
-        f=np.array([flength, flength]), rt=rt, t=t, k=np.zeros(5), c=center)
+    if cam is None:
+        cam = parallel_fit.make_camera(flength, center)
+    cam.rt = rt
+    cam.t = t
+    cam.c = center
 
     # we are going to project the SMPL joints
     cam.v = Jtr
@@ -207,7 +230,8 @@ def optimize_on_joints(j2d,
                        n_betas=10,
                        regs=None,
                        conf=None,
-                       viz=False):
+                       viz=False,
+                       jdirs=None):
     """Fit the model to the given set of joints, given the estimated camera
     :param j2d: 14x2 array of CNN joints
     :param model: SMPL model
@@ -220,6 +244,7 @@ def optimize_on_joints(j2d,
     :param regs: regressors for capsules' axis and radius, if not None enables the interpenetration error term
     :param conf: 14D vector storing the confidence values from the CNN
     :param viz: boolean, if True enables visualization during optimization
+    :param jdirs: precomputed shape-to-joint directions (see model_cache.compute_jdirs), built here if None
     :returns: a tuple containing the optimized model, its joints projected on image space, the camera translation
     """
     t0 = time()
@@ -287,10 +312,9 @@ def optimize_on_joints(j2d,
             posedirs=model.posedirs)
 
         # make the SMPL joints depend on betas
-        Jdirs = np.dstack([model.J_regressor.dot(model.shapedirs[:, :, i])
-                           for i in range(len(betas))])
-        J_onbetas = ch.array(Jdirs).dot(betas) + model.J_regressor.dot(
-            model.v_template.r)
+        if jdirs is None:
+            jdirs = model_cache.compute_jdirs(model, n_betas)
+        J_onbetas = ch.array(jdirs[0]).dot(betas) + jdirs[1]
 
         # get joint positions as a function of model pose, betas and trans
         (_, A_global) = global_rigid_transformation(
@@ -433,7 +457,12 @@ def run_single_fit(img,
                    pix_thsh=25.,
                    scale_factor=1,
                    viz=False,
-                   do_degrees=None):
+                   do_degrees=None,
+                   prior=None,
+                   jdirs=None,
+                   cam=None,
+                   out_files=None,
+                   frame_idx=None):
     """Run the fit for one specific image.
     :param img: h x w x 3 image 
     :param j2d: 14x2 array of CNN joints
@@ -448,13 +477,21 @@ def run_single_fit(img,
     :param scale_factor: int, rescale the image (for LSP, slightly greater images -- 2x -- help obtain better fits)
     :param viz: boolean, if True enables visualization during optimization
     :param do_degrees: list of degrees in azimuth to render the final fit when saving results
+    :param prior: pose prior shared across frames, created here if None
+    :param jdirs: shape-to-joint directions shared across frames, created here if None
+    :param cam: camera template shared across frames, created here if None
+    :param out_files: dict of output paths (see DEFAULT_OUT_FILES)
+    :param frame_idx: frame index stored in the joint record (see jtr_export)
     :returns: a tuple containing camera/model parameters and images with rendered fits
     """
     if do_degrees is None:
         do_degrees = []
+    if out_files is None:
+        out_files = DEFAULT_OUT_FILES
 
-    # create the pose prior (GMM over CMU)
-    prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
+    if prior is None:
+        # create the pose prior (GMM over CMU)
+        prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
     # get the mean pose as our initial pose
     init_pose = np.hstack((np.zeros(3), prior.weights.dot(prior.means)))
 
@@ -472,7 +509,8 @@ def run_single_fit(img,
         init_pose,
         flength=flength,
         pix_thsh=pix_thsh,
-        viz=viz)
+        viz=viz,
+        cam=cam)
 
     # fit
     (sv, opt_j2d, t) = optimize_on_joints(
@@ -486,13 +524,17 @@ def run_single_fit(img,
         n_betas=n_betas,
         conf=conf,
         viz=viz,
-        regs=regs, )
+        regs=regs,
+        jdirs=jdirs)
 
     h = img.shape[0]
     w = img.shape[1]
     dist = np.abs(cam.t.r[2] - np.mean(sv.r, axis=0)[2])
 
     images = []
+    if do_degrees:
+        # opendr rendering is only imported when a fit is rendered
+        from render_model import render_model
     orig_v = sv.r
     for deg in do_degrees:
         if deg != 0:
@@ -516,131 +558,193 @@ def run_single_fit(img,
 
 
 
-    #joints_3d = sv.Jtr
-    num_betas = n_betas
-
-
-    pose = sv.pose
-    J_regressor = model.J_regressor
-    v_template = model.v_template
-    shapedirs = model.shapedirs[:, :, :num_betas]
-    betas = sv.betas
+    # joints of the final fit, evaluated without the chumpy graph
+    if jdirs is None:
+        jdirs = model_cache.compute_jdirs(model, n_betas)
+    joints_3d = batch_fk.smpl_joints(
+        sv.pose.r, sv.betas.r, jdirs,
+        batch_fk.parents_from_kintree(model.kintree_table))[0][0]
+    params['joints'] = joints_3d
 
-    v_shaped = v_template + shapedirs.dot(betas)
+    jtr_export.export_joints(joints_3d, cam.rt.r, cam.t.r, out_files, frame_idx)
 
-    J = J_regressor.dot(v_shaped)
 
-    _, A_global = global_rigid_transformation(pose, J, model.kintree_table, xp=ch)
-    joints_3d = np.stack([g[:3, 3] for g in A_global])
-
-    print("===========Cam============")
-    cam_rotation = cam.rt.r
-    cam_translation = cam.t.r * 10
-    
-    x = float(cam_translation[0])
-    y = float(cam_translation[1])
-    z = float(cam_translation[2])
-    print("cam_translation: " + "x=" + str(x) + ", y=" + str(y) + ", z=" + str(z))
-
-
-    print("===========Jtr============")
-    json_data_list = []
-    for joint_index, joint_position in enumerate(joints_3d):
-        x = float(joint_position[0])
-        y = float(joint_position[1])
-        z = float(joint_position[2])
-        print("Joint Idx: " + str(joint_index) + ", x=" + str(x) + ", y=" + str(y) + ", z=" + str(z))
-        json_data_list.append([x, y, z])
-            
-    with open("output_jtr.json", "w") as json_file:
-        json.dump(json_data_list, json_file)      
-        
-
-    print("===========Jtr World============")
-    R, _ = cv2.Rodrigues(cam_rotation)
-
-    # camera coord -> world coord 
-    Jtr_world = np.dot(R, joints_3d.T).T + cam_translation
-    #Jtr_world = np.dot(Jtr - cam_translation, R.T)
-
-    json_data_list = Jtr_world.tolist()
-    with open("output_jtr2.json", "w") as json_file:
-        json.dump(json_data_list, json_file)      
+    # pose/betas json
+    pose = params['pose'].tolist()
+    betas = params['betas'].tolist()
+    _params = {
+        'pose': pose,
+        'betas': betas
+    }
+    with open(out_files['params'], 'w') as f:
+        json.dump(_params, f, indent=4)
 
-        
-    print("===========Jtr World2============")
-    rvec = cam.rt.r # Assuming cam.rt is in chumpy format, get its numpy representation
-    R, _ = cv2.Rodrigues(rvec)
 
-    # Compute the inverse of the rotation matrix
-    R_inv = np.linalg.inv(R)
+    # ==================Jtr Plot===============
+    if viz:
+        # matplotlib is only imported when visualizing
+        import matplotlib.pyplot as plt2
+        from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
 
-    # Transform each joint coordinate
-    Jtr_world2 = np.array([R_inv.dot(joint) - cam.t.r for joint in joints_3d])
+        # Create a 3D plot
+        fig = plt2.figure()
+        ax = fig.add_subplot(111, projection='3d')
 
-    json_data_list2 = Jtr_world2.tolist()
-    with open("output_jtr3.json", "w") as json_file:
-        json.dump(json_data_list2, json_file)  
+        # Plot a circle at each joint's position
+        ax.scatter(joints_3d[:, 0], joints_3d[:, 1], joints_3d[:, 2], c='b', marker='o')
 
+        # Set labels for axes
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
 
-    print("===========Jtr World3============")
-    cam_rt = cam.rt.r
-    cam_t = cam.t.r
+        # Show the 3D plot
+        #plt2.show()
+    # =========================================
 
-    cam_rot_matrix, _ = cv2.Rodrigues(cam_rt)
 
-    cam_transform = np.eye(4)
-    cam_transform[:3, :3] = cam_rot_matrix
-    cam_transform[:3, 3] = cam_t
 
-    joints_3d_hom = np.hstack([joints_3d, np.ones((joints_3d.shape[0], 1))])
-    #joints_3d_cam = (cam_transform @ joints_3d_hom.T).T
-    joints_3d_cam = np.dot(cam_transform, joints_3d_hom.T).T
-    joints_3d_cam = joints_3d_cam[:, :3]
 
-    json_data_list3 = joints_3d_cam.tolist()
-    with open("output_jtr4.json", "w") as json_file:
-        json.dump(json_data_list3, json_file)  
 
 
-    # pose/betas json
-    pose = params['pose'].tolist()
-    betas = params['betas'].tolist()
-    _params = {
-        'pose': pose,
-        'betas': betas
-    }
-    with open("output.json", 'w') as f:
-        json.dump(_params, f, indent=4)
 
+    return params, images
 
-    # ==================Jtr Plot===============        
-    # Create a 3D plot
-    fig = plt2.figure()
-    ax = fig.add_subplot(111, projection='3d')
 
-    # Plot each joint with a circle and text label
-    for joint_index, joint_position in enumerate(joints_3d):
-        x, y, z = joint_position
-        ax.scatter(x, y, z, c='b', marker='o')  # Plot a circle at the joint's position
-        #ax.text(x, y, z, 'Joint {}'.format(joint_index), fontsize=12, color='r')  # Add text label
+def fit_frame(img,
+              joints_orig,
+              conf_orig,
+              out_files,
+              n_betas=10,
+              flength=1160.,
+              pix_thsh=25.,
+              do_degrees=None,
+              viz=False,
+              model=None,
+              sph_regs=None,
+              prior=None,
+              jdirs=None,
+              cam=None,
+              frame_idx=None):
+    """Fit one robot frame; model, sph_regs, prior, jdirs and cam are the shared resources.
+    :returns: a tuple containing camera/model parameters and images with rendered fits
+    """
+    if img.ndim == 2:
+        _LOGGER.warn("The image is grayscale!")
+        img = np.dstack((img, img, img))
 
-    # Set labels for axes
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
-
-    # Show the 3D plot
-    #plt2.show()
-    # =========================================
+    joints, conf = skeletons.remap_joints_conf(joints_orig, conf_orig, 'coco18', 'lsp14')
 
+    return run_single_fit(
+        img,
+        joints,
+        conf,
+        model,
+        regs=sph_regs,
+        n_betas=n_betas,
+        flength=flength,
+        pix_thsh=pix_thsh,
+        scale_factor=2,
+        viz=viz,
+        do_degrees=do_degrees,
+        prior=prior,
+        jdirs=jdirs,
+        cam=cam,
+        out_files=out_files,
+        frame_idx=frame_idx)
 
 
+def load_json_array(path):
+    with open(path, 'r') as file:
+        return np.array(json.load(file))
 
 
+def deeprobot_outputs(prefix, jtr_format='json'):
+    """Output names used by deeprobot.sh for a frame prefix such as Set1_V6/f_2100.
+    :param jtr_format: 'json' (one file per joint frame), 'npz' (one jtr_export record) or 'both'
+    """
+    out_files = {'params': prefix + '_4_output_smplify.json'}
+    if jtr_format in ('json', 'both'):
+        for n, key in enumerate(jtr_export.JTR_FRAMES):
+            out_files[key] = prefix + '_3_joint_3d_smplify%d.json' % (n + 1)
+    if jtr_format in ('npz', 'both'):
+        out_files['record'] = prefix + '_3_joint_3d_smplify.npz'
+    return {
+        'pkl': prefix + '_4_output_smplify.pkl',
+        'out_files': out_files,
+    }
 
 
-    return params, images
+def deeprobot_paths(data_dir, i, jtr_format='json'):
+    """File names used by deeprobot.sh for frame i of data_dir."""
+    prefix = join(data_dir, 'f_' + str(i))
+    paths = deeprobot_outputs(prefix, jtr_format)
+    paths.update({
+        'img': prefix + '_0_resize.jpg',
+        'joints': prefix + '_1_joint_pos.json',
+        'conf': prefix + '_2_confid.json',
+    })
+    return paths
+
+
+def fit_data_dir(data_dir,
+                 start_frame,
+                 end_frame,
+                 model_path,
+                 sph_regs_path=None,
+                 n_betas=10,
+                 flength=1160.,
+                 pix_thsh=25.,
+                 do_degrees=None,
+                 workers=1,
+                 render_every=1,
+                 jtr_format='json',
+                 store=False):
+    """Fit the frames of a deeprobot data folder on a process pool.
+    Outputs use the deeprobot.sh names next to the inputs and finished frames
+    are recorded in `<data_dir>/manifest.jsonl`.
+    :param data_dir: folder holding f_<i>_0_resize.jpg, f_<i>_1_joint_pos.json and f_<i>_2_confid.json
+    :param start_frame: first frame index (inclusive)
+    :param end_frame: last frame index (inclusive)
+    :param model_path: SMPL model file, loaded once per worker
+    :param sph_regs_path: regressors for capsules' axis and radius, enables the interpenetration term
+    :param workers: number of fitting processes
+    :param render_every: render do_degrees for every Nth frame only, 0 renders nothing
+    :param jtr_format: output of the joints, see deeprobot_outputs
+    :param store: boolean, if True the fit parameters are appended to the result store
+                  `<data_dir>/results_store` (see results_store) instead of `.pkl` files
+    :returns: the number of fitted frames
+    """
+    manifest_path = join(data_dir, 'manifest.jsonl')
+    result_store = None
+    if store:
+        result_store = results_store.ResultStore.open_or_create(
+            join(data_dir, 'results_store'), start_frame, end_frame)
+
+    def out_path_fn(i):
+        return deeprobot_paths(data_dir, i)['pkl']
+
+    frame_ids = [i for i in range(start_frame, end_frame + 1)
+                 if exists(deeprobot_paths(data_dir, i)['joints'])]
+    frame_ids = parallel_fit.pending_frames(frame_ids, manifest_path, out_path_fn, result_store)
+    _LOGGER.info('%d frames left to fit in `%s`.', len(frame_ids), data_dir)
+
+    def jobs():
+        for i in frame_ids:
+            paths = deeprobot_paths(data_dir, i, jtr_format)
+            img = cv2.imread(paths['img'])
+            joints_orig = load_json_array(paths['joints'])
+            conf_orig = load_json_array(paths['conf'])
+            yield (i, (img, joints_orig, conf_orig, paths['out_files'],
+                       n_betas, flength, pix_thsh,
+                       parallel_fit.render_degrees(do_degrees, render_every, i)),
+                   {'frame_idx': i})
+
+    n_fitted, _ = parallel_fit.run_pool(
+        jobs(), fit_frame, out_path_fn, manifest_path, model_path,
+        sph_regs_path=sph_regs_path, workers=workers, n_betas=n_betas,
+        flength=flength, store=result_store)
+    return n_fitted
 
 
 def main(base_dir,
@@ -651,7 +755,14 @@ def main(base_dir,
          flength=1160.,
          pix_thsh=25.,
          use_neutral=False,
-         viz=True):
+         viz=True,
+         data_dir=None,
+         start_frame=None,
+         end_frame=None,
+         workers=1,
+         render_every=1,
+         jtr_format='json',
+         store=False):
     """Set up paths to image and joint data, saves results.
     :param base_dir: folder containing LSP images and data
     :param out_dir: output folder
@@ -663,10 +774,19 @@ def main(base_dir,
                      the estimated one and its flip)
     :param use_neutral: boolean, if True enables uses the neutral gender SMPL model
     :param viz: boolean, if True enables visualization during optimization
+    :param data_dir: deeprobot data folder, if set frames start_frame..end_frame are fitted
+                     with fit_data_dir instead of input.jpg
+    :param start_frame: first frame index in data_dir (inclusive)
+    :param end_frame: last frame index in data_dir (inclusive)
+    :param workers: number of fitting processes used with data_dir
+    :param render_every: render the final fit of every Nth data_dir frame, 0 disables
+                         rendering (also for input.jpg)
+    :param jtr_format: output of the data_dir joints, 'json', 'npz' or 'both'
+    :param store: boolean, if True the data_dir fits go to its result store instead of `.pkl` files
     """
 
     img_dir = join(abspath(base_dir), 'images/lsp')
-    data_dir = join(abspath(base_dir), 'results/lsp')
+    data_dir_lsp = join(abspath(base_dir), 'results/lsp')
 
     if not exists(out_dir):
         makedirs(out_dir)
@@ -675,82 +795,55 @@ def main(base_dir,
     # Note that rendering many views can take a while.
     do_degrees = [0.]
 
+    if data_dir is not None:
+        fit_data_dir(
+            data_dir,
+            start_frame,
+            end_frame,
+            MODEL_MALE_PATH,
+            sph_regs_path=SPH_REGS_MALE_PATH if use_interpenetration else None,
+            n_betas=n_betas,
+            flength=flength,
+            pix_thsh=pix_thsh,
+            do_degrees=do_degrees,
+            workers=workers,
+            render_every=render_every,
+            jtr_format=jtr_format,
+            store=store)
+        return
+
     sph_regs = None
-    model = load_model(MODEL_MALE_PATH)
+    model = model_cache.load_model_fast(MODEL_MALE_PATH)
     if use_interpenetration:
         sph_regs = np.load(SPH_REGS_MALE_PATH)   
 
 
+    if render_every <= 0:
+        do_degrees = []
+
     # Load images
     img_path = 'input.jpg'
     out_path = 'output.pkl'
     if not exists(out_path):
         _LOGGER.info('Fitting 3D body on `%s` (saving to `%s`).', img_path, out_path)
         img = cv2.imread(img_path)
-        if img.ndim == 2:
-            _LOGGER.warn("The image is grayscale!")
-            img = np.dstack((img, img, img))
-        
-        with open('input_joints.json', 'r') as file:
-            joints_json = file.read()
-        joints_json_list = json.loads(joints_json)
-        joints_orig = np.array(joints_json_list)
-        joints = np.copy(joints_orig)
-        
-        with open('input_conf.json', 'r') as file:
-            conf_json = file.read()
-        conf_json_list = json.loads(conf_json)
-        conf_orig = np.array(conf_json_list)
-        conf = np.copy(conf_orig)
-        
-        #robot_ids = [-1, 4, 3, -1, 8, 7, -1, 12, 11, -1, -1, -1, -1, -1, -1, -1, 2, 1, 6, 5, 10, 9]
-        robot_ids = [11, 7, 3, 4, 8, 12, 9, 5, 1, 2, 6, 10, 0]
-
-        # joints_orig -> KIST(2)
-        # joints -> LSP
-
-        joints[0] = joints_orig[10]
-        joints[1] = joints_orig[9]
-        joints[2] = joints_orig[8]
-        joints[3] = joints_orig[11]
-        joints[4] = joints_orig[12]
-        joints[5] = joints_orig[13]
-        joints[6] = joints_orig[4]
-        joints[7] = joints_orig[3]
-        joints[8] = joints_orig[2]
-        joints[9] = joints_orig[5]
-        joints[10] = joints_orig[6]
-        joints[11] = joints_orig[7]
-        joints[12] = joints_orig[1]
-        joints[13] = joints_orig[0]
-        
-        conf[0] = conf_orig[10]
-        conf[1] = conf_orig[9]
-        conf[2] = conf_orig[8]
-        conf[3] = conf_orig[11]
-        conf[4] = conf_orig[12]
-        conf[5] = conf_orig[13]
-        conf[6] = conf_orig[4]
-        conf[7] = conf_orig[3]
-        conf[8] = conf_orig[2]
-        conf[9] = conf_orig[5]
-        conf[10] = conf_orig[6]
-        conf[11] = conf_orig[7]
-        conf[12] = conf_orig[1]
-        conf[13] = conf_orig[0]
-        
-        params, vis = run_single_fit(
+
+        joints_orig = load_json_array('input_joints.json')
+        conf_orig = load_json_array('input_conf.json')
+
+        params, vis = fit_frame(
             img,
-            joints,
-            conf,
-            model,
-            regs=sph_regs,
+            joints_orig,
+            conf_orig,
+            DEFAULT_OUT_FILES,
             n_betas=n_betas,
             flength=flength,
             pix_thsh=pix_thsh,
-            scale_factor=2,
+            do_degrees=do_degrees,
             viz=viz,
-            do_degrees=do_degrees)
+            model=model,
+            sph_regs=sph_regs,
+            jdirs=model_cache.load_jdirs(MODEL_MALE_PATH, n_betas, model))
         if viz:
             print("d")
             import matplotlib.pyplot as plt
@@ -758,7 +851,7 @@ def main(base_dir,
             plt.show()
             plt.subplot(121)
             plt.imshow(img[:, :, ::-1])
-            if do_degrees is not None:
+            if do_degrees:
                 for di, deg in enumerate(do_degrees):
                     plt.subplot(122)
                     plt.cla()
@@ -772,7 +865,7 @@ def main(base_dir,
             pickle.dump(params, outf)
 
         # This only saves the first rendering.
-        if do_degrees is not None:
+        if vis:
             cv2.imwrite(out_path.replace('.pkl', '.png'), vis[0])
 
 
@@ -824,6 +917,47 @@ if __name__ == '__main__':
         action='store_true',
         help="Turns on visualization of intermediate optimization steps "
         "and final results.")
+    parser.add_argument(
+        '--data_dir',
+        default=None,
+        type=str,
+        help="deeprobot data folder (f_<i>_0_resize.jpg, f_<i>_1_joint_pos.json, "
+        "f_<i>_2_confid.json). If set, frames --start_frame..--end_frame are "
+        "fitted instead of input.jpg.")
+    parser.add_argument(
+        '--start_frame',
+        default=0,
+        type=int,
+        help="First frame index in --data_dir (inclusive).")
+    parser.add_argument(
+        '--end_frame',
+        default=0,
+        type=int,
+        help="Last frame index in --data_dir (inclusive).")
+    parser.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help="Number of processes fitting --data_dir frames in parallel. Each "
+        "worker loads the model and the pose prior once.")
+    parser.add_argument(
+        '--render',
+        default=1,
+        type=parallel_fit.parse_render_policy,
+        help="Rendering of the final fits (.png): 'none', 'final' for every "
+        "frame, or N for every Nth --data_dir frame.")
+    parser.add_argument(
+        '--jtr_format',
+        default='json',
+        choices=JTR_FORMATS,
+        help="Output of the fitted --data_dir joints: 'json' files per frame convention, "
+        "one 'npz' record (see jtr_export.py) or 'both'.")
+    parser.add_argument(
+        '--store',
+        default=False,
+        action='store_true',
+        help="Append the --data_dir fits to <data_dir>/results_store (see "
+        "results_store.py) instead of writing one .pkl per frame.")
     args = parser.parse_args()
 
     use_interpenetration = not args.no_interpenetration
@@ -843,6 +977,7 @@ if __name__ == '__main__':
     MODEL_MALE_PATH = join(MODEL_DIR,
                            'basicmodel_m_lbs_10_207_0_v1.0.0.pkl')
 
+    SPH_REGS_MALE_PATH = None
     if use_interpenetration:
         # paths to the npz files storing the regressors for capsules
         SPH_REGS_NEUTRAL_PATH = join(MODEL_DIR,
@@ -853,4 +988,6 @@ if __name__ == '__main__':
                                   'regressors_locked_normalized_male.npz')
 
     main(args.base_dir, args.out_dir, use_interpenetration, args.n_betas,
-         args.flength, args.side_view_thsh, args.gender_neutral, args.viz)
+         args.flength, args.side_view_thsh, args.gender_neutral, args.viz,
+         args.data_dir, args.start_frame, args.end_frame, args.workers,
+         args.render, args.jtr_format, args.store)
@@ -0,0 +1,285 @@
+"""
+Long-lived SMPLify fitting service for deeprobot frames.
+
+The server loads the SMPL model, the sphere regressors, the pose prior and the
+joint cache once and then fits jobs read as JSON lines, either from stdin or
+from the clients of a Unix socket. A job is
+    {"img": "Set1_V6/f_2100_0_resize.jpg",
+     "joints": "Set1_V6/f_2100_1_joint_pos.json",   (path or 18x2 list)
+     "conf": "Set1_V6/f_2100_2_confid.json",        (path or 18 list)
+     "prefix": "Set1_V6/f_2100"}
+and writes the deeprobot.sh outputs `<prefix>_3_joint_3d_smplify{1..4}.json`
+(or a `.npz` joint record, see --jtr_format),
+`<prefix>_4_output_smplify.{pkl,png,json}`. Every job is answered with one
+JSON line. Frames whose `.pkl` exists are skipped unless the job sets "force".
+
+    python fit_server.py submit --data_dir Set1_V6 --start_frame 2100 --end_frame 2350 \
+        | python fit_server.py serve
+fits a frame range in one process; with --socket, `serve` listens on a Unix
+socket and `submit` sends its jobs there and prints the replies.
+"""
+
+from os.path import exists, join, abspath, dirname
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+
+import cv2
+import numpy as np
+
+import fit_3d_robot as fit
+import model_cache
+import parallel_fit
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class FitServer(object):
+    """Fits deeprobot jobs with resources loaded once."""
+
+    def __init__(self, model_path, sph_regs_path=None, n_betas=10, flength=5000.,
+                 pix_thsh=25., do_degrees=None, render_every=1, jtr_format='json'):
+        from lib.max_mixture_prior import MaxMixtureCompletePrior
+
+        t0 = time.time()
+        self.model = model_cache.load_model_fast(model_path)
+        self.sph_regs = np.load(sph_regs_path) if sph_regs_path else None
+        self.prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
+        self.jdirs = model_cache.load_jdirs(model_path, n_betas, self.model)
+        self.cam = parallel_fit.make_camera(flength)
+        self.n_betas = n_betas
+        self.flength = flength
+        self.pix_thsh = pix_thsh
+        self.do_degrees = [0.] if do_degrees is None else do_degrees
+        self.render_every = render_every
+        self.jtr_format = jtr_format
+        self.n_jobs = 0
+        _LOGGER.info('Fitting server ready in %.1f s.', time.time() - t0)
+
+    def handle(self, job):
+        """Fit one job.
+        :param job: dict with img, joints, conf and prefix (see the module docstring)
+        :returns: the reply dict
+        """
+        paths = fit.deeprobot_outputs(job['prefix'], self.jtr_format)
+        reply = {'prefix': job['prefix'], 'pkl': paths['pkl']}
+        if 'id' in job:
+            reply['id'] = job['id']
+        if exists(paths['pkl']) and not job.get('force', False):
+            reply['status'] = 'skipped'
+            return reply
+
+        t0 = time.time()
+        img = cv2.imread(job['img'])
+        if img is None:
+            raise IOError('could not read `%s`' % job['img'])
+        joints_orig = self._array(job['joints'])
+        conf_orig = self._array(job['conf'])
+        frame_idx = job['id'] if isinstance(job.get('id'), int) else self.n_jobs
+        params, vis = fit.fit_frame(
+            img,
+            joints_orig,
+            conf_orig,
+            paths['out_files'],
+            n_betas=self.n_betas,
+            flength=self.flength,
+            pix_thsh=self.pix_thsh,
+            do_degrees=parallel_fit.render_degrees(
+                self.do_degrees, self.render_every, frame_idx),
+            model=self.model,
+            sph_regs=self.sph_regs,
+            prior=self.prior,
+            jdirs=self.jdirs,
+            cam=self.cam,
+            frame_idx=frame_idx)
+        parallel_fit.write_result(paths['pkl'], params, vis[0] if vis else None)
+        self.n_jobs += 1
+        reply.update(status='ok', time=round(time.time() - t0, 3))
+        return reply
+
+    @staticmethod
+    def _array(value):
+        if isinstance(value, list):
+            return np.array(value)
+        return fit.load_json_array(value)
+
+    def serve_lines(self, lines, write):
+        """Answer JSON-line jobs until the input ends or a {"cmd": "shutdown"} line.
+        :param lines: iterable of job lines
+        :param write: function called with every reply line
+        :returns: False if a shutdown was requested
+        """
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+                if job.get('cmd') == 'shutdown':
+                    write(json.dumps({'status': 'shutdown'}) + '\n')
+                    return False
+                reply = self.handle(job)
+            except Exception as e:
+                _LOGGER.exception('job failed: %s', line)
+                reply = {'status': 'error', 'error': repr(e), 'job': line}
+            write(json.dumps(reply) + '\n')
+        return True
+
+    def serve_stdin(self):
+        """Read jobs from stdin and write the replies to stdout."""
+        # the fit prints its progress, keep stdout for the replies
+        out = sys.stdout
+        sys.stdout = sys.stderr
+
+        def write(line):
+            out.write(line)
+            out.flush()
+
+        self.serve_lines(iter(sys.stdin.readline, ''), write)
+
+    def serve_socket(self, socket_path):
+        """Accept clients on a Unix socket, one at a time, until a shutdown job."""
+        if exists(socket_path):
+            os.remove(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(1)
+        _LOGGER.info('Listening on `%s`.', socket_path)
+        try:
+            running = True
+            while running:
+                conn, _ = server.accept()
+                lines = conn.makefile('r')
+                try:
+                    running = self.serve_lines(iter(lines.readline, ''), conn.sendall)
+                except socket.error as e:
+                    _LOGGER.warn('client disconnected: %s', e)
+                finally:
+                    lines.close()
+                    conn.close()
+        finally:
+            server.close()
+            os.remove(socket_path)
+        _LOGGER.info('Fitted %d frames.', self.n_jobs)
+
+
+def deeprobot_jobs(data_dir, start_frame, end_frame, force=False):
+    """Jobs for the frames of a deeprobot data folder that have joints."""
+    for i in range(start_frame, end_frame + 1):
+        paths = fit.deeprobot_paths(data_dir, i)
+        if not exists(paths['joints']):
+            continue
+        job = {'id': i, 'img': paths['img'], 'joints': paths['joints'],
+               'conf': paths['conf'], 'prefix': join(data_dir, 'f_' + str(i))}
+        if force:
+            job['force'] = True
+        yield job
+
+
+def submit(jobs, socket_path=None, shutdown=False):
+    """Send jobs to a server and print its replies.
+    Without socket_path the job lines are printed, to be piped into `serve`.
+    :returns: the number of failed jobs
+    """
+    if socket_path is None:
+        for job in jobs:
+            sys.stdout.write(json.dumps(job) + '\n')
+        sys.stdout.flush()
+        return 0
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    replies = client.makefile('r')
+    n_failed = 0
+    try:
+        for job in jobs:
+            client.sendall(json.dumps(job) + '\n')
+            reply = replies.readline()
+            print(reply.strip())
+            n_failed += json.loads(reply).get('status') == 'error'
+        if shutdown:
+            client.sendall(json.dumps({'cmd': 'shutdown'}) + '\n')
+            replies.readline()
+    finally:
+        replies.close()
+        client.close()
+    return n_failed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    MODEL_DIR = join(abspath(dirname(__file__)), 'models')
+    parser = argparse.ArgumentParser(description='SMPLify fitting server for deeprobot frames')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help="load the model once and fit jobs")
+    serve_parser.add_argument(
+        '--socket',
+        default=None,
+        help="Unix socket to listen on, jobs are read from stdin if not set")
+    serve_parser.add_argument(
+        '--model',
+        default=join(MODEL_DIR, 'basicmodel_m_lbs_10_207_0_v1.0.0.pkl'),
+        help="SMPL model file")
+    serve_parser.add_argument(
+        '--no_interpenetration',
+        default=False,
+        action='store_true',
+        help="Using this flag removes the interpenetration term.")
+    serve_parser.add_argument('--n_betas', default=10, type=int)
+    serve_parser.add_argument('--flength', default=5000, type=float)
+    serve_parser.add_argument('--side_view_thsh', default=25, type=float)
+    serve_parser.add_argument(
+        '--render',
+        default=1,
+        type=parallel_fit.parse_render_policy,
+        help="Rendering of the final fits (.png): 'none', 'final' for every "
+        "frame, or N for every Nth frame.")
+    serve_parser.add_argument(
+        '--jtr_format',
+        default='json',
+        choices=fit.JTR_FORMATS,
+        help="Output of the fitted joints: the smplify{1..4}.json files, "
+        "one `<prefix>_3_joint_3d_smplify.npz` record or 'both'.")
+
+    submit_parser = subparsers.add_parser('submit', help="send the jobs of a deeprobot data folder")
+    submit_parser.add_argument('--data_dir', required=True, help="e.g. Set1_V6")
+    submit_parser.add_argument('--start_frame', required=True, type=int)
+    submit_parser.add_argument('--end_frame', required=True, type=int)
+    submit_parser.add_argument(
+        '--socket',
+        default=None,
+        help="Unix socket of a running server, the job lines are printed if not set")
+    submit_parser.add_argument(
+        '--force',
+        default=False,
+        action='store_true',
+        help="Refit frames that already have a .pkl.")
+    submit_parser.add_argument(
+        '--shutdown',
+        default=False,
+        action='store_true',
+        help="Stop the server after the jobs.")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        sph_regs_path = None
+        if not args.no_interpenetration:
+            sph_regs_path = join(MODEL_DIR, 'regressors_locked_normalized_male.npz')
+        server = FitServer(args.model, sph_regs_path, n_betas=args.n_betas,
+                           flength=args.flength, pix_thsh=args.side_view_thsh,
+                           render_every=args.render, jtr_format=args.jtr_format)
+        if args.socket is None:
+            server.serve_stdin()
+        else:
+            server.serve_socket(args.socket)
+    else:
+        n_failed = submit(deeprobot_jobs(args.data_dir, args.start_frame, args.end_frame,
+                                         args.force),
+                          args.socket, args.shutdown)
+        sys.exit(1 if n_failed else 0)
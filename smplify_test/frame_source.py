@@ -0,0 +1,131 @@
+"""
+Sequential video frame source for the sequence fitters.
+
+Seeking with cv2.CAP_PROP_POS_FRAMES makes H.264 decode again from the
+previous keyframe for every frame. decode_frames seeks once to the first
+requested frame and then decodes forward, skipping unrequested frames with
+grab(), on a background thread that keeps a few frames ahead of the fit.
+ImageWriter moves debug image encoding off the fitting thread as well.
+"""
+
+import logging
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import cv2
+
+_LOGGER = logging.getLogger(__name__)
+
+# a gap longer than this many frames is crossed with a seek instead of grab()
+MAX_GRAB_GAP = 250
+
+_END = object()
+
+
+def _decode(input_video_path, frames, scale_factor, out, stop):
+    """Decode the frames in order and put (frame index, image, joints, conf) into out."""
+    cap = cv2.VideoCapture(input_video_path)
+    try:
+        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        _LOGGER.info('Decoding `%s` (%dx%d).', input_video_path, width, height)
+        size = (int(width / scale_factor), int(height / scale_factor))
+
+        pos = None
+        for frame_idx, joints_orig, conf_orig in frames:
+            if stop.is_set():
+                return
+            if pos is None or frame_idx < pos or frame_idx - pos > MAX_GRAB_GAP:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                pos = frame_idx
+            while pos < frame_idx and cap.grab():
+                pos += 1
+            success, video_frame = cap.read() if pos == frame_idx else (False, None)
+            if not success:
+                _LOGGER.warn('Could not read frame %d from `%s`.', frame_idx, input_video_path)
+                # resynchronize with a seek on the next frame
+                pos = None
+                continue
+            pos += 1
+
+            if scale_factor != 1:
+                img = cv2.resize(video_frame, size)
+            else:
+                img = video_frame
+            out.put((frame_idx, img, joints_orig, conf_orig))
+    except Exception as e:
+        out.put(e)
+    finally:
+        cap.release()
+        out.put(_END)
+
+
+def decode_frames(input_video_path, frames, scale_factor=1, prefetch=8):
+    """Yield (frame index, image, joints, conf) for the frameset entries.
+    The frames are decoded in index order on a prefetch thread.
+    :param input_video_path: video the frameset was detected on
+    :param frames: list of (frame index, joints, conf) tuples
+    :param scale_factor: image downscale factor
+    :param prefetch: number of decoded frames buffered ahead of the consumer
+    """
+    frames = sorted(frames, key=lambda frame: frame[0])
+    out = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    thread = threading.Thread(target=_decode,
+                              args=(input_video_path, frames, scale_factor, out, stop))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # the consumer may stop early, unblock the decoder and let it release the video
+        stop.set()
+        while thread.is_alive():
+            try:
+                out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+class ImageWriter(object):
+    """Encode and write images on a background thread."""
+
+    def __init__(self, max_pending=16):
+        """
+        :param max_pending: images queued before write() blocks
+        """
+        self.n_written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            path, img = item
+            if cv2.imwrite(path, img):
+                self.n_written += 1
+            else:
+                _LOGGER.warn('Could not write `%s`.', path)
+
+    def write(self, path, img):
+        """Queue an image, it must not be modified afterwards."""
+        self._queue.put((path, img))
+
+    def close(self):
+        """Wait for the queued images to be written."""
+        self._queue.put(_END)
+        self._thread.join()
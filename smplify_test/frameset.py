@@ -0,0 +1,140 @@
+"""
+Bulk reader of the OpenPose framesets (Frameset_Joints_Cam2D_*_opose25.json).
+
+A frameset is converted once into a (F, 25, 3) float32 array of
+(x, y, confidence) joints and a (F,) array of frame indices, sorted by
+frame, and cached next to the json as
+
+    <frameset>.joints.npy
+    <frameset>.frames.npy
+
+The cache is rebuilt when the json is newer. Later reads memory-map the
+arrays and slice a frame range with a binary search, without a per-frame
+Python loop. Framesets too large to parse into one document are read
+incrementally with ijson (pip install ijson).
+"""
+
+from os.path import exists, getmtime, getsize, splitext
+import os
+import json
+import logging
+
+import numpy as np
+
+_LOGGER = logging.getLogger(__name__)
+
+# framesets larger than this are streamed with ijson when it is installed
+STREAM_SIZE = 256 << 20
+
+
+def cache_paths(json_path):
+    """(joints, frames) `.npy` cache paths of a frameset."""
+    base = splitext(json_path)[0]
+    return (base + '.joints.npy', base + '.frames.npy')
+
+
+def _iter_frames_stream(json_path):
+    import ijson
+
+    with open(json_path, 'rb') as f:
+        try:
+            items = ijson.items(f, 'Set.item', use_float=True)
+        except TypeError:
+            # ijson < 3.1 yields Decimal numbers, converted by np.asarray below
+            items = ijson.items(f, 'Set.item')
+        for frame in items:
+            yield frame['F'], frame['J']
+
+
+def _iter_frames(json_path):
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    for frame in data['Set']:
+        yield frame['F'], frame['J']
+
+
+def convert_frameset(json_path, stream=None):
+    """Parse a frameset into arrays.
+    :param json_path: path to a Frameset_Joints_Cam2D_*_opose25.json file
+    :param stream: boolean, if True the json is read incrementally with ijson;
+                   None streams files larger than STREAM_SIZE if ijson is installed
+    :returns: a tuple ((F,) int64 frame indices, (F, J, 3) float32 joints), sorted by frame
+    """
+    if stream is None:
+        stream = getsize(json_path) > STREAM_SIZE
+        if stream:
+            try:
+                import ijson  # noqa
+            except ImportError:
+                _LOGGER.warn('`%s` is large but ijson is not installed, parsing it at once.',
+                             json_path)
+                stream = False
+    frames_iter = _iter_frames_stream(json_path) if stream else _iter_frames(json_path)
+
+    frame_ids = []
+    joints = []
+    for frame_idx, frame_joints in frames_iter:
+        frame_ids.append(int(frame_idx))
+        joints.append(np.asarray(frame_joints, dtype=np.float32)[:, :3])
+    frame_ids = np.array(frame_ids, dtype=np.int64)
+    if joints:
+        joints = np.stack(joints)
+    else:
+        joints = np.zeros((0, 25, 3), dtype=np.float32)
+
+    order = np.argsort(frame_ids, kind='mergesort')
+    return frame_ids[order], joints[order]
+
+
+def _save_npy(path, array):
+    tmp_path = '%s.%d.tmp.npy' % (splitext(path)[0], os.getpid())
+    np.save(tmp_path, array)
+    os.rename(tmp_path, path)
+
+
+def load_frameset_arrays(json_path, stream=None, cache=True):
+    """Frame indices and joints of a frameset, from its `.npy` cache when up to date.
+    :param json_path: path to a Frameset_Joints_Cam2D_*_opose25.json file
+    :param stream: see convert_frameset
+    :param cache: boolean, if True the arrays are cached next to the json and memory-mapped
+    :returns: a tuple ((F,) frame indices, (F, J, 3) float32 joints), sorted by frame
+    """
+    joints_path, frames_path = cache_paths(json_path)
+    if cache and exists(joints_path) and exists(frames_path):
+        json_mtime = getmtime(json_path)
+        if getmtime(joints_path) >= json_mtime and getmtime(frames_path) >= json_mtime:
+            return (np.load(frames_path, mmap_mode='r'), np.load(joints_path, mmap_mode='r'))
+
+    frame_ids, joints = convert_frameset(json_path, stream)
+    if cache:
+        try:
+            _save_npy(joints_path, joints)
+            _save_npy(frames_path, frame_ids)
+        except (IOError, OSError) as e:
+            _LOGGER.warn('Could not cache `%s`: %s', json_path, e)
+    return frame_ids, joints
+
+
+def frame_range(frame_ids, joints, start_frame=None, end_frame=None):
+    """Slice sorted frameset arrays to a frame range.
+    :param start_frame: first frame index (inclusive), None for the first frame
+    :param end_frame: last frame index (inclusive), None for the last frame
+    :returns: a tuple (frame indices, joints) of the frames inside the range
+    """
+    lo = 0 if start_frame is None else np.searchsorted(frame_ids, start_frame, side='left')
+    hi = len(frame_ids) if end_frame is None else np.searchsorted(frame_ids, end_frame, side='right')
+    return frame_ids[lo:hi], joints[lo:hi]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='convert OpenPose framesets to cached .npy arrays')
+    parser.add_argument('json_paths', nargs='+', help="Frameset_Joints_Cam2D_*_opose25.json files")
+    parser.add_argument('--stream', default=False, action='store_true',
+                        help="Read the json incrementally with ijson.")
+    args = parser.parse_args()
+    for json_path in args.json_paths:
+        frame_ids, joints = load_frameset_arrays(json_path, stream=args.stream or None)
+        _LOGGER.info('`%s`: %d frames.', json_path, len(frame_ids))
@@ -0,0 +1,173 @@
+"""
+Export of the fitted SMPL joints in the coordinate frames used downstream.
+
+run_single_fit used to write one json file per frame convention, each computed
+joint by joint. joint_frames computes all of them for a batch of fits with a
+few matrix products:
+
+    jtr   J                 joints in the SMPL model frame
+    jtr2  R J + 10 t        rotated by the camera, translation scaled by 10
+    jtr3  R^-1 J - t        inverse camera rotation, translation subtracted
+    jtr4  R J + t           camera frame (the 4x4 [R|t] transform)
+
+with R the rotation of cam.rt and t = cam.t. A record (`.npz`) holds these
+arrays for one or more frames, their frame indices and camera parameters and
+a json header naming the conventions; per-frame records are merged into one
+sequence record with
+
+    python jtr_export.py Seq1_jtr.npz Seq1/USB_Sync_Left_*_jtr.npz
+"""
+
+from collections import OrderedDict
+from os.path import splitext
+import os
+import json
+import logging
+
+import numpy as np
+
+import batch_fk
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD_VERSION = 1
+
+# output key -> frame convention, in the order of the legacy json files
+JTR_FRAMES = OrderedDict([
+    ('jtr', 'J'),
+    ('jtr2', 'R J + 10 t'),
+    ('jtr3', 'R^-1 J - t'),
+    ('jtr4', 'R J + t'),
+])
+
+
+def joint_frames(joints, cam_rt, cam_t):
+    """Express fitted joints in every frame of JTR_FRAMES.
+    :param joints: (F, 24, 3) or (24, 3) joints in the model frame
+    :param cam_rt: (F, 3) or (3,) camera rotations (axis-angle)
+    :param cam_t: (F, 3) or (3,) camera translations
+    :returns: OrderedDict key -> joints, shaped as the input joints
+    """
+    joints = np.asarray(joints, dtype=np.float64)
+    single = joints.ndim == 2
+    J = joints.reshape((-1,) + joints.shape[-2:])
+    t = np.asarray(cam_t, dtype=np.float64).reshape(-1, 1, 3)
+    R = batch_fk.batch_rodrigues(np.asarray(cam_rt).reshape(-1, 3))
+
+    RJ = np.einsum('fab,fjb->fja', R, J)
+    # R is a rotation, R^-1 = R^T
+    RtJ = np.einsum('fba,fjb->fja', R, J)
+    frames = OrderedDict([
+        ('jtr', J),
+        ('jtr2', RJ + 10 * t),
+        ('jtr3', RtJ - t),
+        ('jtr4', RJ + t),
+    ])
+    if single:
+        for key in frames:
+            frames[key] = frames[key][0]
+    return frames
+
+
+def record_header(joint_names=None):
+    """Json header of a record, naming the frame conventions."""
+    header = {'version': RECORD_VERSION,
+              'frames': JTR_FRAMES,
+              'R': 'Rodrigues(cam_rt)',
+              't': 'cam_t'}
+    if joint_names is not None:
+        header['joints'] = list(joint_names)
+    return json.dumps(header)
+
+
+def write_record(path, frame_ids, joints, cam_rt, cam_t):
+    """Write the joint frames of one or more fits as one `.npz` record.
+    The file is written under a temporary name and renamed.
+    :param path: output `.npz` path
+    :param frame_ids: F frame indices
+    :param joints: (F, 24, 3) joints in the model frame
+    :param cam_rt: (F, 3) camera rotations
+    :param cam_t: (F, 3) camera translations
+    """
+    joints = np.asarray(joints, dtype=np.float64).reshape(-1, 24, 3)
+    cam_rt = np.asarray(cam_rt, dtype=np.float64).reshape(-1, 3)
+    cam_t = np.asarray(cam_t, dtype=np.float64).reshape(-1, 3)
+    arrays = joint_frames(joints, cam_rt, cam_t)
+    arrays.update(header=np.array(record_header()),
+                  frame_ids=np.asarray(frame_ids, dtype=np.int64).reshape(-1),
+                  cam_rt=cam_rt,
+                  cam_t=cam_t)
+    tmp_path = '%s.%d.tmp.npz' % (splitext(path)[0], os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+
+
+def read_record(path):
+    """Load a record written by write_record.
+    :returns: a tuple (header dict, dict of arrays)
+    """
+    data = np.load(path)
+    try:
+        arrays = dict((key, data[key]) for key in data.files)
+    finally:
+        data.close()
+    header = json.loads(str(arrays.pop('header')))
+    if header.get('version') != RECORD_VERSION:
+        raise ValueError('`%s` has record version %s, expected %d'
+                         % (path, header.get('version'), RECORD_VERSION))
+    return header, arrays
+
+
+def merge_records(paths, out_path):
+    """Concatenate records into one sequence record, sorted by frame index.
+    :returns: the number of frames written
+    """
+    parts = [read_record(path)[1] for path in paths]
+    if not parts:
+        raise ValueError('no records to merge')
+    frame_ids = np.concatenate([part['frame_ids'] for part in parts])
+    order = np.argsort(frame_ids, kind='mergesort')
+    joints = np.concatenate([part['jtr'] for part in parts])[order]
+    cam_rt = np.concatenate([part['cam_rt'] for part in parts])[order]
+    cam_t = np.concatenate([part['cam_t'] for part in parts])[order]
+    write_record(out_path, frame_ids[order], joints, cam_rt, cam_t)
+    return len(order)
+
+
+def export_joints(joints, cam_rt, cam_t, out_files, frame_idx=None):
+    """Write the outputs of a fit selected by the keys of out_files.
+    Every JTR_FRAMES key of out_files gets a json file (a 24x3 list) and
+    'record' a single `.npz` record. The joints are logged at debug level.
+    :param joints: 24x3 joints in the model frame
+    :param cam_rt: camera rotation (axis-angle)
+    :param cam_t: camera translation
+    :param out_files: dict of output paths
+    :param frame_idx: frame index stored in the record, -1 if unknown
+    :returns: OrderedDict key -> 24x3 joints
+    """
+    frames = joint_frames(joints, cam_rt, cam_t)
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+        _LOGGER.debug('cam_translation: %s', np.asarray(cam_t) * 10)
+        for key, convention in JTR_FRAMES.items():
+            _LOGGER.debug('%s (%s):\n%s', key, convention, frames[key])
+
+    for key in JTR_FRAMES:
+        if key in out_files:
+            with open(out_files[key], 'w') as json_file:
+                json.dump(frames[key].tolist(), json_file)
+    if 'record' in out_files:
+        write_record(out_files['record'], [-1 if frame_idx is None else frame_idx],
+                     joints, cam_rt, cam_t)
+    return frames
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='merge per-frame joint records into one')
+    parser.add_argument('out_path', help="sequence record to write (.npz)")
+    parser.add_argument('record_paths', nargs='+', help="per-frame records")
+    args = parser.parse_args()
+    n_frames = merge_records(args.record_paths, args.out_path)
+    _LOGGER.info('Wrote %d frames to `%s`.', n_frames, args.out_path)
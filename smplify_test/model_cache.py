@@ -0,0 +1,286 @@
+"""
+Caches of data derived from the SMPL model files.
+
+The shape-to-joint directions (Jdirs), the template joints
+(J_regressor . v_template) and the kinematic tree parents only depend on the
+model file. They are computed once and saved next to the model as
+`<model>.jcache.npz`, keyed by the SHA-1 of the model file, so the fitting
+scripts and converters load them instead of regressing the 6890 vertices of
+every shape direction again.
+
+load_model_fast replaces smpl_webuser's load_model: the arrays of the model
+pickle are written once to an uncompressed `.npy` folder (`<model>_arrays/`)
+and memory-mapped read-only afterwards, so every process (pool workers, shell
+loops) starts without unpickling chumpy objects and shares the same pages.
+
+    python model_cache.py models/*.pkl
+converts the models and builds their joint caches ahead of time.
+"""
+
+from os.path import exists, splitext, join
+import os
+import shutil
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+import batch_fk
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    """SHA-1 hex digest of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            sha1.update(chunk)
+            chunk = f.read(chunk_size)
+    return sha1.hexdigest()
+
+
+def file_stamp(path):
+    """Size and modification time of a file, a cheap check before hashing it."""
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime], dtype=np.float64)
+
+
+def joint_cache_path(model_path):
+    return splitext(model_path)[0] + '.jcache.npz'
+
+
+def save_npz(path, arrays):
+    """Write an uncompressed `.npz` atomically, concurrent readers never see a partial file.
+    Failures (e.g. a read-only model folder) are logged and ignored.
+    """
+    tmp_path = '%s.%d.tmp.npz' % (splitext(path)[0], os.getpid())
+    try:
+        np.savez(tmp_path, **arrays)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        _LOGGER.warn('Could not write `%s`: %s', path, e)
+        if exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def compute_joint_cache(model):
+    """Regress every shape direction and the template onto the SMPL joints.
+    :param model: SMPL model
+    :returns: dict with Jdirs (24x3xN), J_template (24x3) and parents (24)
+    """
+    shapedirs = getattr(model.shapedirs, 'r', model.shapedirs)
+    Jdirs = np.dstack([model.J_regressor.dot(shapedirs[:, :, i])
+                       for i in range(shapedirs.shape[2])])
+    return {'Jdirs': Jdirs,
+            'J_template': model.J_regressor.dot(getattr(model.v_template, 'r', model.v_template)),
+            'parents': batch_fk.parents_from_kintree(model.kintree_table)}
+
+
+def compute_jdirs(model, n_betas=10):
+    """Regress the shape directions and the template onto the SMPL joints.
+    :param model: SMPL model
+    :param n_betas: number of shape coefficients considered during optimization
+    :returns: a tuple (24x3xn_betas joint shape directions, 24x3 template joints)
+    """
+    cache = compute_joint_cache(model)
+    return (cache['Jdirs'][:, :, :n_betas], cache['J_template'])
+
+
+def load_joint_cache(model_path, model=None):
+    """Load the joint cache of a model file, building it if missing or stale.
+    :param model_path: SMPL model file
+    :param model: the loaded model, avoids loading it again when the cache is rebuilt
+    :returns: dict with Jdirs (24x3xN), J_template (24x3) and parents (24)
+    """
+    cache_path = joint_cache_path(model_path)
+    stamp = file_stamp(model_path)
+    sha1 = None
+    if exists(cache_path):
+        data = np.load(cache_path)
+        cache = dict((key, data[key]) for key in data.files)
+        data.close()
+        if np.array_equal(cache['stamp'], stamp):
+            return cache
+        sha1 = file_sha1(model_path)
+        if str(cache['sha1']) == sha1:
+            # touched but unchanged
+            cache['stamp'] = stamp
+            save_npz(cache_path, cache)
+            return cache
+        _LOGGER.info('`%s` changed, rebuilding `%s`.', model_path, cache_path)
+
+    if model is None:
+        from smpl_webuser.serialization import load_model
+        model = load_model(model_path)
+    cache = compute_joint_cache(model)
+    cache['sha1'] = np.array(sha1 or file_sha1(model_path))
+    cache['stamp'] = stamp
+    save_npz(cache_path, cache)
+    return cache
+
+
+def load_jdirs(model_path, n_betas=10, model=None):
+    """Shape-to-joint directions of a model file, as returned by compute_jdirs.
+    :returns: a tuple (24x3xn_betas joint shape directions, 24x3 template joints)
+    """
+    cache = load_joint_cache(model_path, model)
+    return (cache['Jdirs'][:, :, :n_betas], cache['J_template'])
+
+
+# arrays of the model pickle kept by convert_model; smpl_webuser's
+# backwards_compatibility_replacements needs 'J' (or the legacy 'joints')
+MODEL_ARRAYS = ('v_template', 'shapedirs', 'posedirs', 'J_regressor', 'weights',
+                'kintree_table', 'f', 'J')
+# version of the array folder layout, folders of another version are converted again
+MODEL_FORMAT = 2
+# blend skinning settings read by ready_arguments
+MODEL_VALUES = ('bs_style', 'bs_type')
+
+
+def model_array_dir(model_path):
+    return splitext(model_path)[0] + '_arrays'
+
+
+def _read_meta(array_dir):
+    meta_path = join(array_dir, 'meta.json')
+    if not exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def _plain(value):
+    # chumpy values of the pickle as plain arrays
+    return value.r if hasattr(value, 'dterms') else value
+
+
+def convert_model(model_path, array_dir=None):
+    """Write the arrays of a SMPL model pickle as `.npy` files for load_model_fast.
+    The sparse J_regressor is stored as its CSC data/indices/indptr arrays.
+    :param model_path: SMPL model pickle
+    :param array_dir: output folder, default `<model>_arrays`
+    :returns: the output folder
+    """
+    import cPickle as pickle
+    import scipy.sparse as sp
+
+    if array_dir is None:
+        array_dir = model_array_dir(model_path)
+    with open(model_path, 'rb') as f:
+        dd = pickle.load(f)
+
+    tmp_dir = '%s.%d.tmp' % (array_dir, os.getpid())
+    if exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    if 'J' not in dd:
+        # legacy pickles name the template joints 'joints'
+        dd['J'] = dd['joints'] if 'joints' in dd else dd['J_regressor'].dot(_plain(dd['v_template']))
+    meta = {'format': MODEL_FORMAT,
+            'sha1': file_sha1(model_path),
+            'stamp': file_stamp(model_path).tolist(),
+            'sparse': {},
+            'values': dict((key, dd[key]) for key in MODEL_VALUES if key in dd)}
+    for key in MODEL_ARRAYS:
+        value = _plain(dd[key])
+        if sp.issparse(value):
+            value = value.tocsc()
+            for part in ('data', 'indices', 'indptr'):
+                np.save(join(tmp_dir, '%s_%s.npy' % (key, part)), getattr(value, part))
+            meta['sparse'][key] = list(value.shape)
+        else:
+            np.save(join(tmp_dir, key + '.npy'), np.ascontiguousarray(value))
+    with open(join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+    if exists(array_dir):
+        current = _read_meta(array_dir)
+        if (current is not None and current.get('format') == MODEL_FORMAT and
+                current['sha1'] == meta['sha1']):
+            # converted meanwhile by another process (e.g. a pool worker)
+            shutil.rmtree(tmp_dir)
+            return array_dir
+        shutil.rmtree(array_dir)
+    os.rename(tmp_dir, array_dir)
+    _LOGGER.info('Converted `%s` to `%s`.', model_path, array_dir)
+    return array_dir
+
+
+def load_model_arrays(array_dir, meta=None):
+    """Memory-map the arrays written by convert_model.
+    :returns: dict of read-only arrays (J_regressor as a CSC matrix) and skinning settings
+    """
+    import scipy.sparse as sp
+
+    if meta is None:
+        meta = _read_meta(array_dir)
+    dd = dict(meta['values'])
+    for key in MODEL_ARRAYS:
+        if key in meta['sparse']:
+            parts = [np.load(join(array_dir, '%s_%s.npy' % (key, part)), mmap_mode='r')
+                     for part in ('data', 'indices', 'indptr')]
+            dd[key] = sp.csc_matrix(tuple(parts), shape=tuple(meta['sparse'][key]))
+        else:
+            dd[key] = np.load(join(array_dir, key + '.npy'), mmap_mode='r')
+    return dd
+
+
+def load_model_fast(model_path, convert=True):
+    """Load a SMPL model from its memory-mapped array folder.
+    The folder is written on first use and rebuilt when the pickle changes; if it
+    cannot be written, the pickle is loaded as usual.
+    :param model_path: SMPL model pickle
+    :param convert: boolean, if False a missing or stale folder falls back to the pickle
+    :returns: the SMPL model, as smpl_webuser.serialization.load_model
+    """
+    import chumpy as ch
+    from smpl_webuser.serialization import load_model
+
+    array_dir = model_array_dir(model_path)
+    meta = _read_meta(array_dir)
+    if meta is not None and meta.get('format') != MODEL_FORMAT:
+        # written before 'J' was kept
+        meta = None
+    if meta is not None and exists(model_path) and meta['stamp'] != file_stamp(model_path).tolist():
+        if meta['sha1'] == file_sha1(model_path):
+            # touched but unchanged
+            meta['stamp'] = file_stamp(model_path).tolist()
+            try:
+                with open(join(array_dir, 'meta.json'), 'w') as f:
+                    json.dump(meta, f, indent=4)
+            except (IOError, OSError):
+                pass
+        else:
+            meta = None
+
+    if meta is None:
+        if not convert:
+            return load_model(model_path)
+        try:
+            convert_model(model_path, array_dir)
+        except (IOError, OSError) as e:
+            _LOGGER.warn('Could not convert `%s` (%s), unpickling it.', model_path, e)
+            return load_model(model_path)
+        meta = _read_meta(array_dir)
+
+    dd = load_model_arrays(array_dir, meta)
+    # ready_arguments would copy plain arrays with ch.array, wrap the mapped ones as they are
+    for key in ('v_template', 'shapedirs', 'posedirs', 'weights'):
+        dd[key] = ch.Ch(dd[key])
+    return load_model(dd)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description='convert SMPL models to memory-mapped arrays and build their joint caches')
+    parser.add_argument('model_paths', nargs='+', help="SMPL model pickles")
+    args = parser.parse_args()
+    for model_path in args.model_paths:
+        convert_model(model_path)
+        load_joint_cache(model_path, load_model_fast(model_path))
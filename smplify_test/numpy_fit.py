@@ -0,0 +1,543 @@
+"""
+NumPy fitting backend for optimize_on_joints.
+
+Evaluates the same residuals as the chumpy objective of optimize_on_joints
+(GMOf data term on the projected joints, GMM pose prior, joint angle prior and
+shape prior) together with their analytic Jacobians, using vectorised forward
+kinematics, and minimises them with scipy.optimize.least_squares.
+The interpenetration (sphere collision) term is not modelled.
+
+Run this file on a fitted pkl to check residuals, Jacobians and fit speed
+against the chumpy path:
+    python numpy_fit.py f_1801_4_output_smplify.pkl
+or only the Jacobian parity on a synthetic model, which fails on a mismatch:
+    python numpy_fit.py --check
+"""
+
+import logging
+import time
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from batch_fk import parents_from_kintree
+
+_LOGGER = logging.getLogger(__name__)
+
+# LSP -> SMPL joint ids used by the data term (neck and head are not fitted)
+SMPL_IDS = [8, 5, 2, 1, 4, 7, 21, 19, 17, 16, 18, 20]
+# hips are defined differently in SMPL and LSP
+BASE_WEIGHTS = np.array([1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1], dtype=np.float64)
+# weights of the 4 optimization stages: (pose prior, shape prior)
+OPT_WEIGHTS = list(zip([4.04 * 1e2, 4.04 * 1e2, 57.4, 4.78],
+                       [1e2, 5 * 1e1, 1e1, .5 * 1e1]))
+
+
+def skew(v):
+    """Cross-product matrices of Nx3 vectors, Nx3x3."""
+    v = np.asarray(v).reshape(-1, 3)
+    S = np.zeros((len(v), 3, 3))
+    S[:, 0, 1] = -v[:, 2]
+    S[:, 0, 2] = v[:, 1]
+    S[:, 1, 0] = v[:, 2]
+    S[:, 1, 2] = -v[:, 0]
+    S[:, 2, 0] = -v[:, 1]
+    S[:, 2, 1] = v[:, 0]
+    return S
+
+
+def rodrigues(r):
+    """Rotation matrices of axis-angle vectors and their derivatives.
+    :param r: Nx3 axis-angle vectors
+    :returns: a tuple (Nx3x3 rotations, Nx3x3x3 derivatives where [n, k] = dR_n/dr_nk)
+    """
+    r = np.asarray(r, dtype=np.float64).reshape(-1, 3)
+    n = len(r)
+    theta2 = np.sum(r**2, axis=1)
+    theta = np.sqrt(theta2)
+    small = theta < 1e-8
+    safe = np.where(small, 1., theta)
+
+    K = skew(r / safe[:, None])
+    KK = np.matmul(K, K)
+    R = (np.eye(3)[None] + np.sin(theta)[:, None, None] * K +
+         (1 - np.cos(theta))[:, None, None] * KK)
+    R[small] = np.eye(3) + skew(r[small])
+
+    # dR/dr_k = (r_k [r]x + [r x (I - R) e_k]x) R / |r|^2  (Gallego and Yezzi)
+    I_R = np.eye(3)[None] - R
+    v = np.cross(r[:, None, :], np.swapaxes(I_R, 1, 2))
+    dR = (r[:, :, None, None] * skew(r)[:, None] +
+          skew(v.reshape(-1, 3)).reshape(n, 3, 3, 3))
+    dR = np.matmul(dR / np.where(small, 1., theta2)[:, None, None, None], R[:, None])
+    dR[small] = skew(np.eye(3))[None]
+    return R, dR
+
+
+def ancestor_mask(parents):
+    """Boolean matrix, [i, k] is True if joint k is a strict ancestor of joint i."""
+    n = len(parents)
+    mask = np.zeros((n, n), dtype=bool)
+    for i in range(n):
+        p = parents[i]
+        while p >= 0:
+            mask[i, p] = True
+            p = parents[p]
+    return mask
+
+
+def joints_with_jacobian(pose, betas, Jdirs, J_template, parents, ancestors=None):
+    """SMPL joint positions and their derivatives w.r.t. pose and betas.
+    Same joints as the translation part of global_rigid_transformation on J_onbetas.
+    :param pose: 72D pose vector
+    :param betas: shape coefficients
+    :param Jdirs: 24x3xn_betas joint shape directions
+    :param J_template: 24x3 template joints
+    :param parents: parent index of each joint (see batch_fk.parents_from_kintree)
+    :param ancestors: optional ancestor_mask(parents)
+    :returns: a tuple (24x3 joints, 24x3x72 pose Jacobian, 24x3xn_betas shape Jacobian)
+    """
+    if ancestors is None:
+        ancestors = ancestor_mask(parents)
+    n = len(parents)
+    Jdirs = Jdirs[:, :, :len(betas)]
+    J = J_template + Jdirs.dot(betas)
+    R, dR = rodrigues(pose)
+
+    G = np.empty((n, 3, 3))
+    t = np.empty((n, 3))
+    D = np.empty((n, 3, Jdirs.shape[2]))
+    G[0] = R[0]
+    t[0] = J[0]
+    D[0] = Jdirs[0]
+    for i in range(1, n):
+        p = parents[i]
+        G[i] = G[p].dot(R[i])
+        t[i] = G[p].dot(J[i] - J[p]) + t[p]
+        D[i] = G[p].dot(Jdirs[i] - Jdirs[p]) + D[p]
+
+    # d(R_k)/d(pose_kc) R_k^T is the cross-product matrix of an angular velocity,
+    # rotated to world coordinates by the parent's global rotation
+    S = np.matmul(dR, np.swapaxes(R, 1, 2)[:, None])
+    w = np.stack([S[..., 2, 1], S[..., 0, 2], S[..., 1, 0]], axis=-1)
+    G_parent = np.empty((n, 3, 3))
+    G_parent[0] = np.eye(3)
+    G_parent[1:] = G[parents[1:]]
+    omega = np.einsum('kab,kcb->kca', G_parent, w)
+
+    # a pose parameter of joint k moves every descendant i by omega x (t_i - t_k)
+    diff = t[:, None, :] - t[None, :, :]
+    dpose = np.cross(omega[None, :, :, :], diff[:, :, None, :])
+    dpose *= ancestors[:, :, None, None]
+    dpose = dpose.transpose(0, 3, 1, 2).reshape(n, 3, 3 * n)
+    return t, dpose, D
+
+
+def project(X, cam):
+    """Project 3D points with a ProjectPoints-style camera (no distortion).
+    :param X: Nx3 points
+    :param cam: dict with rt, t, f, c (see camera_params)
+    :returns: a tuple (Nx2 pixels, Nx2x3 derivatives w.r.t. X)
+    """
+    Rc = rodrigues(cam['rt'])[0][0]
+    Xc = X.dot(Rc.T) + cam['t']
+    z = Xc[:, 2]
+    f = cam['f']
+    uv = f * Xc[:, :2] / z[:, None] + cam['c']
+
+    dproj = np.zeros((len(X), 2, 3))
+    dproj[:, 0, 0] = f[0] / z
+    dproj[:, 0, 2] = -f[0] * Xc[:, 0] / z**2
+    dproj[:, 1, 1] = f[1] / z
+    dproj[:, 1, 2] = -f[1] * Xc[:, 1] / z**2
+    return uv, np.matmul(dproj, Rc)
+
+
+def camera_params(cam):
+    """Read the parameters of an opendr ProjectPoints camera."""
+    return {'rt': np.array(cam.rt.r, dtype=np.float64).ravel(),
+            't': np.array(cam.t.r, dtype=np.float64).ravel(),
+            'f': np.array(cam.f.r, dtype=np.float64).ravel(),
+            'c': np.array(cam.c.r, dtype=np.float64).ravel()}
+
+
+def prior_params(prior):
+    """Read means, Cholesky factors and weights of a MaxMixtureCompletePrior GMM."""
+    r = lambda x: np.asarray(getattr(x, 'r', x), dtype=np.float64)
+    return (r(prior.means), r(prior.precs), r(prior.weights).ravel())
+
+
+def gmof(x, sigma):
+    """Geman-McClure residual as computed by lib.robustifiers.GMOf, and its derivative."""
+    d = sigma**2 + x**2
+    return sigma * x / np.sqrt(d), sigma**3 / d**1.5
+
+
+class JointObjective(object):
+    """Residuals and Jacobian of the optimize_on_joints objective.
+    Variables are [betas, pose] or, with fixed betas, the pose only.
+    """
+
+    def __init__(self, j2d, conf, cam, prior, jdirs, parents, n_betas=10,
+                 fixed_betas=None, sigma=100.):
+        """
+        :param j2d: 12x2 array of LSP joints (neck and head removed)
+        :param conf: 12D vector storing the confidence values from the CNN, or None
+        :param cam: camera dict (see camera_params)
+        :param prior: MaxMixtureCompletePrior GMM
+        :param jdirs: tuple (joint shape directions, template joints), see model_cache.compute_jdirs
+        :param parents: parent index of each joint
+        :param fixed_betas: shape coefficients kept fixed, None optimizes them
+        """
+        self.j2d = np.asarray(j2d, dtype=np.float64)[:12]
+        self.weights = BASE_WEIGHTS * (np.asarray(conf)[:12] if conf is not None else 1.)
+        self.cam = cam
+        self.means, self.chols, self.gmm_weights = prior_params(prior)
+        self.Jdirs = np.asarray(jdirs[0])[:, :, :n_betas]
+        self.J_template = np.asarray(jdirs[1])
+        self.parents = parents
+        self.ancestors = ancestor_mask(parents)
+        self.n_betas = n_betas
+        self.fixed_betas = None if fixed_betas is None else np.asarray(fixed_betas)[:n_betas]
+        self.sigma = sigma
+        self.set_stage(*OPT_WEIGHTS[0])
+
+    def set_stage(self, w, wbetas):
+        """Set the pose prior and shape prior weights."""
+        self.w = w
+        self.wbetas = wbetas
+        self._x = None
+
+    def split(self, x):
+        """Split the variable vector into (pose, betas)."""
+        if self.fixed_betas is not None:
+            return x, self.fixed_betas
+        return x[self.n_betas:], x[:self.n_betas]
+
+    def pack(self, pose, betas):
+        if self.fixed_betas is not None:
+            return np.array(pose, dtype=np.float64)
+        return np.hstack((betas[:self.n_betas], pose)).astype(np.float64)
+
+    def data_term(self, pose, betas):
+        """Weighted GMOf data term (24D) and its Jacobians w.r.t. pose and betas."""
+        Jtr, dpose, dbetas = joints_with_jacobian(
+            pose, betas, self.Jdirs, self.J_template, self.parents, self.ancestors)
+        uv, dproj = project(Jtr[SMPL_IDS], self.cam)
+        r, dr = gmof(self.j2d - uv, self.sigma)
+        scale = -(self.weights[:, None] * dr)[:, :, None] * dproj
+        r = (self.weights[:, None] * r).ravel()
+        d_pose = np.matmul(scale, dpose[SMPL_IDS]).reshape(-1, dpose.shape[2])
+        d_betas = np.matmul(scale, dbetas[SMPL_IDS]).reshape(-1, dbetas.shape[2])
+        return r, d_pose, d_betas
+
+    def evaluate(self, x):
+        """Residual vector and Jacobian, cached for the last x."""
+        if self._x is not None and np.array_equal(x, self._x):
+            return self._r, self._J
+        pose, betas = self.split(x)
+        n_pose = len(pose)
+
+        r_j2d, dj2d_pose, dj2d_betas = self.data_term(pose, betas)
+
+        # mixture of gaussians prior on pose[3:], on the best component
+        logl = np.sqrt(0.5) * np.einsum('ki,kij->kj', pose[3:][None] - self.means, self.chols)
+        k = np.argmin(np.sum(logl**2, axis=1) - np.log(self.gmm_weights))
+        r_prior = self.w * np.hstack((logl[k], np.sqrt(-np.log(self.gmm_weights[k]))))
+        dprior_pose = np.zeros((len(r_prior), n_pose))
+        dprior_pose[:-1, 3:] = self.w * np.sqrt(0.5) * self.chols[k].T
+
+        # joint angle prior on elbows and knees
+        ids = [55, 58, 12, 15]
+        signs = np.array([1., -1., -1., -1.])
+        w_angle = 0.317 * self.w
+        r_angle = w_angle * 10 * np.exp(signs * pose[ids])
+        dangle_pose = np.zeros((4, n_pose))
+        dangle_pose[np.arange(4), ids] = signs * r_angle
+
+        rows = [r_j2d, r_prior, r_angle]
+        if self.fixed_betas is not None:
+            J = np.vstack((dj2d_pose, dprior_pose, dangle_pose))
+        else:
+            nb = self.n_betas
+            r_betas = self.wbetas * betas
+            rows.append(r_betas)
+            J = np.vstack((
+                np.hstack((dj2d_betas, dj2d_pose)),
+                np.hstack((np.zeros((len(r_prior), nb)), dprior_pose)),
+                np.hstack((np.zeros((4, nb)), dangle_pose)),
+                np.hstack((self.wbetas * np.eye(nb), np.zeros((nb, n_pose))))))
+
+        self._x = np.array(x, copy=True)
+        self._r = np.hstack(rows)
+        self._J = J
+        return self._r, self._J
+
+    def residuals(self, x):
+        return self.evaluate(x)[0]
+
+    def jacobian(self, x):
+        return self.evaluate(x)[1]
+
+
+def fit_stages(j2d,
+               conf,
+               cam,
+               prior,
+               init_pose,
+               init_betas,
+               jdirs,
+               kintree_table,
+               stages=None,
+               n_betas=10,
+               fixed_betas=None,
+               maxiter=100,
+               method='lm'):
+    """Run the staged optimization of optimize_on_joints with scipy.
+    :param j2d: 12x2 array of LSP joints (neck and head removed)
+    :param conf: 12D vector storing the confidence values from the CNN
+    :param cam: camera dict (see camera_params), kept fixed
+    :param prior: MaxMixtureCompletePrior GMM
+    :param init_pose: 72D initial pose
+    :param init_betas: initial shape coefficients
+    :param jdirs: tuple (joint shape directions, template joints), see model_cache.compute_jdirs
+    :param kintree_table: SMPL kinematic tree
+    :param stages: list of (pose prior weight, shape prior weight), default all 4 stages
+    :param fixed_betas: shape coefficients kept fixed, None optimizes them
+    :param maxiter: maximum function evaluations per stage
+    :param method: least_squares method, 'lm' (Levenberg-Marquardt), 'dogbox' or 'trf'
+    :returns: a tuple (72D pose, shape coefficients, sum of squared data residuals)
+    """
+    if stages is None:
+        stages = OPT_WEIGHTS
+    obj = JointObjective(j2d, conf, cam, prior, jdirs, parents_from_kintree(kintree_table),
+                         n_betas=n_betas, fixed_betas=fixed_betas)
+    x = obj.pack(init_pose, np.zeros(n_betas) if init_betas is None else init_betas)
+    for stage, (w, wbetas) in enumerate(stages):
+        obj.set_stage(w, wbetas)
+        result = least_squares(obj.residuals, x, jac=obj.jacobian, method=method,
+                               max_nfev=maxiter, xtol=1e-4)
+        x = result.x
+        _LOGGER.debug('numpy stage %d: cost %.4f, %d evaluations',
+                      stage, result.cost, result.nfev)
+    pose, betas = obj.split(x)
+    r_j2d = obj.data_term(pose, betas)[0]
+    return np.array(pose), np.array(betas), np.sum(r_j2d**2)
+
+
+# parent of each SMPL joint, used by the synthetic model of check_parity
+SMPL_PARENTS = [-1, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 12, 13, 14, 16, 17, 18, 19, 20, 21]
+
+
+def _ch_rodrigues(r):
+    """Rotation matrix of a chumpy axis-angle vector (non-zero angle)."""
+    import chumpy as ch
+
+    # cross-product matrix of a vector k is SKEW.dot(k).reshape(3, 3)
+    skew_map = skew(np.eye(3)).transpose(1, 2, 0).reshape(9, 3)
+    theta = ch.sqrt(ch.sum(r**2))
+    k = r / theta
+    K = ch.dot(skew_map, k).reshape((3, 3))
+    outer = ch.dot(k.reshape((3, 1)), k.reshape((1, 3)))
+    return ch.cos(theta) * np.eye(3) + (1. - ch.cos(theta)) * outer + ch.sin(theta) * K
+
+
+def chumpy_objective(obj, x):
+    """Residuals of a JointObjective written as a chumpy expression of x, for check_parity.
+    The GMM component of the pose prior is the one JointObjective selects at x.
+    :returns: a tuple (chumpy residual vector, chumpy variable x)
+    """
+    import chumpy as ch
+
+    x = ch.array(np.asarray(x, dtype=np.float64))
+    if obj.fixed_betas is not None:
+        pose, betas = x, ch.array(obj.fixed_betas)
+    else:
+        pose, betas = x[obj.n_betas:], x[:obj.n_betas]
+    n = len(obj.parents)
+    J = obj.J_template + ch.dot(obj.Jdirs.reshape(n * 3, -1), betas).reshape((n, 3))
+
+    G = [_ch_rodrigues(pose[0:3])]
+    t = [J[0]]
+    for i in range(1, n):
+        p = obj.parents[i]
+        G.append(ch.dot(G[p], _ch_rodrigues(pose[3 * i:3 * i + 3])))
+        t.append(ch.dot(G[p], J[i] - J[p]) + t[p])
+    Jtr = ch.vstack([t[i].reshape((1, 3)) for i in SMPL_IDS])
+
+    Rc = rodrigues(obj.cam['rt'])[0][0]
+    Xc = ch.dot(Jtr, Rc.T) + obj.cam['t']
+    uv = obj.cam['f'] * Xc[:, :2] / Xc[:, 2].reshape((-1, 1)) + obj.cam['c']
+    x_j2d = obj.j2d - uv
+    r_j2d = obj.weights.reshape((-1, 1)) * obj.sigma * x_j2d / ch.sqrt(obj.sigma**2 + x_j2d**2)
+
+    pose_np = np.asarray(pose.r)
+    logl = np.sqrt(0.5) * np.einsum('ki,kij->kj', pose_np[3:][None] - obj.means, obj.chols)
+    k = np.argmin(np.sum(logl**2, axis=1) - np.log(obj.gmm_weights))
+    r_prior = obj.w * np.sqrt(0.5) * ch.dot(pose[3:] - obj.means[k], obj.chols[k])
+    r_const = obj.w * np.sqrt(-np.log(obj.gmm_weights[k])) * ch.ones(1)
+
+    ids = [55, 58, 12, 15]
+    signs = np.array([1., -1., -1., -1.])
+    r_angle = 0.317 * obj.w * 10 * ch.exp(signs * ch.concatenate([pose[i] for i in ids]))
+
+    rows = [r_j2d.ravel(), r_prior, r_const, r_angle]
+    if obj.fixed_betas is None:
+        rows.append(obj.wbetas * betas)
+    return ch.concatenate(rows), x
+
+
+def synthetic_objective(seed=0, n_betas=10, fixed_betas=False, noise=5.):
+    """JointObjective on a random SMPL-like model, GMM and camera, and a point to evaluate it at.
+    :returns: a tuple (JointObjective, variable vector)
+    """
+    class Prior(object):
+        pass
+
+    rng = np.random.RandomState(seed)
+    parents = SMPL_PARENTS
+    n = len(parents)
+    J_template = np.zeros((n, 3))
+    for i in range(1, n):
+        J_template[i] = J_template[parents[i]] + 0.15 * rng.randn(3)
+    jdirs = (0.01 * rng.randn(n, 3, n_betas), J_template)
+
+    prior = Prior()
+    n_gaussians = 8
+    prior.means = 0.2 * rng.randn(n_gaussians, 69)
+    prior.precs = np.triu(rng.randn(n_gaussians, 69, 69)) * 0.3 + 2. * np.eye(69)[None]
+    prior.weights = rng.dirichlet(np.ones(n_gaussians)) * 0.5
+
+    cam = {'rt': 0.1 * rng.randn(3), 't': np.array([0., 0., 5.]),
+           'f': np.array([5000., 5000.]), 'c': np.array([640., 360.])}
+    pose = 0.3 * rng.randn(72)
+    betas = rng.randn(n_betas)
+    Jtr = joints_with_jacobian(pose, betas, jdirs[0], jdirs[1], parents)[0]
+    j2d = project(Jtr[SMPL_IDS], cam)[0] + noise * rng.randn(12, 2)
+    conf = rng.uniform(0.3, 1., 12)
+
+    obj = JointObjective(j2d, conf, cam, prior, jdirs, parents, n_betas=n_betas,
+                         fixed_betas=betas if fixed_betas else None)
+    obj.set_stage(*OPT_WEIGHTS[1])
+    # evaluate away from the pose that generated the targets
+    pose_eval = pose + 0.1 * rng.randn(72)
+    return obj, obj.pack(pose_eval, betas + 0.2 * rng.randn(n_betas))
+
+
+def check_parity(seed=0, tol=1e-6):
+    """Check the residuals and the analytic Jacobian of JointObjective against chumpy's
+    derivatives of the same objective, on synthetic_objective, with optimized and fixed betas.
+    :param tol: largest accepted difference, relative to the largest absolute value
+    :returns: dict of the relative differences, raises AssertionError beyond tol
+    """
+    import scipy.sparse as sp
+
+    diffs = {}
+    for fixed_betas in (False, True):
+        obj, x = synthetic_objective(seed, fixed_betas=fixed_betas)
+        r_np, J_np = obj.evaluate(x)
+        r_ch, x_ch = chumpy_objective(obj, x)
+        J_ch = r_ch.dr_wrt(x_ch)
+        J_ch = J_ch.toarray() if sp.issparse(J_ch) else np.asarray(J_ch)
+        name = 'fixed betas' if fixed_betas else 'betas'
+        diffs[name + ' residual'] = np.abs(r_np - r_ch.r).max() / np.abs(r_ch.r).max()
+        diffs[name + ' jacobian'] = np.abs(J_np - J_ch).max() / np.abs(J_ch).max()
+    for name in sorted(diffs):
+        _LOGGER.info('%s: relative max abs diff %.3e', name, diffs[name])
+        assert diffs[name] <= tol, '%s differs from chumpy by %.3e (tol %.1e)' % (
+            name, diffs[name], tol)
+    return diffs
+
+
+def compare_backends(pkl_path, model_path, n_betas=10, img_size=(1280, 720),
+                     noise=5., seed=0):
+    """Check the numpy backend against chumpy around a fitted pkl.
+    Target joints are the projection of the pkl's fit plus pixel noise. Residuals and
+    Jacobians are compared at a perturbed pose, then both backends run the full
+    4-stage fit from the mean pose and are timed.
+    """
+    import cPickle as pickle
+    import chumpy as ch
+    import scipy.sparse as sp
+    from lib.max_mixture_prior import MaxMixtureCompletePrior
+    import fit_3d_kist_robot_0508_seq1 as fit
+    import model_cache
+    import parallel_fit
+
+    with open(pkl_path) as f:
+        params = pickle.load(f)
+    model = model_cache.load_model_fast(model_path)
+    prior = MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior()
+    jdirs = model_cache.load_jdirs(model_path, n_betas, model)
+    parents = parents_from_kintree(model.kintree_table)
+    rng = np.random.RandomState(seed)
+
+    center = np.array(img_size, dtype=np.float64)
+    cam = parallel_fit.make_camera(float(np.ravel(params['f'])[0]), center)
+    cam.t = ch.array(params['cam_t'])
+    cam_np = camera_params(cam)
+
+    pose = np.asarray(params['pose'], dtype=np.float64)
+    betas = np.asarray(params['betas'], dtype=np.float64)[:n_betas]
+    Jtr = joints_with_jacobian(pose, betas, jdirs[0], jdirs[1], parents)[0]
+    j2d = project(Jtr[SMPL_IDS], cam_np)[0] + noise * rng.randn(12, 2)
+    conf = np.ones(12)
+
+    # residuals and Jacobians at a perturbed point
+    pose_pert = pose + 0.05 * rng.randn(72)
+    ch_betas = ch.array(betas)
+    (sv, obj_j2d, pprior, obj_angle) = fit.build_fit_terms(
+        j2d, conf, model, cam, prior, ch_betas, pose_pert, n_betas, jdirs)
+    w, wbetas = OPT_WEIGHTS[0]
+    terms = [obj_j2d(1., 100), pprior(w), obj_angle(0.317 * w), wbetas * ch_betas]
+    dense = lambda m: m.toarray() if sp.issparse(m) else np.asarray(m)
+    r_ch = np.hstack([term.r.ravel() for term in terms])
+    J_ch = np.vstack([np.hstack((dense(term.dr_wrt(ch_betas)), dense(term.dr_wrt(sv.pose))))
+                      for term in terms])
+
+    obj = JointObjective(j2d, conf, cam_np, prior, jdirs, parents, n_betas=n_betas)
+    obj.set_stage(w, wbetas)
+    r_np, J_np = obj.evaluate(obj.pack(pose_pert, betas))
+    print('residual max abs diff: %.3e (max %.3e)' % (np.abs(r_np - r_ch).max(), np.abs(r_ch).max()))
+    print('jacobian max abs diff: %.3e (max %.3e)' % (np.abs(J_np - J_ch).max(), np.abs(J_ch).max()))
+
+    # full fits from the mean pose
+    j2d14 = np.vstack((j2d, np.zeros((2, 2))))
+    conf14 = np.hstack((conf, np.zeros(2)))
+    results = {}
+    for backend in ('chumpy', 'numpy'):
+        cam.t = ch.array(params['cam_t'])
+        t0 = time.time()
+        (sv, proj, _, err, _) = fit.optimize_on_joints(
+            j2d14, model, cam, None, prior, False, pose[:3], n_betas=n_betas,
+            conf=conf14, jdirs=jdirs, backend=backend)
+        results[backend] = (time.time() - t0, err, sv.pose.r.copy())
+        print('%-6s fit: %.3f s, reprojection error %.3f px' % (
+            backend, results[backend][0], err))
+    print('pose max abs diff: %.3e, speedup %.1fx' % (
+        np.abs(results['chumpy'][2] - results['numpy'][2]).max(),
+        results['chumpy'][0] / results['numpy'][0]))
+
+
+if __name__ == '__main__':
+    import argparse
+    from os.path import join, abspath, dirname
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='compare the numpy and chumpy fitting backends')
+    parser.add_argument('pkl_path', nargs='?', default=None,
+                        help="fitted pkl, e.g. f_1801_4_output_smplify.pkl")
+    parser.add_argument('--check', default=False, action='store_true',
+                        help="Only check the analytic Jacobian against chumpy on a synthetic "
+                        "model (no SMPL model or pkl needed), fails on a mismatch.")
+    parser.add_argument(
+        '--model',
+        default=join(abspath(dirname(__file__)), 'models',
+                     'basicModel_neutral_lbs_10_207_0_v1.0.0.pkl'),
+        help="SMPL model file")
+    args = parser.parse_args()
+    check_parity()
+    if not args.check:
+        if args.pkl_path is None:
+            parser.error("give pkl_path, or --check")
+        compare_backends(args.pkl_path, args.model)
@@ -0,0 +1,278 @@
+"""
+Process-pool frame fitting for the SMPLify scripts.
+
+Every worker loads the SMPL model, the sphere regressors and the GMM pose
+prior once (in the pool initializer) and keeps them resident for all the
+frames it fits. The parent process writes the `.pkl`/`.png` results in frame
+order (or appends the parameters to a results_store) and appends every
+finished frame to a JSON-lines manifest, so a crashed run only refits the
+frames that are missing from the manifest.
+"""
+
+from os.path import exists, isfile
+import os
+import logging
+import json
+import time
+from collections import deque
+import multiprocessing
+
+import cPickle as pickle
+import cv2
+import numpy as np
+
+import model_cache
+
+_LOGGER = logging.getLogger(__name__)
+
+# per-process resources, filled by _init_worker
+_WORKER = {}
+
+
+def load_manifest(manifest_path):
+    """Read the frames recorded as done in a manifest.
+    :param manifest_path: path to the JSON-lines manifest
+    :returns: a dict mapping frame index -> manifest entry
+    """
+    done = {}
+    if not exists(manifest_path):
+        return done
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a crash can leave a truncated last line behind
+                _LOGGER.warn('Ignoring broken manifest line: %s', line)
+                continue
+            done[entry['F']] = entry
+    return done
+
+
+def pending_frames(frame_ids, manifest_path, out_path_fn, store=None):
+    """Select the frames that still have to be fitted.
+    A frame is done when it is in the manifest and its result file still exists.
+    Results written before the manifest existed are adopted into it, as
+    write_result only ever leaves complete pickles behind. Frames recorded as
+    written to a store are not done here, the store decides about them.
+    :param frame_ids: iterable of frame indices
+    :param manifest_path: path to the JSON-lines manifest
+    :param out_path_fn: function mapping a frame index to its `.pkl` output path
+    :param store: results_store.ResultStore of the run, its frames are the finished ones
+    :returns: list of frame indices to fit, in the given order
+    """
+    if store is not None:
+        return [i for i in frame_ids if i not in store]
+    done = load_manifest(manifest_path)
+    pending = []
+    adopted = []
+    for i in frame_ids:
+        pkl_path = done[i].get('pkl') if i in done else None
+        if pkl_path is not None and isfile(pkl_path):
+            continue
+        if pkl_path is None and isfile(out_path_fn(i)):
+            adopted.append(i)
+            continue
+        pending.append(i)
+
+    if adopted:
+        _LOGGER.info('Adopting %d existing results into `%s`.', len(adopted), manifest_path)
+        with open(manifest_path, 'a') as manifest:
+            for i in adopted:
+                record_frame(manifest, i, out_path_fn(i))
+    return pending
+
+
+def record_frame(manifest, frame_idx, out_path, elapsed=None, store=None):
+    """Append a finished frame to an open manifest file.
+    :param store: path of the result store the frame was written to, recorded
+                  under 'store' instead of out_path under 'pkl'
+    """
+    entry = {'F': frame_idx, 'time': None if elapsed is None else round(elapsed, 3)}
+    if store is not None:
+        entry['store'] = store
+    else:
+        entry['pkl'] = out_path
+    manifest.write(json.dumps(entry) + '\n')
+    manifest.flush()
+
+
+def write_result(out_path, params, vis=None, store=None, frame_idx=None):
+    """Write a fit result, the pickle is renamed into place once complete.
+    :param out_path: `.pkl` output path
+    :param params: dict of fit parameters
+    :param vis: optional rendering saved next to the pickle as `.png`
+    :param store: results_store.ResultStore, if given the parameters are appended
+                  to it at frame_idx instead of being pickled
+    :param frame_idx: frame index of the result in store
+    """
+    if store is not None:
+        store.append(frame_idx, params)
+    else:
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'w') as outf:
+            pickle.dump(params, outf)
+        os.rename(tmp_path, out_path)
+
+    # This only saves the first rendering.
+    if vis is not None:
+        cv2.imwrite(out_path.replace('.pkl', '.png'), vis)
+
+
+def parse_render_policy(value):
+    """Parse a --render value: 'none', 'final' (the final fit of every frame)
+    or N (the final fit of every Nth frame).
+    :returns: the rendering period in frames, 0 renders nothing
+    """
+    if value == 'none':
+        return 0
+    if value == 'final':
+        return 1
+    every = int(value)
+    if every < 0:
+        raise ValueError('negative render period: %s' % value)
+    return every
+
+
+def render_degrees(do_degrees, render_every, frame_idx):
+    """Azimuths to render for a frame under the render policy (see parse_render_policy)."""
+    if not do_degrees or render_every <= 0 or frame_idx % render_every != 0:
+        return []
+    return do_degrees
+
+
+def make_camera(flength, center=None):
+    """Build the camera template used by initialize_camera.
+    :param flength: camera focal length (kept fixed)
+    :param center: 2D principal point, set again per image by initialize_camera
+    :returns: a ProjectPoints camera with zero rotation and translation
+    """
+    import chumpy as ch
+    from opendr.camera import ProjectPoints
+
+    if center is None:
+        center = np.zeros(2)
+    return ProjectPoints(
+        f=np.array([flength, flength]), rt=ch.zeros(3), t=ch.zeros(3),
+        k=np.zeros(5), c=center)
+
+
+def _init_worker(fit_fn, model_path, sph_regs_path, n_betas, flength):
+    """Load the model, regressors and pose prior once per worker process."""
+    from lib.max_mixture_prior import MaxMixtureCompletePrior
+
+    model = model_cache.load_model_fast(model_path)
+    _WORKER['fit_fn'] = fit_fn
+    _WORKER['resources'] = {
+        'model': model,
+        'sph_regs': np.load(sph_regs_path) if sph_regs_path else None,
+        'prior': MaxMixtureCompletePrior(n_gaussians=8).get_gmm_prior(),
+        'jdirs': model_cache.load_jdirs(model_path, n_betas, model),
+        'cam': make_camera(flength),
+    }
+    _LOGGER.info('worker %d ready', os.getpid())
+
+
+def _run_job(job):
+    """Fit one frame inside a worker."""
+    frame_idx, args = job[:2]
+    kwargs = dict(job[2]) if len(job) > 2 else {}
+    kwargs.update(_WORKER['resources'])
+    t0 = time.time()
+    try:
+        params, vis = _WORKER['fit_fn'](*args, **kwargs)
+    except Exception as e:
+        _LOGGER.exception('frame %d failed', frame_idx)
+        return (frame_idx, None, None, time.time() - t0, repr(e))
+    vis0 = vis[0] if len(vis) > 0 else None
+    return (frame_idx, params, vis0, time.time() - t0, None)
+
+
+def run_pool(jobs,
+             fit_fn,
+             out_path_fn,
+             manifest_path,
+             model_path,
+             sph_regs_path=None,
+             workers=2,
+             n_betas=10,
+             flength=5000.,
+             max_pending=None,
+             store=None,
+             on_result=None):
+    """Fit frames on a process pool and write the results in frame order.
+    :param jobs: iterable of (frame index, args) or (frame index, args, kwargs) tuples,
+                 passed to fit_fn
+    :param fit_fn: module-level function called as fit_fn(*args, model=, sph_regs=,
+                   prior=, jdirs=, cam=) returning (params, images)
+    :param out_path_fn: function mapping a frame index to its `.pkl` output path
+    :param manifest_path: JSON-lines manifest of finished frames
+    :param model_path: SMPL model loaded by every worker
+    :param sph_regs_path: sphere regressors loaded by every worker, None disables the term
+    :param workers: number of worker processes
+    :param n_betas: number of shape coefficients considered during optimization
+    :param flength: camera focal length used for the camera template
+    :param max_pending: frames submitted ahead of the writer (default 2 * workers),
+                        bounds the number of decoded images held in memory
+    :param store: results_store.ResultStore receiving the parameters instead of the `.pkl` files
+    :param on_result: function called as on_result(frame index, params) in the parent for
+                      every fitted frame, e.g. to aggregate statistics of the workers' fits
+    :returns: a tuple (number of fitted frames, number of failed frames)
+    """
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    pool = multiprocessing.Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(fit_fn, model_path, sph_regs_path, n_betas, flength))
+
+    n_fitted = 0
+    n_failed = 0
+    t_start = time.time()
+    pending = deque()
+
+    manifest = open(manifest_path, 'a')
+
+    def collect():
+        frame_idx, params, vis, elapsed, error = pending.popleft().get()
+        if error is not None:
+            _LOGGER.error('frame %d: %s', frame_idx, error)
+            return 0
+        out_path = out_path_fn(frame_idx)
+        write_result(out_path, params, vis, store, frame_idx)
+        if on_result is not None:
+            on_result(frame_idx, params)
+        record_frame(manifest, frame_idx, out_path, elapsed,
+                     store.path if store is not None else None)
+        return 1
+
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(_run_job, (job, )))
+            if len(pending) >= max_pending:
+                ok = collect()
+                n_fitted += ok
+                n_failed += 1 - ok
+        while pending:
+            ok = collect()
+            n_fitted += ok
+            n_failed += 1 - ok
+        pool.close()
+    except BaseException:
+        # frames already written stay recorded in the manifest
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        manifest.close()
+
+    elapsed = time.time() - t_start
+    if n_fitted > 0:
+        _LOGGER.info('Fitted %d frames (%d failed) with %d workers in %.1f s '
+                     '(%.3f frames/sec).', n_fitted, n_failed, workers,
+                     elapsed, n_fitted / elapsed)
+    return (n_fitted, n_failed)
@@ -1,12 +1,21 @@
+import os
+import re
+import sys
+import glob
+import time
 import pickle
 import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 def extract_params_from_pkl(pkl_path, json_path):
     # pkl 파일에서 데이터 로드 시 encoding='latin1' 사용
     with open(pkl_path, 'rb') as f:
         data = pickle.load(f, encoding='latin1')  # Python 2에서 생성된 pickle 파일 호환
 
+    save_params_json(data, json_path)
+
+def save_params_json(data, json_path):
     # 필요한 'pose'와 'betas' 변수 추출
     pose = data['pose'].tolist()  # numpy array를 list로 변환
     betas = data['betas'].tolist()  # numpy array를 list로 변환
@@ -17,17 +26,137 @@ def extract_params_from_pkl(pkl_path, json_path):
         'betas': betas
     }
 
-    # JSON 파일로 저장
-    with open(json_path, 'w') as f:
+    # JSON 파일로 저장 (완성된 파일만 남도록 임시 파일에 쓰고 이름 변경)
+    tmp_path = f"{json_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(params, f, indent=4)
+    os.replace(tmp_path, json_path)
+
+def frame_index(pkl_path):
+    # 파일 이름의 첫 번째 숫자가 프레임 번호 (f_1800_4_output_smplify.pkl -> 1800)
+    match = re.search(r'\d+', os.path.basename(pkl_path))
+    return int(match.group()) if match else None
+
+def find_pkl_files(input_path, start_frame=None, end_frame=None):
+    # 디렉터리 또는 glob 패턴에서 pkl 파일 목록을 프레임 순서로 반환
+    if os.path.isdir(input_path):
+        pkl_paths = glob.glob(os.path.join(input_path, '*.pkl'))
+    else:
+        pkl_paths = glob.glob(input_path)
+
+    frames = []
+    for pkl_path in pkl_paths:
+        i = frame_index(pkl_path)
+        if i is None:
+            continue
+        if start_frame is not None and i < start_frame:
+            continue
+        if end_frame is not None and i > end_frame:
+            continue
+        frames.append((i, pkl_path))
+    return [pkl_path for _, pkl_path in sorted(frames)]
+
+def json_path_for(pkl_path):
+    return os.path.splitext(pkl_path)[0] + '.json'
+
+def is_up_to_date(pkl_path, json_path):
+    return os.path.exists(json_path) and os.path.getmtime(json_path) >= os.path.getmtime(pkl_path)
+
+def convert_one(paths):
+    # 작업 프로세스에서 실행, 실패 시 오류 메시지 반환
+    pkl_path, json_path = paths
+    try:
+        extract_params_from_pkl(pkl_path, json_path)
+    except Exception as e:
+        return f"{pkl_path}: {e!r}"
+    return None
+
+def convert_all(pkl_paths, workers=None, force=False, chunksize=16):
+    # 여러 pkl 파일을 하나의 프로세스 풀에서 변환하고 (변환, 건너뜀, 실패) 개수를 반환
+    jobs = []
+    n_skipped = 0
+    for pkl_path in pkl_paths:
+        json_path = json_path_for(pkl_path)
+        if not force and is_up_to_date(pkl_path, json_path):
+            n_skipped += 1
+            continue
+        jobs.append((pkl_path, json_path))
+
+    errors = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for error in executor.map(convert_one, jobs, chunksize=chunksize):
+                if error is not None:
+                    errors.append(error)
+    for error in errors:
+        print(f"Failed: {error}")
+    return len(jobs) - len(errors), n_skipped, len(errors)
+
+def store_json_pattern(store_path):
+    # results_store 폴더 옆에 프레임별 json 경로 (Seq1/USB_Sync_Left_store -> Seq1/USB_Sync_Left_{}.json)
+    store_path = os.path.normpath(store_path)
+    name = os.path.basename(store_path)
+    if name.endswith('store'):
+        name = name[:-len('store')]
+    return os.path.join(os.path.dirname(store_path), name + '{}.json')
+
+def convert_store(store_path, output_pattern=None, start_frame=None, end_frame=None, force=False):
+    # results_store의 프레임을 json으로 변환하고 (변환, 건너뜀) 개수를 반환
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import results_store
 
-    print(f"Parameters saved to {json_path}")
+    if output_pattern is None:
+        output_pattern = store_json_pattern(store_path)
+    store = results_store.ResultStore(store_path)
+    # 행이 쓰일 때마다 valid.npy가 갱신되므로 그보다 새 json은 최신 상태
+    store_mtime = os.path.getmtime(os.path.join(store_path, 'valid.npy'))
+    n_converted = 0
+    n_skipped = 0
+    for i, params in store.items(start_frame, end_frame):
+        json_path = output_pattern.format(i)
+        if not force and os.path.exists(json_path) and os.path.getmtime(json_path) >= store_mtime:
+            n_skipped += 1
+            continue
+        save_params_json(params, json_path)
+        n_converted += 1
+    return n_converted, n_skipped
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Extract 'pose' and 'betas' from pkl and save as JSON")
-    parser.add_argument('pkl_path', type=str, help="Path to the input .pkl file")
-    parser.add_argument('json_path', type=str, help="Path to the output .json file")
+    parser.add_argument('pkl_path', type=str, nargs='?', help="Path to the input .pkl file")
+    parser.add_argument('json_path', type=str, nargs='?', help="Path to the output .json file")
+    parser.add_argument('--input', type=str, default=None,
+                        help="Directory or glob of .pkl files, each converted to a .json next to it")
+    parser.add_argument('--store', type=str, default=None,
+                        help="results_store folder written by the fitters, each frame converted to a .json")
+    parser.add_argument('--output_pattern', type=str, default=None,
+                        help="Output path of a --store frame, '{}' is the frame index "
+                        "(default: <store without 'store'>{}.json next to the store)")
+    parser.add_argument('--start_frame', type=int, default=None, help="First frame to convert (inclusive)")
+    parser.add_argument('--end_frame', type=int, default=None, help="Last frame to convert (inclusive)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Convert files whose .json is already up to date")
 
     args = parser.parse_args()
 
-    extract_params_from_pkl(args.pkl_path, args.json_path)
+    if args.store is not None:
+        start_time = time.time()
+        n_converted, n_skipped = convert_store(args.store, args.output_pattern,
+                                               args.start_frame, args.end_frame, args.force)
+        elapsed = time.time() - start_time
+        rate = n_converted / elapsed if elapsed > 0 else 0.
+        print(f"Converted {n_converted} frames ({n_skipped} up to date) "
+              f"in {elapsed:.1f} s, {rate:.1f} frames/sec.")
+    elif args.input is None:
+        if args.pkl_path is None or args.json_path is None:
+            parser.error("give pkl_path and json_path, --input or --store")
+        extract_params_from_pkl(args.pkl_path, args.json_path)
+        print(f"Parameters saved to {args.json_path}")
+    else:
+        pkl_paths = find_pkl_files(args.input, args.start_frame, args.end_frame)
+        start_time = time.time()
+        n_converted, n_skipped, n_failed = convert_all(pkl_paths, args.workers, args.force)
+        elapsed = time.time() - start_time
+        rate = n_converted / elapsed if elapsed > 0 else 0.
+        print(f"Converted {n_converted} files ({n_skipped} up to date, {n_failed} failed) "
+              f"in {elapsed:.1f} s, {rate:.1f} files/sec.")
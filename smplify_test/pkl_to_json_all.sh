@@ -4,15 +4,8 @@
 start=1800
 end=3600
 
-# 지정된 범위 내에서 반복
-for i in $(seq $start $end); do
-    # 입력 파일과 출력 파일 이름 설정
-    input_file="f_${i}_4_output_smplify.pkl"
-    output_file="f_${i}_4_output_smplify.json"
-
-    # 스크립트 실행
-    echo "Converting $input_file to $output_file..."
-    python pkl_to_json.py "$input_file" "$output_file"
-done
+# 지정된 범위의 f_<i>_4_output_smplify.pkl 파일을 한 번에 변환
+# (각 파일은 f_<i>_4_output_smplify.json 으로 저장, 최신 json 은 건너뜀)
+python pkl_to_json.py --input "f_*_4_output_smplify.pkl" --start_frame $start --end_frame $end
 
 echo "Conversion completed."
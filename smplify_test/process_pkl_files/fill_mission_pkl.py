@@ -1,21 +1,177 @@
 import os
-import shutil
-
-def fill_missing_files(folder_path):
-    for i in range(1, 1470):
-        expected_file = "USB_Sync_Right_{}.pkl".format(i)
-        previous_file = "USB_Sync_Right_{}.pkl".format(i-1)
-        
-        expected_file_path = os.path.join(folder_path, expected_file)
-        previous_file_path = os.path.join(folder_path, previous_file)
-        
-        if not os.path.exists(expected_file_path):
-            if os.path.exists(previous_file_path):
-                shutil.copy(previous_file_path, expected_file_path)
-                print("copy: {} -> {}".format(previous_file, expected_file))
-            else:
-                print("error: {} file missing.".format(previous_file))
-
-folder_path = "Seq3_Right"
-
-fill_missing_files(folder_path)
+import re
+import sys
+import pickle
+import argparse
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+PKL_PATTERN = re.compile(r'^USB_Sync_Right_(\d+)\.pkl$')
+PKL_NAME = "USB_Sync_Right_{}.pkl"
+
+def list_frames(folder_path, pattern=PKL_PATTERN):
+    # {frame index: file name} of the pkl files in the folder, with one directory listing
+    frames = {}
+    for file_name in os.listdir(folder_path):
+        match = pattern.match(file_name)
+        if match:
+            frames[int(match.group(1))] = file_name
+    return frames
+
+def find_gaps(present, start, end):
+    # Runs of missing frames in [start, end] as (first missing, last missing) pairs
+    gaps = []
+    run_start = None
+    for i in range(start, end + 1):
+        if i in present:
+            if run_start is not None:
+                gaps.append((run_start, i - 1))
+                run_start = None
+        elif run_start is None:
+            run_start = i
+    if run_start is not None:
+        gaps.append((run_start, end))
+    return gaps
+
+def slerp(q0, q1, t):
+    # Spherical interpolation of (J, 4) quaternions, along the shorter arc
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.abs(dot)
+    omega = np.arccos(np.clip(dot, -1., 1.))
+    sin_omega = np.sin(omega)
+    # nearly identical rotations are interpolated linearly
+    linear = sin_omega < 1e-6
+    safe_sin = np.where(linear, 1., sin_omega)
+    w0 = np.where(linear, 1. - t, np.sin((1. - t) * omega) / safe_sin)
+    w1 = np.where(linear, t, np.sin(t * omega) / safe_sin)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+def interpolate_params(prev_params, next_params, t):
+    # Parameters at fraction t between two fits: per-joint slerp of the pose,
+    # linear betas and cam_t; the focal length is kept from the previous fit
+    pose0 = np.asarray(prev_params['pose'], dtype=np.float64).reshape(-1, 3)
+    pose1 = np.asarray(next_params['pose'], dtype=np.float64).reshape(-1, 3)
+    q = slerp(R.from_rotvec(pose0).as_quat(), R.from_rotvec(pose1).as_quat(), t)
+    params = dict(prev_params)
+    # values derived from the previous fit do not match the interpolated pose
+    for key in ('joints', 'j2d_err', 'orient_path'):
+        params.pop(key, None)
+    params['pose'] = R.from_quat(q).as_rotvec().ravel()
+    for key in ('betas', 'cam_t'):
+        params[key] = ((1. - t) * np.asarray(prev_params[key], dtype=np.float64) +
+                       t * np.asarray(next_params[key], dtype=np.float64))
+    return params
+
+def gap_params(gap, load_params):
+    # Yield (frame index, params) for the frames of a gap; the fits on both sides are
+    # interpolated, a gap at the start or end of the range repeats its only neighbour.
+    # A gap without a fit on either side yields nothing
+    first, last = gap
+    prev_params = load_params(first - 1)
+    next_params = load_params(last + 1)
+    if prev_params is None and next_params is None:
+        return
+    for i in range(first, last + 1):
+        if prev_params is None:
+            yield i, dict(next_params)
+        elif next_params is None:
+            yield i, dict(prev_params)
+        else:
+            t = float(i - first + 1) / (last - first + 2)
+            yield i, interpolate_params(prev_params, next_params, t)
+
+def fill_missing_files(folder_path, start_frame=None, end_frame=None):
+    # Write interpolated pkl files for the missing frames of folder_path
+    frames = list_frames(folder_path)
+    if not frames:
+        print("error: no pkl files in {}.".format(folder_path))
+        return 0
+    start_frame = min(frames) if start_frame is None else start_frame
+    end_frame = max(frames) if end_frame is None else end_frame
+
+    def load_params(i):
+        if i not in frames:
+            return None
+        with open(os.path.join(folder_path, frames[i]), 'rb') as f:
+            # the fits are written by Python 2
+            return pickle.load(f, encoding='latin1')
+
+    n_filled = 0
+    for gap in find_gaps(frames, start_frame, end_frame):
+        gap_filled = 0
+        for i, params in gap_params(gap, load_params):
+            params['interpolated'] = True
+            expected_file = PKL_NAME.format(i)
+            tmp_path = os.path.join(folder_path, expected_file + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(params, f, protocol=2)
+            os.replace(tmp_path, os.path.join(folder_path, expected_file))
+            gap_filled += 1
+        if gap_filled == 0:
+            print("skipped: frames {} - {}, no fit next to them".format(*gap))
+            continue
+        n_filled += gap_filled
+        print("filled: frames {} - {}".format(*gap))
+    return n_filled
+
+def fill_missing_rows(store_path, start_frame=None, end_frame=None):
+    # Fill the missing frames of a results_store in place, the rows are flagged as FILLED
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import results_store
+
+    store = results_store.ResultStore(store_path, 'r+')
+    frames = set(int(i) for i in store.frames())
+    if not frames:
+        print("error: {} holds no frames.".format(store_path))
+        return 0
+    start_frame = min(frames) if start_frame is None else start_frame
+    end_frame = max(frames) if end_frame is None else end_frame
+    # only frames inside the store have a row to fill
+    last_frame = store.first_frame + store.n_frames - 1
+    if start_frame > last_frame or end_frame < store.first_frame:
+        print("error: frames {} - {} are outside {} (frames {} - {}).".format(
+            start_frame, end_frame, store_path, store.first_frame, last_frame))
+        return 0
+    if start_frame < store.first_frame or end_frame > last_frame:
+        start_frame = max(start_frame, store.first_frame)
+        end_frame = min(end_frame, last_frame)
+        print("range clamped to the store: frames {} - {}".format(start_frame, end_frame))
+
+    def load_params(i):
+        return store.get(i) if i in frames else None
+
+    n_filled = 0
+    for gap in find_gaps(frames, start_frame, end_frame):
+        frame_ids = []
+        values = dict((key, []) for key in ('cam_t', 'f', 'pose', 'betas'))
+        for i, params in gap_params(gap, load_params):
+            frame_ids.append(i)
+            for key in values:
+                values[key].append(params[key])
+        if not frame_ids:
+            print("skipped: frames {} - {}, no fit next to them".format(*gap))
+            continue
+        # the joints and 2D error of filled rows stay unknown (NaN)
+        store.write_rows(frame_ids, values, results_store.FILLED)
+        n_filled += len(frame_ids)
+        print("filled: frames {} - {}".format(*gap))
+    return n_filled
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="fill missing USB_Sync_Right_<i>.pkl frames by interpolation")
+    parser.add_argument('--folder_path', default="Seq3_Right")
+    parser.add_argument('--store', default=None,
+                        help="results_store folder to fill instead of the pkl files of --folder_path")
+    parser.add_argument('--start_frame', type=int, default=None,
+                        help="first frame of the range (default: first existing frame)")
+    parser.add_argument('--end_frame', type=int, default=None,
+                        help="last frame of the range (default: last existing frame)")
+    args = parser.parse_args()
+
+    if args.store is not None:
+        n_filled = fill_missing_rows(args.store, args.start_frame, args.end_frame)
+    else:
+        n_filled = fill_missing_files(args.folder_path, args.start_frame, args.end_frame)
+    print("{} frames filled.".format(n_filled))
@@ -1,6 +1,8 @@
 import os
+import sys
 import json
 import pickle
+import argparse
 
 def extract_camera_params(pkl_dir):
     camera_params = []
@@ -30,16 +32,38 @@ def extract_camera_params(pkl_dir):
     
     return camera_params
 
+def extract_store_camera_params(store_path):
+    # Same records from a results_store folder written by the fitters (--store)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import results_store
+
+    camera_params = []
+    for frame_index, params in results_store.ResultStore(store_path).items():
+        camera_params.append({
+            "F": frame_index,
+            "cam_t_r": params['cam_t'].tolist(),
+            "cam_f_r": params['f'].tolist()
+        })
+    return camera_params
+
 def save_to_json(data, output_file):
     with open(output_file, 'w') as f:
         json.dump(data, f, indent=4)
 
-# Directory containing the pkl files
-pkl_dir = 'Seq2_Right'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export the cameras of SMPLify pkl files to json')
+    # Directory containing the pkl files
+    parser.add_argument('--pkl_dir', default='Seq2_Right')
+    parser.add_argument('--store', default=None,
+                        help="Read the fits from this results_store folder instead of --pkl_dir.")
+    parser.add_argument('--output', default='smplify_cam.json')
+    args = parser.parse_args()
 
-# Extract the camera parameters
-camera_params = extract_camera_params(pkl_dir)
+    # Extract the camera parameters
+    if args.store is not None:
+        camera_params = extract_store_camera_params(args.store)
+    else:
+        camera_params = extract_camera_params(args.pkl_dir)
 
-# Save to JSON file
-output_file = 'smplify_cam.json'
-save_to_json(camera_params, output_file)
+    # Save to JSON file
+    save_to_json(camera_params, args.output)
@@ -1,6 +1,10 @@
 import os
+import sys
 import pickle
+import itertools
 import json
+import argparse
+import tempfile
 import numpy as np
 from scipy.spatial.transform import Rotation as R
 
@@ -9,77 +13,234 @@ def load_pkl(pkl_dir, file_path):
         data = pickle.load(f)
     return data
 
-def axis_angle_to_quaternion(axis_angle):
-    r = R.from_rotvec(axis_angle)
-    return r.as_quat()  # Returns (x, y, z, w) format
+def kinematic_levels(bone_parents):
+    # Group the non-root bones by depth in the tree, the parents of a level are in the previous levels
+    depth = [None] * len(bone_parents)
 
-def compute_global_rotations(pose_quaternions, bone_parents):
-    global_rotations = [None] * len(bone_parents)
-    for idx, parent_idx in enumerate(bone_parents):
-        if parent_idx == -1:
-            global_rotations[idx] = pose_quaternions[idx]
-        else:
-            parent_global_rotation = R.from_quat(global_rotations[parent_idx])
-            local_rotation = R.from_quat(pose_quaternions[idx])
-            global_rotation = parent_global_rotation * local_rotation
-            global_rotations[idx] = global_rotation.as_quat().tolist()
+    def bone_depth(idx):
+        if depth[idx] is None:
+            parent_idx = bone_parents[idx]
+            depth[idx] = 0 if parent_idx == -1 else bone_depth(parent_idx) + 1
+        return depth[idx]
+
+    for idx in range(len(bone_parents)):
+        bone_depth(idx)
+    return [[idx for idx in range(len(bone_parents)) if depth[idx] == d]
+            for d in range(1, max(depth) + 1)]
+
+def compute_global_rotations_batch(pose_quaternions, bone_parents):
+    # Global rotations (GlobalTrans = GlobalTrans_parent * LocalTransform) of the (F, J, 4)
+    # local quaternions of all frames at once, one quaternion product per tree level
+    global_rotations = np.array(pose_quaternions, dtype=np.float64)
+    num_frames = global_rotations.shape[0]
+    if num_frames == 0:
+        return global_rotations
+    for level in kinematic_levels(bone_parents):
+        parents = [bone_parents[idx] for idx in level]
+        parent_global_rotation = R.from_quat(global_rotations[:, parents].reshape(-1, 4))
+        local_rotation = R.from_quat(global_rotations[:, level].reshape(-1, 4))
+        global_rotation = parent_global_rotation * local_rotation
+        global_rotations[:, level] = global_rotation.as_quat().reshape(num_frames, len(level), 4)
     return global_rotations
 
-def extract_parameters(pkl_dir, pkl_files, index_mapping, bone_parents):
-    poses = []
-    shapes = []
-    
-    #for i, pkl_file in enumerate(pkl_files):
+def iter_pkl_params(pkl_dir, pkl_files):
+    # Yield (frame index, params) of the pkl files
     for pkl_file in pkl_files:
-        i = int(pkl_file.split('_')[-1].split('.')[0])
-        data = load_pkl(pkl_dir, pkl_file)
-        cam_t = data['cam_t']
-        pose = data['pose']
-        betas = data['betas']
-        
-        pose_quaternions = []
-        for j in range(0, len(pose), 3):
-            axis_angle = pose[j:j+3]
-            quaternion = axis_angle_to_quaternion(axis_angle)
-            pose_quaternions.append(quaternion.tolist())
+        yield int(pkl_file.split('_')[-1].split('.')[0]), load_pkl(pkl_dir, pkl_file)
+
+def open_store(store_path):
+    # results_store folder written by the fitters (--store), instead of the pkl files
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import results_store
+
+    return results_store.ResultStore(store_path)
+
+def iter_parameters(frames, index_mapping, bone_parents, chunk_size=256):
+    # Yield (frame index, (J, 4) global rotations, betas) for every (frame index, params) of frames,
+    # from iter_pkl_params or ResultStore.items.
+    # The frames are converted chunk_size at a time, memory does not grow with the sequence.
+    frames = iter(frames)
+    while True:
+        chunk = list(itertools.islice(frames, chunk_size))
+        if not chunk:
+            break
+        frame_indices = []
+        all_poses = []
+        all_betas = []
+        for i, data in chunk:
+            frame_indices.append(i)
+            all_poses.append(np.asarray(data['pose'], dtype=np.float64).reshape(-1, 3))
+            all_betas.append(data['betas'])
+
+        # Axis-angle to quaternions (x, y, z, w) of every joint of the chunk in one call
+        all_poses = np.array(all_poses)
+        pose_quaternions = R.from_rotvec(all_poses.reshape(-1, 3)).as_quat().reshape(
+            all_poses.shape[0], all_poses.shape[1], 4)
 
         # Reorder pose_quaternions according to index_mapping
-        reordered_pose_quaternions = [pose_quaternions[idx] for idx in index_mapping]
+        reordered_pose_quaternions = pose_quaternions[:, index_mapping]
 
         # Compute global rotations
-        global_rotations = compute_global_rotations(reordered_pose_quaternions, bone_parents)
-                
-        # Negate the cam_t values (meter to centimeter)
-        negated_cam_t = (-cam_t[0] / 1, -cam_t[1] / 1, -cam_t[2] / 1)
-        negated_cam_t = (0, 0, 0)
-        
-        poses.append({
-            "F": i,
-            "R": global_rotations,
-            #"T": cam_t.tolist()
-            "T": negated_cam_t
-        })
-        shapes.append({
-            "F": i,
-            "S": betas.tolist()
-        })
-
-    return poses, shapes
-
-def calculate_average_shape(shapes):
-    shape_params = [shape["S"] for shape in shapes]
-    shape_params_avg = np.mean(shape_params, axis=0).tolist()
-    return shape_params_avg
-
-def save_json(data, file_path):
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=3)
+        global_rotations = compute_global_rotations_batch(reordered_pose_quaternions, bone_parents)
+
+        for item in zip(frame_indices, global_rotations, all_betas):
+            yield item
+
+def pose_record(i, global_rotations, precision=None):
+    # Negate the cam_t values (meter to centimeter)
+    #negated_cam_t = (-cam_t[0] / 1, -cam_t[1] / 1, -cam_t[2] / 1)
+    negated_cam_t = (0, 0, 0)
+    return {
+        "F": i,
+        "R": format_values(global_rotations, precision),
+        #"T": cam_t.tolist()
+        "T": negated_cam_t
+    }
+
+def shape_record(i, betas, precision=None):
+    return {
+        "F": i,
+        "S": format_values(betas, precision)
+    }
+
+def format_values(values, precision=None):
+    # Nested lists of floats, rounded to precision decimals if set
+    values = np.asarray(values, dtype=np.float64)
+    if precision is not None:
+        values = np.round(values, precision)
+    return values.tolist()
+
+class FramesetWriter(object):
+    # Writes a json object whose last item, list_key, is a list of frame records,
+    # streaming the records as they are produced. With indent the file is laid out as
+    # json.dump(..., indent=indent); with indent=None it is compact, one record per line.
+    # The file is written under a temporary name and renamed by close().
+
+    def __init__(self, file_path, header, list_key, indent=3):
+        self.file_path = file_path
+        self.indent = indent
+        self.num_records = 0
+        self.f = open(file_path + '.tmp', 'w')
+        if indent is None:
+            self.separators = (',', ':')
+            head = json.dumps(header, separators=self.separators)[:-1]
+            self.f.write(head + (',' if header else '') + json.dumps(list_key) + ':[')
+        else:
+            self.separators = (',', ': ')
+            if header:
+                head = json.dumps(header, indent=indent)[:-2] + ','
+            else:
+                head = '{'
+            self.f.write(head + '\n' + ' ' * indent + json.dumps(list_key) + ': [')
+
+    def write(self, record):
+        if self.indent is None:
+            text = json.dumps(record, separators=self.separators)
+            self.f.write((',\n' if self.num_records else '\n') + text)
+        else:
+            pad = '\n' + ' ' * (2 * self.indent)
+            text = json.dumps(record, indent=self.indent).replace('\n', pad)
+            self.f.write((',' if self.num_records else '') + pad + text)
+        self.num_records += 1
+
+    def close(self):
+        if self.indent is None:
+            self.f.write('\n]}' if self.num_records else ']}')
+        else:
+            self.f.write(('\n' + ' ' * self.indent + ']' if self.num_records else ']') + '\n}')
+        self.f.close()
+        os.replace(self.file_path + '.tmp', self.file_path)
+
+class QuaternionSidecar(object):
+    # Binary copy of the global rotations: a raw little-endian float32 (F, J, 4) array
+    # in <file_path>, described by <file_path>.json (shape, dtype, quaternion order,
+    # bone names and frame indices), so readers can memory-map it.
+
+    def __init__(self, file_path, bone_names):
+        self.file_path = file_path
+        self.bone_names = bone_names
+        self.frame_indices = []
+        self.f = open(file_path + '.tmp', 'wb')
+
+    def write(self, i, global_rotations):
+        self.f.write(np.asarray(global_rotations, dtype='<f4').tobytes())
+        self.frame_indices.append(int(i))
+
+    def close(self):
+        self.f.close()
+        os.replace(self.file_path + '.tmp', self.file_path)
+        header = {
+            "dtype": "float32",
+            "byte_order": "little",
+            "shape": [len(self.frame_indices), len(self.bone_names), 4],
+            "quaternion": "x,y,z,w",
+            "BoneNames": self.bone_names,
+            "frames": self.frame_indices
+        }
+        with open(self.file_path + '.json', 'w') as f:
+            json.dump(header, f)
+
+def save_frameset(frames, index_mapping, bone_parents, pose_data, shape_data,
+                  pose_path, shape_path, indent=3, precision=None, sidecar_path=None):
+    # Stream Frameset_SMPL_Pose/Shape.json of the (frame index, params) of frames;
+    # pose_data and shape_data hold the header items,
+    # the frame lists and shape_param_avg are filled in here. The shape records are spooled
+    # to a temporary file, as shape_param_avg has to be written before them.
+    pose_writer = FramesetWriter(pose_path, pose_data, "pose_parameters", indent)
+    sidecar = None
+    if sidecar_path is not None:
+        sidecar = QuaternionSidecar(sidecar_path, pose_data["BoneNames"])
+
+    shape_sum = None
+    num_frames = 0
+    with tempfile.TemporaryFile('w+') as shape_spool:
+        for i, global_rotations, betas in iter_parameters(frames, index_mapping, bone_parents):
+            pose_writer.write(pose_record(i, global_rotations, precision))
+            if sidecar is not None:
+                sidecar.write(i, global_rotations)
+            shape_spool.write(json.dumps(shape_record(i, betas, precision)) + '\n')
+            betas = np.asarray(betas, dtype=np.float64)
+            shape_sum = betas.copy() if shape_sum is None else shape_sum + betas
+            num_frames += 1
+        pose_writer.close()
+        if sidecar is not None:
+            sidecar.close()
+
+        shape_data = dict(shape_data)
+        if num_frames:
+            shape_data["shape_param_avg"] = format_values(shape_sum / num_frames, precision)
+        shape_writer = FramesetWriter(shape_path, shape_data, "shape_param_frames", indent)
+        shape_spool.seek(0)
+        for line in shape_spool:
+            shape_writer.write(json.loads(line))
+        shape_writer.close()
+    return num_frames
 
 def main():
-    pkl_dir = "Seq3_Right"
-    #pkl_files = sorted([os.path.join(pkl_dir, f) for f in os.listdir(pkl_dir) if f.endswith('.pkl') and not f.endswith('_2.pkl')])
-    pkl_files = [f for f in os.listdir(pkl_dir) if f.endswith('.pkl') and f.count('_') != 4]
-    pkl_files.sort(key=lambda x: int(x.split('_')[-1].split('.')[0]))
+    parser = argparse.ArgumentParser(description='export SMPLify pkl files to Frameset_SMPL_Pose/Shape.json')
+    parser.add_argument('--pkl_dir', default="Seq3_Right")
+    parser.add_argument('--store', default=None,
+                        help="Read the fits from this results_store folder instead of --pkl_dir.")
+    parser.add_argument('--compact', default=False, action='store_true',
+                        help="Write compact json, one frame record per line, instead of indent=3.")
+    parser.add_argument('--precision', default=None, type=int,
+                        help="Round the rotations and shape parameters to this many decimals.")
+    parser.add_argument('--binary', default=False, action='store_true',
+                        help="Also write the global rotations to Frameset_SMPL_Pose.bin "
+                        "(float32, described by Frameset_SMPL_Pose.bin.json).")
+    args = parser.parse_args()
+
+    if args.store is not None:
+        store = open_store(args.store)
+        frames = store.items()
+        num_frames = len(store)
+    else:
+        pkl_dir = args.pkl_dir
+        #pkl_files = sorted([os.path.join(pkl_dir, f) for f in os.listdir(pkl_dir) if f.endswith('.pkl') and not f.endswith('_2.pkl')])
+        pkl_files = [f for f in os.listdir(pkl_dir) if f.endswith('.pkl') and f.count('_') != 4]
+        pkl_files.sort(key=lambda x: int(x.split('_')[-1].split('.')[0]))
+        frames = iter_pkl_params(pkl_dir, pkl_files)
+        num_frames = len(pkl_files)
 
     # Index mapping from SMPL to GroundTruth
     boneIndexNamesSMPL = [
@@ -102,9 +263,6 @@ def main():
         11, 19, 20, 21, 22
     ]
 
-    poses, shapes = extract_parameters(pkl_dir, pkl_files, index_mapping, bone_parents)
-    shape_params_avg = calculate_average_shape(shapes)
-
     shape_data = {
         "_README": [
             ["// -----------------------------------------------"],
@@ -117,10 +275,9 @@ def main():
             ["// -----------------------------------------------"]
         ],
         "gender": "NEUTRAL",
-        "num_frames": len(pkl_files),  # Adjusting to the number of processed frames
-        "shape_param_avg": shape_params_avg,
-        "shape_param_fit": {},
-        "shape_param_frames": shapes
+        "num_frames": num_frames,  # Adjusting to the number of processed frames
+        "shape_param_avg": [],
+        "shape_param_fit": {}
     }
 
     pose_data = {
@@ -138,12 +295,13 @@ def main():
             ["// --- pose_parameters: R = rotations"],
             ["// -----------------------------------------------"]
         ],
-        "num_frames": len(pkl_files),  # Adjusting to the number of processed frames
-        "pose_parameters": poses
+        "num_frames": num_frames  # Adjusting to the number of processed frames
     }
 
-    save_json(pose_data, "Frameset_SMPL_Pose.json")
-    save_json(shape_data, "Frameset_SMPL_Shape.json")
+    save_frameset(frames, index_mapping, bone_parents, pose_data, shape_data,
+                  "Frameset_SMPL_Pose.json", "Frameset_SMPL_Shape.json",
+                  indent=None if args.compact else 3, precision=args.precision,
+                  sidecar_path="Frameset_SMPL_Pose.bin" if args.binary else None)
 
 if __name__ == "__main__":
     main()
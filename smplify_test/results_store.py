@@ -0,0 +1,294 @@
+"""
+Sequence-level store of fit results.
+
+Instead of one `.pkl` per frame, the parameters of every fit of a sequence
+are kept in one folder of preallocated `.npy` columns, one row per frame:
+
+    <store>/meta.json         first frame, number of rows, column shapes
+    <store>/cam_t.npy         (N, 3)
+    <store>/f.npy             (N, 2)
+    <store>/pose.npy          (N, 72)
+    <store>/betas.npy         (N, 10)
+    <store>/joints.npy        (N, 24, 3) joints in the model frame
+    <store>/j2d_err.npy       (N,) mean 2D reprojection error, NaN if unknown
+    <store>/valid.npy         (N,) FITTED once the row of the frame is complete,
+                              FILLED for rows interpolated from their neighbours
+
+Row i holds frame first_frame + i, so reading a frame is an index into
+memory-mapped arrays. Writers open the columns read-write and only touch the
+rows of their own frames, several processes can append concurrently; the
+valid flag is written after the row has been flushed.
+
+    python results_store.py Seq1/USB_Sync_Left_store "Seq1/USB_Sync_Left_*.pkl"
+imports existing per-frame pickles into a store.
+"""
+
+from collections import OrderedDict
+from os.path import exists, join
+import os
+import re
+import json
+import shutil
+import logging
+
+import numpy as np
+
+_LOGGER = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+
+# values of the valid column
+FITTED = 1
+FILLED = 2
+
+# column -> (shape of one row, dtype)
+COLUMNS = OrderedDict([
+    ('cam_t', ((3, ), 'float64')),
+    ('f', ((2, ), 'float64')),
+    ('pose', ((72, ), 'float64')),
+    ('betas', ((10, ), 'float64')),
+    ('joints', ((24, 3), 'float64')),
+    ('j2d_err', ((), 'float64')),
+])
+
+
+def _read_meta(path):
+    meta_path = join(path, 'meta.json')
+    if not exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def _create(path, first_frame, n_frames):
+    """Write an empty store (NaN rows, no valid frame) into path."""
+    os.makedirs(path)
+    for name, (shape, dtype) in COLUMNS.items():
+        column = np.lib.format.open_memmap(
+            join(path, name + '.npy'), mode='w+', dtype=dtype, shape=(n_frames, ) + shape)
+        column[:] = np.nan
+        column.flush()
+        del column
+    valid = np.lib.format.open_memmap(
+        join(path, 'valid.npy'), mode='w+', dtype=np.uint8, shape=(n_frames, ))
+    valid.flush()
+    del valid
+    meta = {'version': STORE_VERSION,
+            'first_frame': first_frame,
+            'n_frames': n_frames,
+            'columns': dict((name, [list(shape), dtype])
+                            for name, (shape, dtype) in COLUMNS.items())}
+    with open(join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+class ResultStore(object):
+    """Memory-mapped per-frame fit results of a sequence."""
+
+    def __init__(self, path, mode='r'):
+        """Open an existing store.
+        :param path: store folder
+        :param mode: 'r' to read, 'r+' to append
+        """
+        meta = _read_meta(path)
+        if meta is None:
+            raise IOError('no result store at `%s`' % path)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError('`%s` has store version %s, expected %d'
+                             % (path, meta['version'], STORE_VERSION))
+        self.path = path
+        self.mode = mode
+        self.first_frame = meta['first_frame']
+        self.n_frames = meta['n_frames']
+        self.columns = OrderedDict(
+            (name, np.load(join(path, name + '.npy'), mmap_mode=mode)) for name in COLUMNS)
+        self.valid = np.load(join(path, 'valid.npy'), mmap_mode=mode)
+
+    @classmethod
+    def open_or_create(cls, path, first_frame, last_frame):
+        """Open a store for appending, creating or extending it to cover a frame range.
+        Extending copies the store and must not run while other processes append to it.
+        :param path: store folder
+        :param first_frame: first frame index (inclusive)
+        :param last_frame: last frame index (inclusive)
+        """
+        meta = _read_meta(path)
+        if meta is not None:
+            old_last = meta['first_frame'] + meta['n_frames'] - 1
+            if meta['first_frame'] <= first_frame and last_frame <= old_last:
+                return cls(path, 'r+')
+            first_frame = min(first_frame, meta['first_frame'])
+            last_frame = max(last_frame, old_last)
+
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        if exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        _create(tmp_path, first_frame, last_frame - first_frame + 1)
+        if meta is not None:
+            old = cls(path, 'r')
+            new = cls(tmp_path, 'r+')
+            frames = old.frames()
+            new.write_rows(frames, dict((name, old.column(name, frames)) for name in COLUMNS),
+                           old.flags(frames))
+            new.flush()
+            _LOGGER.info('Extending `%s` to frames [%d, %d].', path, first_frame, last_frame)
+            shutil.rmtree(path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # created meanwhile by another process
+            shutil.rmtree(tmp_path)
+            return cls.open_or_create(path, first_frame, last_frame)
+        return cls(path, 'r+')
+
+    def row(self, frame_idx):
+        """Row of a frame, raises IndexError outside the store."""
+        row = frame_idx - self.first_frame
+        if row < 0 or row >= self.n_frames:
+            raise IndexError('frame %d is outside the store [%d, %d]'
+                             % (frame_idx, self.first_frame, self.first_frame + self.n_frames - 1))
+        return row
+
+    def __contains__(self, frame_idx):
+        row = frame_idx - self.first_frame
+        return 0 <= row < self.n_frames and bool(self.valid[row])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.valid))
+
+    def frames(self):
+        """Indices of the stored frames, in order."""
+        return np.flatnonzero(self.valid) + self.first_frame
+
+    def filled_frames(self):
+        """Indices of the stored frames that were interpolated, not fitted."""
+        return np.flatnonzero(np.asarray(self.valid) == FILLED) + self.first_frame
+
+    def flags(self, frames):
+        """valid values (FITTED or FILLED) of stored frames."""
+        return np.array([self.valid[self.row(i)] for i in frames], dtype=np.uint8)
+
+    def items(self, start_frame=None, end_frame=None):
+        """Yield (frame index, parameters) of the stored frames in order, as the
+        per-frame `.pkl` files would be read (see get).
+        :param start_frame: first frame index (inclusive), None for the first stored frame
+        :param end_frame: last frame index (inclusive), None for the last stored frame
+        """
+        for frame_idx in self.frames():
+            frame_idx = int(frame_idx)
+            if start_frame is not None and frame_idx < start_frame:
+                continue
+            if end_frame is not None and frame_idx > end_frame:
+                break
+            yield frame_idx, self.get(frame_idx)
+
+    def append(self, frame_idx, params):
+        """Store the fit of a frame, replacing a previous one.
+        :param frame_idx: frame index
+        :param params: fit parameters as written to the `.pkl` files (cam_t, f, pose,
+                       betas, optional joints and j2d_err)
+        """
+        self.write_rows([frame_idx], dict((name, [params[name]]) for name in COLUMNS
+                                          if params.get(name) is not None))
+
+    def write_rows(self, frame_ids, values, flag=FITTED):
+        """Store the fits of several frames.
+        :param frame_ids: F frame indices
+        :param values: dict column -> F rows, missing columns are left NaN
+        :param flag: FITTED, FILLED or F of them, the valid value of the rows
+        """
+        rows = np.array([self.row(i) for i in frame_ids], dtype=np.int64)
+        self.valid[rows] = 0
+        for name, column in self.columns.items():
+            shape = COLUMNS[name][0]
+            if name in values:
+                value = np.asarray(values[name], dtype=np.float64).reshape((len(rows), -1))
+                n = min(value.shape[1], int(np.prod(shape)))
+                flat = np.full((len(rows), int(np.prod(shape))), np.nan)
+                flat[:, :n] = value[:, :n]
+                if name == 'betas':
+                    # fewer fitted betas leave the others at zero
+                    flat[:, n:] = 0.
+                column[rows] = flat.reshape((len(rows), ) + shape)
+            else:
+                column[rows] = np.nan
+        self.flush()
+        self.valid[rows] = flag
+        self.valid.flush()
+
+    def get(self, frame_idx):
+        """Parameters of a stored frame, as the dict of its `.pkl`."""
+        if frame_idx not in self:
+            raise KeyError('frame %d is not in `%s`' % (frame_idx, self.path))
+        row = self.row(frame_idx)
+        return dict((name, np.array(column[row])) for name, column in self.columns.items())
+
+    def column(self, name, frames=None):
+        """Rows of one column.
+        :param name: column name (see COLUMNS)
+        :param frames: frame indices, default all stored frames
+        :returns: (F, ...) array
+        """
+        if frames is None:
+            frames = self.frames()
+        rows = np.array([self.row(i) for i in frames], dtype=np.int64)
+        return np.array(self.columns[name][rows])
+
+    def flush(self):
+        if self.mode != 'r':
+            for column in self.columns.values():
+                column.flush()
+
+
+def frame_index_of(path):
+    """Frame index of a per-frame result path: the first number of its file name,
+    e.g. USB_Sync_Left_700.pkl or f_2100_4_output_smplify.pkl.
+    """
+    match = re.search(r'\d+', os.path.basename(path))
+    if match is None:
+        raise ValueError('no frame index in `%s`' % path)
+    return int(match.group())
+
+
+def import_pickles(store_path, pkl_paths, index_fn=frame_index_of):
+    """Append per-frame result pickles to a store.
+    :param store_path: store folder, created or extended to the frames of the pickles
+    :param pkl_paths: `.pkl` result files
+    :param index_fn: function mapping a pickle path to its frame index
+    :returns: the store
+    """
+    import cPickle as pickle
+
+    frames = dict((index_fn(path), path) for path in pkl_paths)
+    if not frames:
+        raise ValueError('no result pickles to import')
+    store = ResultStore.open_or_create(store_path, min(frames), max(frames))
+    frame_ids = sorted(frames)
+    values = dict((name, []) for name in COLUMNS)
+    for i in frame_ids:
+        with open(frames[i], 'rb') as f:
+            params = pickle.load(f)
+        for name, (shape, _) in COLUMNS.items():
+            size = int(np.prod(shape))
+            row = np.full(size, np.nan)
+            if params.get(name) is not None:
+                value = np.ravel(params[name])[:size]
+                row[:len(value)] = value
+                if name == 'betas':
+                    row[len(value):] = 0.
+            values[name].append(row)
+    store.write_rows(frame_ids, values)
+    return store
+
+
+if __name__ == '__main__':
+    import argparse
+    from glob import glob
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='import per-frame result pickles into a result store')
+    parser.add_argument('store_path', help="store folder")
+    parser.add_argument('pkl_pattern', help="glob of the result pickles, e.g. 'Seq1/USB_Sync_Left_*.pkl'")
+    args = parser.parse_args()
+    store = import_pickles(args.store_path, glob(args.pkl_pattern))
+    _LOGGER.info('`%s` holds %d frames.', args.store_path, len(store))
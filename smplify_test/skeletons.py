@@ -0,0 +1,106 @@
+"""
+Joint orders of the skeletons used by the scripts and the mappings between them.
+
+Every skeleton is a list of joint names from one vocabulary. The mapping from
+a source to a target skeleton is an index array into the source joints (and a
+mask of the target joints the source has), computed once per pair from the
+names, so whole (F, J, C) arrays are remapped with one fancy-indexing call:
+
+    joints, conf = skeletons.remap_joints_conf(joints_orig, conf_orig, 'openpose25', 'lsp14')
+
+Joints the source lacks are filled (zeros by default) and reported by the mask.
+"""
+
+import numpy as np
+
+SKELETONS = {
+    # OpenPose BODY_25, the KIST framesets
+    'openpose25': [
+        'nose', 'neck', 'rshoulder', 'relbow', 'rwrist', 'lshoulder', 'lelbow',
+        'lwrist', 'midhip', 'rhip', 'rknee', 'rankle', 'lhip', 'lknee', 'lankle',
+        'reye', 'leye', 'rear', 'lear', 'lbigtoe', 'lsmalltoe', 'lheel',
+        'rbigtoe', 'rsmalltoe', 'rheel'],
+    # OpenPose COCO, the deeprobot 2D detections
+    'coco18': [
+        'nose', 'neck', 'rshoulder', 'relbow', 'rwrist', 'lshoulder', 'lelbow',
+        'lwrist', 'rhip', 'rknee', 'rankle', 'lhip', 'lknee', 'lankle',
+        'reye', 'leye', 'rear', 'lear'],
+    # LSP, the 2D joints SMPLify fits
+    'lsp14': [
+        'rankle', 'rknee', 'rhip', 'lhip', 'lknee', 'lankle', 'rwrist', 'relbow',
+        'rshoulder', 'lshoulder', 'lelbow', 'lwrist', 'neck', 'headtop'],
+    # SMPL joints
+    'smpl24': [
+        'pelvis', 'lhip', 'rhip', 'spine1', 'lknee', 'rknee', 'spine2', 'lankle',
+        'rankle', 'spine3', 'lfoot', 'rfoot', 'neck', 'lcollar', 'rcollar', 'head',
+        'lshoulder', 'rshoulder', 'lelbow', 'relbow', 'lwrist', 'rwrist', 'lhand',
+        'rhand'],
+    # deeprobot 3D joints
+    'deeprobot13': [
+        'neck', 'lshoulder', 'rshoulder', 'lhip', 'rhip', 'lelbow', 'relbow',
+        'lknee', 'rknee', 'lwrist', 'rwrist', 'lankle', 'rankle'],
+}
+
+# (source, target) -> {target joint: source joint} for joints filled with a stand-in
+ALIASES = {
+    # the LSP head top is taken from the nose
+    ('openpose25', 'lsp14'): {'headtop': 'nose'},
+    ('coco18', 'lsp14'): {'headtop': 'nose'},
+}
+
+# (source, target) -> {target joint: source joint} applied on top of ALIASES to the
+# confidences only (remap_joints_conf)
+CONF_ALIASES = {
+    # the KIST fits have always weighted the LSP left ankle with the MidHip confidence
+    ('openpose25', 'lsp14'): {'lankle': 'midhip'},
+}
+
+_MAPS = {}
+
+
+def joint_map(source, target, conf=False):
+    """Index array of a skeleton mapping.
+    :param source: source skeleton name (see SKELETONS)
+    :param target: target skeleton name
+    :param conf: boolean, if True the mapping of the confidences (with CONF_ALIASES)
+    :returns: a tuple (index, mask): index[k] is the source joint of target joint k
+              (0 where mask[k] is False, the target joint is missing in the source)
+    """
+    key = (source, target, conf)
+    if key not in _MAPS:
+        source_ids = dict((name, i) for i, name in enumerate(SKELETONS[source]))
+        aliases = dict(ALIASES.get((source, target), {}))
+        if conf:
+            aliases.update(CONF_ALIASES.get((source, target), {}))
+        names = [aliases.get(name, name) for name in SKELETONS[target]]
+        mask = np.array([name in source_ids for name in names])
+        index = np.array([source_ids.get(name, 0) for name in names], dtype=np.intp)
+        index.setflags(write=False)
+        mask.setflags(write=False)
+        _MAPS[key] = (index, mask)
+    return _MAPS[key]
+
+
+def remap(values, source, target, axis=-2, fill=0., conf=False):
+    """Reorder the joint axis of an array from one skeleton to another.
+    :param values: array with the source joints along axis, e.g. (F, J, C) joints
+                   (axis=-2) or (F, J) confidences (axis=-1)
+    :param axis: joint axis of values
+    :param fill: value of the joints missing in the source
+    :param conf: boolean, if True values are confidences (see CONF_ALIASES)
+    :returns: array with the target joints along axis
+    """
+    index, mask = joint_map(source, target, conf)
+    values = np.moveaxis(np.asarray(values), axis, 0)
+    out = values[index]
+    if not mask.all():
+        out[~mask] = fill
+    return np.moveaxis(out, 0, axis)
+
+
+def remap_joints_conf(joints, conf, source, target):
+    """Remap 2D/3D joints (..., J, C) and their confidences (..., J) together.
+    :returns: a tuple (joints, conf) in the target order, missing joints have zero confidence
+    """
+    return (remap(joints, source, target, axis=-2),
+            remap(conf, source, target, axis=-1, conf=True))